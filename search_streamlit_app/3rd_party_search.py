@@ -7,17 +7,24 @@ from data_processing import (
     process_dataframe
 )
 from gpt_scoring import gpt_rerank_results
+from performance_table import load_performance_table
 from ui_components import render_search_interface, render_results
 
-from config import VERTICALS
+from config import VERTICALS, NON_US_FILTER_PUSHDOWN, PERFORMANCE_TABLE_PATH
+
+@st.cache_resource
+def get_performance_table():
+    return load_performance_table(PERFORMANCE_TABLE_PATH)
 
 def search_and_rank_segments(query: str, vertical: str, presearch_filter: dict = {}, top_k: int = 250) -> pd.DataFrame:
+    if NON_US_FILTER_PUSHDOWN:
+        presearch_filter = {**presearch_filter, 'is_non_us': {'$ne': True}}
     query_embedding = generate_embedding(query)
     query_results = query_pinecone(query_embedding, top_k, presearch_filter)
     df = results_to_dataframe(query_results)
     
     # Initial processing without relevance score
-    df = process_dataframe(df, query, vertical)
+    df = process_dataframe(df, query, vertical, get_performance_table())
     
     # Generate relevance scores
     segment_descriptions = df['Segment Description'].tolist()
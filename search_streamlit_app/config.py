@@ -1,10 +1,27 @@
+import os
 import streamlit as st
 
 EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 256
+EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings")
+EMBEDDING_CACHE_CAPACITY = 50000
 OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
 OPEN_ROUTER_KEY = st.secrets["OPEN_ROUTER_KEY"]
 PINECONE_API_KEY = st.secrets["PINECONE_API_KEY"]
 PINECONE_INDEX_NAME = "3rd-party-data-v2"
+SERVICE_BASE_URL = os.environ.get("SERVICE_BASE_URL") # Address of smart_audience_gen/prod/src/mock_services.py for load testing, None for the real APIs
+OPENAI_BASE_URL = f"{SERVICE_BASE_URL}/openai/v1" if SERVICE_BASE_URL else None
+OPEN_ROUTER_BASE_URL = f"{SERVICE_BASE_URL}/openrouter/v1" if SERVICE_BASE_URL else "https://openrouter.ai/api/v1"
+PINECONE_INDEX_HOST = f"{SERVICE_BASE_URL}/pinecone/{PINECONE_INDEX_NAME}" if SERVICE_BASE_URL else ""
+NON_US_FILTER_PUSHDOWN = False # Exclude is_non_us segments inside the vector query (tag with smart_audience_gen/prod/src/tag_non_us.py first)
+VECTOR_BACKEND = "pinecone" # 'pinecone' or 'local' (snapshot written by smart_audience_gen/prod/src/index_snapshot.py)
+RERANK_MODE = "pointwise" # 'pointwise' (one LLM call per segment) or 'listwise' (RERANK_BATCH_SIZE segments per call)
+RERANK_BATCH_SIZE = 20
+SCORE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "scores.sqlite")
+SCORE_CACHE_TTL_DAYS = 30
+SCORE_CACHE_MAX_ENTRIES = 2000000
+PERFORMANCE_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "segment_performance.arrow") # Built by smart_audience_gen/prod/src/export_performance_table.py
+LOCAL_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "segment_index")
 
 NON_US_COUNTRIES = [
     "afghanistan", "albania", "algeria", "andorra", "angola", "antigua and barbuda", "argentina", "armenia", "australia", "austria", "azerbaijan",
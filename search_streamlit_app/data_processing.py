@@ -6,6 +6,34 @@ import re
 import numpy as np
 from config import NON_US_LOCATIONS
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Declared schema of the segment index metadata. Text fields are never JSON-decoded,
+# other string fields are only decoded when they hold a JSON object, and columns with
+# these suffixes are converted to floats up front.
+SEGMENT_TEXT_FIELDS = frozenset(['id', 'Name', 'BrandName', 'raw_string', 'Description', 'FullPath'])
+SEGMENT_FLOAT_SUFFIXES = ('_ctr', '_cpa', '_cpm', '_Amount')
+
+SEGMENT_COLUMN_MAPPING = {
+    'Name': 'Segment Name',
+    'BrandName': 'Brand Name',
+    'raw_string': 'Segment Description',
+    'relevance_score': 'Relevance Score',
+    'UniqueUserCount': 'Unique User Count',
+    'CPMRateInAdvertiserCurrency_Amount': 'CPM Rate'
+}
+
+# Compiled once at import. Locations are de-duplicated and longest-first so multi-word names win.
+NON_US_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(map(re.escape, sorted({location.lower() for location in NON_US_LOCATIONS}, key=len, reverse=True))) + r')\b',
+    re.IGNORECASE
+)
+NON_US_COLUMNS = ['Segment Name', 'Segment Description', 'Brand Name', 'Segment ID'] # Columns searched for non-US locations
+
 def calculate_z_scores(df, vertical):
     # Overall Z-scores
     df['Overall CTR Z-score'] = (df['Overall CTR'] - df['Overall CTR'].mean()) / df['Overall CTR'].std()
@@ -31,6 +59,16 @@ def calculate_normalized_scores(df, vertical):
 
     return df
 
+def apply_performance_table(df, vertical, performance_table):
+    """Fill z-scores and normalized scores from the catalogue-wide table instead of per-query statistics."""
+    for label, key in [('Overall', 'overall'), (vertical, vertical.lower())]:
+        scores = performance_table.lookup(df['Segment ID'], key)
+        df[f'{label} CTR Z-score'] = scores['ctr_z_score'].to_numpy()
+        df[f'{label} CPA Z-score'] = scores['cpa_z_score'].to_numpy()
+        df[f'{label} Score'] = df[f'{label} CTR Z-score'] - df[f'{label} CPA Z-score']
+        df[f'{label} Normalized Score'] = scores['normalized_score'].to_numpy()
+    return df
+
 def flatten_dict(d: Dict[str, Any], parent_key: str = '', sep: str = '_') -> Dict[str, Any]:
     items = []
     for k, v in d.items():
@@ -43,52 +81,48 @@ def flatten_dict(d: Dict[str, Any], parent_key: str = '', sep: str = '_') -> Dic
             items.append((new_key, v))
     return dict(items)
 
-def process_metadata(flattened_metadata: Dict[str, Any]) -> Dict[str, Any]:
-    processed_metadata = {}
-    for key, value in flattened_metadata.items():
+def decode_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten one match's metadata, JSON-decoding only fields that hold encoded objects."""
+    decoded = {}
+    for key, value in metadata.items():
         if isinstance(value, str):
-            try:
-                parsed_value = json.loads(value)
+            if key not in SEGMENT_TEXT_FIELDS and value[:1] == '{':
+                try:
+                    parsed_value = json_loads(value)
+                except ValueError:
+                    parsed_value = None
                 if isinstance(parsed_value, dict):
-                    processed_metadata.update(flatten_dict(parsed_value, parent_key=key))
-                else:
-                    processed_metadata[key] = value
-            except json.JSONDecodeError:
-                processed_metadata[key] = value
+                    decoded.update(flatten_dict(parsed_value, parent_key=key))
+                    continue
+            decoded[key] = value
+        elif isinstance(value, dict):
+            decoded.update(decode_metadata(flatten_dict(value, parent_key=key)))
+        elif isinstance(value, list):
+            decoded[key] = json.dumps(value)
         else:
-            processed_metadata[key] = value
-    return processed_metadata
+            decoded[key] = value
+    return decoded
 
 def results_to_dataframe(results: Dict[str, Any]) -> pd.DataFrame:
-    data = []
-    for match in results.get('matches', []):
-        row = {
-            'Segment ID': match['id'],
-            'similarity_score': match['score']
-        }
-        
-        metadata = match.get('metadata', {})
-        flattened_metadata = flatten_dict(metadata)
-        
-        processed_metadata = process_metadata(flattened_metadata)
-        
-        column_mapping = {
-            'Name': 'Segment Name',
-            'BrandName': 'Brand Name',
-            'raw_string': 'Segment Description',
-            'relevance_score': 'Relevance Score',
-            'UniqueUserCount': 'Unique User Count',
-            'CPMRateInAdvertiserCurrency_Amount': 'CPM Rate'
-        }
-        
-        for old_name, new_name in column_mapping.items():
-            if old_name in processed_metadata:
-                processed_metadata[new_name] = processed_metadata.pop(old_name)
-        
-        row.update(processed_metadata)
-        data.append(row)
-    
-    df = pd.DataFrame(data)
+    matches = results.get('matches', [])
+    num_matches = len(matches)
+
+    # Build columns directly instead of a list of row dicts
+    columns: Dict[str, List[Any]] = {'Segment ID': [None] * num_matches, 'similarity_score': [None] * num_matches}
+    for i, match in enumerate(matches):
+        columns['Segment ID'][i] = match['id']
+        columns['similarity_score'][i] = match['score']
+        for key, value in decode_metadata(match.get('metadata') or {}).items():
+            key = SEGMENT_COLUMN_MAPPING.get(key, key)
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * num_matches
+            column[i] = value
+
+    df = pd.DataFrame(columns)
+    for column in df.columns:
+        if column.endswith(SEGMENT_FLOAT_SUFFIXES) or column == 'CPM Rate':
+            df[column] = pd.to_numeric(df[column], errors='coerce')
     return df
 
 def add_metrics_columns(df: pd.DataFrame, vertical: str) -> pd.DataFrame:
@@ -113,19 +147,24 @@ def add_metrics_columns(df: pd.DataFrame, vertical: str) -> pd.DataFrame:
     
     return df
 
+def non_us_mask(df: pd.DataFrame) -> pd.Series:
+    """Flag rows mentioning a non-US location, trusting precomputed catalogue flags where present."""
+    if 'is_non_us' in df.columns:
+        untagged = df['is_non_us'].isna()
+        mask = df['is_non_us'].where(~untagged, False).astype(bool)
+    else:
+        untagged = pd.Series(True, index=df.index)
+        mask = pd.Series(False, index=df.index)
+    if untagged.any():
+        rows = df.loc[untagged, NON_US_COLUMNS].astype(str)
+        concatenated = rows[NON_US_COLUMNS[0]]
+        for column in NON_US_COLUMNS[1:]:
+            concatenated = concatenated + ' ' + rows[column]
+        mask[untagged] = concatenated.str.contains(NON_US_PATTERN).to_numpy()
+    return mask
+
 def filter_non_us(df: pd.DataFrame) -> pd.DataFrame:
-    # Compile the pattern once
-    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, NON_US_LOCATIONS)) + r')\b', re.IGNORECASE)
-    
-    # Concatenate relevant columns only
-    relevant_columns = ['Segment Name', 'Segment Description', 'Brand Name', 'Segment ID']
-    df['concatenated'] = df[relevant_columns].astype(str).agg(' '.join, axis=1)
-    
-    # Use vectorized operations
-    mask = ~df['concatenated'].str.contains(pattern, regex=True)
-    
-    # Apply the mask and drop the temporary column
-    filtered_df = df[mask].drop(columns=['concatenated'])
+    filtered_df = df[~non_us_mask(df)]
     
     print(f"Filtered out {len(df) - len(filtered_df)} non-US locations")
     
@@ -134,11 +173,14 @@ def filter_non_us(df: pd.DataFrame) -> pd.DataFrame:
 def filter_duplicates(df: pd.DataFrame) -> pd.DataFrame:
     return df.drop_duplicates(subset=['Segment Description', 'Segment Name'], keep='first')
 
-def process_dataframe(df: pd.DataFrame, query: str, vertical: str) -> pd.DataFrame:
+def process_dataframe(df: pd.DataFrame, query: str, vertical: str, performance_table=None) -> pd.DataFrame:
     df = filter_non_us(df)
     df = df.sort_values('CPM Rate', ascending=True)
     df = filter_duplicates(df)
     df = add_metrics_columns(df, vertical)
-    df = calculate_z_scores(df, vertical)
-    df = calculate_normalized_scores(df, vertical)
+    if performance_table is not None:
+        df = apply_performance_table(df, vertical, performance_table)
+    else:
+        df = calculate_z_scores(df, vertical)
+        df = calculate_normalized_scores(df, vertical)
     return df
\ No newline at end of file
@@ -1,14 +1,26 @@
 from openai import OpenAI
-from config import OPENAI_API_KEY, EMBEDDING_MODEL
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_CAPACITY
+from embedding_cache import EmbeddingCache
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_CACHE_CAPACITY)
+
+def generate_embeddings(texts: list[str]) -> list[list[float]]:
+    """Generate embeddings for the given texts in one request, skipping cached texts."""
+    embeddings = {text: embedding_cache.get(text) for text in set(texts)}
+    missing = [text for text, embedding in embeddings.items() if embedding is None]
+    if missing:
+        response = client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=missing,
+            encoding_format="float",
+            dimensions=EMBEDDING_DIMENSIONS
+        )
+        new_embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        embedding_cache.put_many(missing, new_embeddings)
+        embeddings.update(zip(missing, new_embeddings))
+    return [embeddings[text] for text in texts]
 
 def generate_embedding(text: str) -> list[float]:
     """Generate an embedding for the given text."""
-    response = client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=[text],
-        encoding_format="float",
-        dimensions=256
-    )
-    return response.data[0].embedding
\ No newline at end of file
+    return generate_embeddings([text])[0]
@@ -1,38 +1,56 @@
 from openai import OpenAI
 import re
-from typing import List, Dict
+import json
+from typing import List, Dict, Optional
 import concurrent.futures
-from config import OPENAI_API_KEY, NON_US_LOCATIONS, OPEN_ROUTER_KEY
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPEN_ROUTER_BASE_URL, NON_US_LOCATIONS, OPEN_ROUTER_KEY, SCORE_CACHE_PATH, SCORE_CACHE_TTL_DAYS, SCORE_CACHE_MAX_ENTRIES, RERANK_MODE, RERANK_BATCH_SIZE
+from score_cache import ScoreCache
 import pandas as pd
 import tenacity
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+score_cache = ScoreCache(SCORE_CACHE_PATH, SCORE_CACHE_TTL_DAYS * 24 * 60 * 60, SCORE_CACHE_MAX_ENTRIES)
+
+RERANKER_MODEL = "gpt-4o-mini-2024-07-18"
+
+RERANK_PROMPT = """On a scale of 0 to 100, how effective would the data segment be for targeting the user's desired audience?
+
+    Desired audience: "{query}"
+
+    Data segment: "{doc}"
+
+    Provide only a numeric score between 0 and 100, where 0 is not effective at all and 100 is extremely effective.
+    """
+
+BATCH_RERANK_PROMPT = """On a scale of 0 to 100, how effective would each numbered data segment be for targeting the user's desired audience?
+
+    Desired audience: "{query}"
+
+    Data segments:
+    {docs}
+
+    Score every segment independently, where 0 is not effective at all and 100 is extremely effective. Respond only with JSON in this form, with one entry per segment id:
+    {{"scores": [{{"id": 1, "score": 0}}, {{"id": 2, "score": 0}}]}}
+    """
 
 open_router_client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
+  base_url=OPEN_ROUTER_BASE_URL,
   api_key=OPEN_ROUTER_KEY,
 )
 
 
 
 @tenacity.retry(stop=tenacity.stop_after_attempt(6), wait=tenacity.wait_exponential(multiplier=1, min=4, max=60))
-def gpt_score_relevance(query: str, doc: str) -> float:
+def request_relevance_score(query: str, doc: str) -> Optional[float]:
     """
     Score the relevance of a document to the query using GPT-3.5.
-    Returns a relevance score between 0 and 1.
+    Returns a relevance score between 0 and 1, or None if the response has no score.
     """
 
-    prompt = f"""On a scale of 0 to 100, how effective would the data segment be for targeting the user's desired audience?
-
-    Desired audience: "{query}"
-
-    Data segment: "{doc}"
-
-    Provide only a numeric score between 0 and 100, where 0 is not effective at all and 100 is extremely effective.
-    """
+    prompt = RERANK_PROMPT.format(query=query, doc=doc)
 
     response = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
+        model=RERANKER_MODEL,
         messages=[{"role": "user", "content": prompt}],
         max_tokens=100,
         temperature=0
@@ -51,12 +69,89 @@ def gpt_score_relevance(query: str, doc: str) -> float:
             raise ValueError("No number found in response")
     except ValueError as e:
         print(f"Error parsing score for document: {doc[:50]}... Error: {str(e)}")
-        return 0
+        return None
+
+def gpt_score_relevance(query: str, doc: str) -> float:
+    """
+    Score the relevance of a document to the query, reusing cached scores when available.
+    Returns a relevance score between 0 and 1.
+    """
+    key = ScoreCache.make_key(RERANKER_MODEL, RERANK_PROMPT, query, doc)
+    cached_score = score_cache.get(key)
+    if cached_score is not None:
+        return cached_score
+
+    score = request_relevance_score(query, doc)
+    if score is None:
+        return 0 # Irrelevant for this run only; an unparseable reply is never cached
+    score_cache.put(key, score)
+    return score
+
+def parse_batch_scores(result: str, num_docs: int) -> Dict[int, float]:
+    """Parse the JSON score list from a listwise rerank response, keyed by 1-based segment id."""
+    match = re.search(r'\{[\s\S]*\}', result)
+    try:
+        items = json.loads(match.group()).get('scores', []) if match else []
+    except (json.JSONDecodeError, AttributeError):
+        items = []
+
+    scores = {}
+    for item in items:
+        try:
+            doc_id = int(item['id'])
+            score = float(item['score']) / 100
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 1 <= doc_id <= num_docs:
+            scores[doc_id] = max(0, min(score, 1))
+    return scores
+
+@tenacity.retry(stop=tenacity.stop_after_attempt(3), wait=tenacity.wait_exponential(multiplier=1, min=4, max=60))
+def request_batch_relevance_scores(query: str, docs: List[str]) -> Dict[int, float]:
+    """Score several documents against the query in a single LLM call."""
+    numbered_docs = "\n    ".join(f'{doc_id}. "{doc}"' for doc_id, doc in enumerate(docs, 1))
+    prompt = BATCH_RERANK_PROMPT.format(query=query, docs=numbered_docs)
+
+    response = client.chat.completions.create(
+        model=RERANKER_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=50 + 20 * len(docs),
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+
+    return parse_batch_scores(response.choices[0].message.content, len(docs))
+
+def gpt_score_relevance_batch(query: str, docs: List[str]) -> Dict[str, float]:
+    """
+    Score a batch of documents with one listwise prompt.
+    Documents the model leaves out of its score list are scored individually.
+    """
+    keys = {doc: ScoreCache.make_key(RERANKER_MODEL, BATCH_RERANK_PROMPT, query, doc) for doc in docs}
+    scores = {doc: score_cache.get(key) for doc, key in keys.items()}
+    missing = [doc for doc, score in scores.items() if score is None]
+
+    if missing:
+        try:
+            batch_scores = request_batch_relevance_scores(query, missing)
+        except tenacity.RetryError as e:
+            print(f"Listwise rerank failed, falling back to per-item scoring. Error: {str(e)}")
+            batch_scores = {}
+        for doc_id, doc in enumerate(missing, 1):
+            if doc_id in batch_scores:
+                scores[doc] = batch_scores[doc_id]
+                score_cache.put(keys[doc], scores[doc])
+
+    for doc, score in scores.items():
+        if score is None:
+            scores[doc] = gpt_score_relevance(query, doc)
+    return scores
 
 def gpt_rerank_results(query: str, docs: List[str], max_workers: int = 10) -> Dict[str, float]:
     """
     Rerank documents by scoring each document's relevance to the query using GPT-3.5.
     Uses concurrent.futures to parallelize the scoring process.
+    In listwise mode each worker scores RERANK_BATCH_SIZE documents per call.
     Keeps track of total input tokens.
     """
     total_tokens = 0
@@ -66,11 +161,24 @@ def gpt_rerank_results(query: str, docs: List[str], max_workers: int = 10) -> Di
         total_tokens += len(query.split()) + len(doc.split())
         return doc, gpt_score_relevance(query, doc)
 
+    def score_batch(batch):
+        nonlocal total_tokens
+        total_tokens += len(query.split()) + sum(len(doc.split()) for doc in batch)
+        return gpt_score_relevance_batch(query, batch)
+
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        scores = dict(executor.map(score_doc, docs))
+        if RERANK_MODE == 'listwise':
+            unique_docs = list(dict.fromkeys(docs))
+            batches = [unique_docs[i:i + RERANK_BATCH_SIZE] for i in range(0, len(unique_docs), RERANK_BATCH_SIZE)]
+            scores = {}
+            for batch_scores in executor.map(score_batch, batches):
+                scores.update(batch_scores)
+        else:
+            scores = dict(executor.map(score_doc, docs))
     
     # Calculate and print the number *1000000/50
     token_cost = (total_tokens / 1000000) * 0.15
     print(f"Estimated rerank cost: ${token_cost:.6f}")
+    score_cache.flush_stats()
     
     return scores
\ No newline at end of file
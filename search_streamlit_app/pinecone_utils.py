@@ -1,9 +1,13 @@
 from pinecone import Pinecone
-from config import PINECONE_API_KEY, PINECONE_INDEX_NAME
+from config import PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_INDEX_HOST, VECTOR_BACKEND, LOCAL_INDEX_DIR
+from local_index import LocalSegmentIndex
 from typing import List, Dict, Any
 
 pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
+index = pc.Index(PINECONE_INDEX_NAME, host=PINECONE_INDEX_HOST)
+
+if VECTOR_BACKEND == 'local':
+    index = LocalSegmentIndex(LOCAL_INDEX_DIR)
 
 def query_pinecone(query_embedding: List[float], top_k: int, presearch_filter: Dict[str, Any] = {}) -> Dict[str, Any]:
     """Query Pinecone index with the given embedding."""
@@ -13,4 +17,4 @@ def query_pinecone(query_embedding: List[float], top_k: int, presearch_filter: D
         top_k=top_k,
         include_metadata=True
     )
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ScoreCache:
+    """
+    Durable SQLite cache of reranker relevance scores.
+
+    Entries are keyed by (reranker model, prompt template hash, query, doc hash),
+    expire after ttl_seconds and are trimmed least-recently-used first once the
+    table grows past max_entries. Hit and miss counts are totalled in the same file, so
+    stats() covers every process sharing it.
+    """
+
+    EVICT_EVERY = 500 # Writes between eviction passes
+    STATS_FLUSH_EVERY = 100 # Lookups counted in memory before being added to the stored totals
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores "
+                "(key TEXT PRIMARY KEY, score REAL NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scores_accessed_at ON scores (accessed_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @staticmethod
+    def make_key(model: str, prompt_template: str, query: str, doc: str) -> str:
+        return _sha256(json.dumps([model, _sha256(prompt_template), query, _sha256(doc)]))
+
+    def get(self, key: str) -> Optional[float]:
+        """Return a fresh cached score, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score FROM scores WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                with self._conn:
+                    self._conn.execute("UPDATE scores SET accessed_at = ? WHERE key = ?", (now, key))
+                self._pending_hits += 1
+            else:
+                self._pending_misses += 1
+            if self._pending_hits + self._pending_misses >= self.STATS_FLUSH_EVERY:
+                self._flush_stats()
+        return row[0] if row is not None else None
+
+    def put(self, key: str, score: float):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scores (key, score, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, score, now, now)
+                )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        with self._conn:
+            self._conn.execute("DELETE FROM scores WHERE created_at < ?", (now - self.ttl_seconds,))
+            count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def _flush_stats(self):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                [('hits', self._pending_hits), ('misses', self._pending_misses)]
+            )
+        self._pending_hits = self._pending_misses = 0
+
+    def flush_stats(self):
+        """Add this process's uncounted lookups to the stored totals."""
+        with self._lock:
+            self._flush_stats()
+
+    def stats(self) -> Dict[str, float]:
+        """Hits, misses and hit rate over every lookup since the cache file was created."""
+        with self._lock:
+            self._flush_stats()
+            totals = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+        hits, misses = totals.get('hits', 0), totals.get('misses', 0)
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0}
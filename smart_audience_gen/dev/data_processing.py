@@ -1,7 +1,19 @@
 import pandas as pd
 import json
 import re
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Declared schema of the segment index metadata. Text fields are never JSON-decoded,
+# other string fields are only decoded when they hold a JSON object, and columns with
+# these suffixes are converted to floats up front.
+SEGMENT_TEXT_FIELDS = frozenset(['id', 'Name', 'BrandName', 'raw_string', 'Description', 'FullPath'])
+SEGMENT_FLOAT_SUFFIXES = ('_ctr', '_cpa', '_cpm', '_Amount')
 
 def extract_and_correct_json(text):
     # Try to find JSON content enclosed in triple backticks first
@@ -59,37 +71,45 @@ def flatten_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def results_to_dataframe(results):
-    data = []
-    for match in results.get('matches', []):  # Access 'matches' key from results dictionary
-        row = {
-            'id': match['id'],
-            'vector_score': match['score']
-        }
-        
-        # Handle metadata
-        metadata = match.get('metadata', {})
-        flattened_metadata = flatten_dict(metadata)
-        
-        # Create a new dictionary to store processed values
-        processed_metadata = {}
-        
-        # Handle potential JSON strings in metadata
-        for key, value in flattened_metadata.items():
-            if isinstance(value, str):
+def decode_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten one match's metadata, JSON-decoding only fields that hold encoded objects."""
+    decoded = {}
+    for key, value in metadata.items():
+        if isinstance(value, str):
+            if key not in SEGMENT_TEXT_FIELDS and value[:1] == '{':
                 try:
-                    parsed_value = json.loads(value)
-                    if isinstance(parsed_value, dict):
-                        processed_metadata.update(flatten_dict(parsed_value, parent_key=key))
-                    else:
-                        processed_metadata[key] = value
-                except json.JSONDecodeError:
-                    processed_metadata[key] = value
-            else:
-                processed_metadata[key] = value
-        
-        row.update(processed_metadata)
-        data.append(row)
-    
-    df = pd.DataFrame(data)
+                    parsed_value = json_loads(value)
+                except ValueError:
+                    parsed_value = None
+                if isinstance(parsed_value, dict):
+                    decoded.update(flatten_dict(parsed_value, parent_key=key))
+                    continue
+            decoded[key] = value
+        elif isinstance(value, dict):
+            decoded.update(decode_metadata(flatten_dict(value, parent_key=key)))
+        elif isinstance(value, list):
+            decoded[key] = json.dumps(value)
+        else:
+            decoded[key] = value
+    return decoded
+
+def results_to_dataframe(results):
+    matches = results.get('matches', [])  # Access 'matches' key from results dictionary
+    num_matches = len(matches)
+
+    # Build columns directly instead of a list of row dicts
+    columns: Dict[str, List[Any]] = {'id': [None] * num_matches, 'vector_score': [None] * num_matches}
+    for i, match in enumerate(matches):
+        columns['id'][i] = match['id']
+        columns['vector_score'][i] = match['score']
+        for key, value in decode_metadata(match.get('metadata') or {}).items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * num_matches
+            column[i] = value
+
+    df = pd.DataFrame(columns)
+    for column in df.columns:
+        if column.endswith(SEGMENT_FLOAT_SUFFIXES):
+            df[column] = pd.to_numeric(df[column], errors='coerce')
     return df
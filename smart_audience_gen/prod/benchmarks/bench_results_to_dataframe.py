@@ -0,0 +1,72 @@
+"""
+Compare the schema-driven results_to_dataframe with the previous row-by-row implementation.
+
+Run from the prod directory:
+    python -m benchmarks.bench_results_to_dataframe [--matches 300] [--repeat 20]
+"""
+import json
+import random
+import argparse
+import timeit
+import pandas as pd
+from src.data_processing import flatten_dict, results_to_dataframe
+
+VERTICAL_KEYS = ['overall', 'retail', 'finance', 'automotive', 'qsr', 'healthcare']
+
+def legacy_results_to_dataframe(results):
+    """The previous implementation: flatten every match and try json.loads on every string."""
+    data = []
+    for match in results.get('matches', []):
+        row = {
+            'id': match['id'],
+            'vector_score': match['score']
+        }
+        metadata = match.get('metadata', {})
+        flattened_metadata = flatten_dict(metadata)
+        processed_metadata = {}
+        for key, value in flattened_metadata.items():
+            if isinstance(value, str):
+                try:
+                    parsed_value = json.loads(value)
+                    if isinstance(parsed_value, dict):
+                        processed_metadata.update(flatten_dict(parsed_value, parent_key=key))
+                    else:
+                        processed_metadata[key] = value
+                except json.JSONDecodeError:
+                    processed_metadata[key] = value
+            else:
+                processed_metadata[key] = value
+        row.update(processed_metadata)
+        data.append(row)
+    return pd.DataFrame(data)
+
+def make_results(num_matches: int, seed: int = 0) -> dict:
+    """Synthetic query results shaped like the 3rd-party-data-v2 metadata."""
+    rng = random.Random(seed)
+    matches = []
+    for i in range(num_matches):
+        metadata = {
+            'Name': f"Segment {i}",
+            'BrandName': rng.choice(['Data Alliance', 'Acxiom', 'Experian', 'Oracle']),
+            'raw_string': f"Full Path: Category > Subcategory > Segment {i}, Description: Audience segment number {i}",
+            'UniqueUserCount': rng.randint(1000, 10000000),
+            'CPMRateInAdvertiserCurrency': json.dumps({'Amount': round(rng.uniform(0.5, 3.0), 2), 'CurrencyCode': 'USD'}),
+        }
+        for vertical in VERTICAL_KEYS:
+            metadata[vertical] = json.dumps({'ctr': rng.random() / 100, 'cpa': rng.uniform(1, 100)})
+        matches.append({'id': str(100000 + i), 'score': rng.random(), 'metadata': metadata})
+    return {'matches': matches}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark results_to_dataframe implementations.")
+    parser.add_argument("--matches", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = make_results(args.matches)
+    for name, fn in [('legacy', legacy_results_to_dataframe), ('schema-driven', results_to_dataframe)]:
+        best = min(timeit.repeat(lambda: fn(results), number=1, repeat=args.repeat))
+        print(f"{name:>14}: {best * 1000:.2f} ms per {args.matches} matches")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Benchmark the search pipeline offline against recorded API responses.
+
+Record fixtures once with live keys, then replay them anywhere with simulated latency
+and rate limiting. Run from the prod directory:
+    python -m benchmarks.bench_search record --target process_audience_segments
+    python -m benchmarks.bench_search replay --target process_audience_segments --repeat 5
+    python -m benchmarks.bench_search replay --target find_relevant_segments --chat-ms 400 \\
+        --rate-limit-rate 0.05 --set SEARCH_MODE=pipelined --set RERANK_WAVE_SIZE=5
+
+search_and_rank_segments benchmarks search_streamlit_app instead. Replays must use the
+same prompts, models and audiences as the recording, but top_k may be lowered and any
+concurrency setting changed. Caches start empty for each repetition unless --warm-caches.
+"""
+import os
+import sys
+import ast
+import json
+import glob
+import time
+import argparse
+import tempfile
+import importlib
+import threading
+import contextlib
+from typing import Any, Callable, Dict, List
+import numpy as np
+import openai
+import pinecone
+import streamlit as st
+from benchmarks.replay import (
+    FixtureStore, LatencyModel, FaultInjector, CallStats, RecordingOpenAI, RecordingAsyncOpenAI,
+    RecordingIndex, ReplayOpenAI, ReplayAsyncOpenAI, ReplayIndex
+)
+
+PROD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_APP_DIR = os.path.join(os.path.dirname(os.path.dirname(PROD_DIR)), 'search_streamlit_app')
+BENCHMARK_DIR = os.path.join(PROD_DIR, 'benchmarks')
+
+PROD_PIPELINE = {
+    'root': PROD_DIR,
+    'module': 'src.audience_search',
+    'stages': ['generate_embedding', 'generate_embeddings', 'query_pinecone', 'results_to_dataframe', 'filter_non_us', 'rerank_candidates'],
+    'settings': {'TRACE_EXPORT_PATH': None},  # Keep span export IO out of the measurements
+}
+PIPELINES = {
+    'find_relevant_segments': PROD_PIPELINE,
+    'process_audience_segments': PROD_PIPELINE,
+    'search_and_rank_segments': {
+        'root': SEARCH_APP_DIR,
+        'module': '3rd_party_search',
+        'stages': ['generate_embedding', 'query_pinecone', 'results_to_dataframe', 'process_dataframe', 'gpt_rerank_results'],
+        'settings': {},
+    },
+}
+BENCHMARK_EMBEDDING_CAPACITY = 10000 # Rows in the per-run embedding cache, far more than one benchmark embeds
+API_COUNTERS = ('embedding_requests', 'embedded_texts', 'pinecone_queries', 'chat', 'injected_429')
+
+class PlaceholderSecrets(dict):
+    """Stands in for st.secrets when replaying without a secrets file."""
+
+    def __missing__(self, key):
+        return 'replay'
+
+class StageTimer:
+    """Wall and CPU time of every call to a wrapped function. CPU time is that of the calling thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: Dict[str, List[tuple]] = {}
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = ((time.perf_counter() - wall_start) * 1000, (time.thread_time() - cpu_start) * 1000)
+                with self._lock:
+                    self.calls.setdefault(name, []).append(elapsed)
+        return timed
+
+def app_modules(root: str) -> List[Any]:
+    """Loaded modules belonging to an app, excluding the benchmarks themselves."""
+    modules = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None) or ''
+        if path.startswith(root + os.sep) and not path.startswith(BENCHMARK_DIR):
+            modules.append(module)
+    return modules
+
+def override_setting(root: str, name: str, value: Any):
+    """Set a setting everywhere it was imported by name, since modules read their own copy."""
+    patched = [module for module in app_modules(root) if hasattr(module, name)]
+    if not patched:
+        raise SystemExit(f"Unknown setting {name}")
+    for module in patched:
+        setattr(module, name, value)
+
+def parse_setting(assignment: str):
+    name, _, value = assignment.partition('=')
+    try:
+        return name.strip(), ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name.strip(), value
+
+def sync_client_types() -> tuple:
+    types = [openai.OpenAI]
+    try:
+        import groq
+        types.append(groq.Groq)
+    except ImportError:
+        pass
+    return tuple(types)
+
+def load_pipeline(target: str, mode: str, store: FixtureStore, latency: LatencyModel, faults: FaultInjector, stats: CallStats):
+    """Import the app with its OpenAI clients and Pinecone index swapped for recording or replaying ones."""
+    pipeline = PIPELINES[target]
+    sys.path.insert(0, pipeline['root'])
+    if mode == 'replay':
+        if not st.secrets.load_if_toml_exists():
+            st.secrets = PlaceholderSecrets()
+        # Resolving an index by name calls the Pinecone API, so the index is replaced before import
+        pinecone.Pinecone.Index = lambda self, *args, **kwargs: ReplayIndex(store, latency, stats)
+
+    module = importlib.import_module(pipeline['module'])
+    replacements = {}
+    for app_module in app_modules(pipeline['root']):
+        for name, value in list(vars(app_module).items()):
+            if isinstance(value, sync_client_types()):
+                if id(value) not in replacements:
+                    replacements[id(value)] = RecordingOpenAI(value, store) if mode == 'record' else ReplayOpenAI(store, latency, faults, stats)
+                setattr(app_module, name, replacements[id(value)])
+            elif mode == 'record' and isinstance(value, pinecone.Index):
+                setattr(app_module, name, RecordingIndex(value, store))
+        if hasattr(app_module, 'get_client') and hasattr(app_module, 'chat_completion_async'):
+            # The async client layer builds one client per provider
+            real_get_client, async_clients = app_module.get_client, {}
+
+            def get_client(provider, real_get_client=real_get_client, async_clients=async_clients):
+                if provider not in async_clients:
+                    async_clients[provider] = RecordingAsyncOpenAI(real_get_client(provider), store) if mode == 'record' else ReplayAsyncOpenAI(store, latency, faults, stats)
+                return async_clients[provider]
+            app_module.get_client = get_client
+    return module
+
+def reset_caches(root: str, cache_dir: str):
+    """Point every embedding and relevance score cache at empty stores under cache_dir."""
+    replacements = {}
+    for module in app_modules(root):
+        for name, value in list(vars(module).items()):
+            cache_type = type(value).__name__
+            if cache_type not in ('EmbeddingCache', 'ScoreCache'):
+                continue
+            if id(value) not in replacements:
+                if cache_type == 'EmbeddingCache':
+                    replacements[id(value)] = type(value)(os.path.join(cache_dir, 'embeddings'), value.model, value.dimensions, BENCHMARK_EMBEDDING_CAPACITY)
+                else:
+                    replacements[id(value)] = type(value)(os.path.join(cache_dir, 'scores.sqlite'), value.ttl_seconds, value.max_entries)
+            setattr(module, name, replacements[id(value)])
+
+def audience_descriptions(audience: Dict) -> List[str]:
+    return list(dict.fromkeys(
+        item['description'] for category in ('included', 'excluded') for items in audience['Audience'][category].values() for item in items
+    ))
+
+def run_target(target: str, module, audience: Dict, args) -> List[float]:
+    """Run the target over one audience, returning the latency in ms of each call."""
+    latencies = []
+    if target == 'process_audience_segments':
+        start = time.perf_counter()
+        module.process_audience_segments(audience, args.filter, args.top_k, args.strategy)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+    for description in audience_descriptions(audience):
+        start = time.perf_counter()
+        if target == 'find_relevant_segments':
+            module.find_relevant_segments(description, args.filter, args.top_k, optimization_strategy=args.strategy)
+        else:
+            module.search_and_rank_segments(description, args.vertical, args.filter, args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'p50': float('nan'), 'p95': float('nan')}
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95))}
+
+def benchmark(args) -> Dict[str, Any]:
+    store = FixtureStore(args.fixtures)
+    stats = CallStats()
+    latency = LatencyModel(args.latency_scale, {'embedding': args.embedding_ms, 'pinecone': args.pinecone_ms, 'chat': args.chat_ms}, args.jitter, args.seed)
+    faults = FaultInjector(args.rate_limit_rate if args.mode == 'replay' else 0.0, args.retry_after, args.seed)
+    if args.mode == 'replay' and not len(store):
+        raise SystemExit(f"No fixtures in {args.fixtures}, record them first")
+
+    pipeline = PIPELINES[args.target]
+    module = load_pipeline(args.target, args.mode, store, latency, faults, stats)
+    for name, value in {**pipeline['settings'], **dict(parse_setting(s) for s in args.set)}.items():
+        override_setting(pipeline['root'], name, value)
+
+    timer = StageTimer()
+    for stage in pipeline['stages']:
+        setattr(module, stage, timer.wrap(stage, getattr(module, stage)))
+
+    audiences = {}
+    for path in sorted(glob.glob(args.audiences)):
+        with open(path) as f:
+            audiences[os.path.basename(path)] = json.load(f)
+    if not audiences:
+        raise SystemExit(f"No audience JSONs match {args.audiences}")
+
+    latencies, descriptions = [], 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    # The pipeline prints per segment, which would swamp the report
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with tempfile.TemporaryDirectory() as cache_root, quiet:
+        for repetition in range(args.repeat):
+            reset_caches(pipeline['root'], os.path.join(cache_root, 'warm' if args.warm_caches else str(repetition)))
+            for name, audience in audiences.items():
+                latencies.extend(run_target(args.target, module, audience, args))
+                descriptions += len(audience_descriptions(audience))
+    wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    stages = {}
+    for stage in pipeline['stages']:
+        calls = timer.calls.get(stage, [])
+        if calls:
+            stages[stage] = {
+                'calls': len(calls),
+                'calls_per_description': len(calls) / descriptions,
+                **percentiles([wall for wall, _ in calls]),
+                'cpu_ms_per_call': sum(cpu for _, cpu in calls) / len(calls),
+            }
+    return {
+        'target': args.target,
+        'mode': args.mode,
+        'audiences': list(audiences),
+        'repeat': args.repeat,
+        'settings': args.set,
+        'descriptions': descriptions,
+        'latency_ms': percentiles(latencies),
+        'descriptions_per_second': descriptions / wall_seconds,
+        'process_cpu_seconds': cpu_seconds,
+        'api_calls_per_description': {name: stats.counts.get(name, 0) / descriptions for name in API_COUNTERS},
+        'stages': stages,
+    }
+
+def print_report(result: Dict[str, Any]):
+    unit = 'audience' if result['target'] == 'process_audience_segments' else 'description'
+    print(f"{result['target']} ({result['mode']}): {result['descriptions']} descriptions from {len(result['audiences'])} audiences x {result['repeat']}")
+    print(f"  per {unit}: p50 {result['latency_ms']['p50']:.1f} ms, p95 {result['latency_ms']['p95']:.1f} ms")
+    print(f"  throughput: {result['descriptions_per_second']:.2f} descriptions/s, process CPU {result['process_cpu_seconds']:.2f} s")
+    print("  API calls per description: " + ", ".join(f"{name} {value:.2f}" for name, value in result['api_calls_per_description'].items()))
+    print(f"  {'stage':<22}{'calls/desc':>11}{'p50 ms':>10}{'p95 ms':>10}{'CPU ms/call':>13}")
+    for stage, row in result['stages'].items():
+        print(f"  {stage:<22}{row['calls_per_description']:>11.2f}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['cpu_ms_per_call']:>13.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search pipeline against recorded API responses.")
+    parser.add_argument("mode", choices=['record', 'replay'])
+    parser.add_argument("--target", choices=list(PIPELINES), default='process_audience_segments')
+    parser.add_argument("--fixtures", default=os.path.join(BENCHMARK_DIR, 'fixtures'))
+    parser.add_argument("--audiences", default=os.path.join(BENCHMARK_DIR, 'audiences', '*.json'), help="Glob of audience JSONs to search")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=300)
+    parser.add_argument("--strategy", choices=['composite', 'ctr', 'cpa'], default='composite')
+    parser.add_argument("--vertical", default='Retail', help="Vertical for search_and_rank_segments")
+    parser.add_argument("--filter", type=json.loads, default={}, help="Presearch filter as JSON")
+    parser.add_argument("--warm-caches", action='store_true', help="Keep embedding and score caches across repetitions")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on recorded latencies")
+    parser.add_argument("--embedding-ms", type=float, help="Fixed embedding latency instead of the recorded one")
+    parser.add_argument("--pinecone-ms", type=float, help="Fixed Pinecone query latency instead of the recorded one")
+    parser.add_argument("--chat-ms", type=float, help="Fixed chat completion latency instead of the recorded one")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform latency jitter as a fraction")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of chat completions answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds on injected 429s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", action='append', default=[], metavar="NAME=VALUE", help="Override a setting, e.g. SEARCH_MODE=pipelined")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action='store_true', help="Show the pipeline's own output")
+    args = parser.parse_args()
+    if args.mode == 'record':
+        args.repeat = 1
+
+    result = benchmark(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Drive many simulated users through a Streamlit app at once, headless, with AppTest.
+
+Every user is an AppTest session in this process, so sessions contend for the same
+interpreter, caches and client pools as they would on one server. Point the app at
+src/mock_services.py to load test without API keys or spend. Run from the prod directory:
+    python -m src.mock_services --port 8750 --chat-latency 0.8 &
+    SERVICE_BASE_URL=http://127.0.0.1:8750 python -m benchmarks.load_test --app prod --users 50 --ramp-up 30
+    SERVICE_BASE_URL=http://127.0.0.1:8750 python -m benchmarks.load_test --app search --users 200 \\
+        --set MAX_RERANK_WORKERS=20
+
+Prod users go through generate, feedback, search (which also writes the report) and
+methodology; search users run one search per iteration. The report gives latency per
+step as the user sees it, time per pipeline stage, and process RSS and thread counts
+sampled throughout the run.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import types
+import random
+import argparse
+import importlib
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from unittest import mock
+import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test
+from streamlit.testing.v1.util import patch_config_options
+from .bench_search import (
+    PROD_DIR, SEARCH_APP_DIR, BENCHMARK_DIR, PlaceholderSecrets, StageTimer,
+    override_setting, parse_setting, audience_descriptions, percentiles
+)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+APPS = {
+    'prod': {
+        'root': PROD_DIR,
+        'script': 'main.py',
+        'steps': ['generate', 'feedback', 'search', 'methodology'],
+        'stages': [
+            ('src.audience_generation', 'generate_audience'),
+            ('src.audience_generation', 'process_user_feedback'),
+            ('src.audience_search', 'process_audience_segments'),
+            ('src.report_generation', 'generate_audience_report'),
+            ('src.researcher', 'generate_segment_summaries'),
+        ],
+        # The stage timers patch this process, so stages must not run in (deduplicated) job workers
+        'settings': {'TRACE_EXPORT_PATH': None, 'USE_BACKGROUND_JOBS': False},
+    },
+    'search': {
+        'root': SEARCH_APP_DIR,
+        'script': '3rd_party_search.py',
+        'steps': ['search'],
+        'stages': [
+            ('embedding', 'generate_embedding'),
+            ('pinecone_utils', 'query_pinecone'),
+            ('data_processing', 'process_dataframe'),
+            ('gpt_scoring', 'gpt_rerank_results'),
+        ],
+        'settings': {},
+    },
+}
+DEFAULT_COMPANIES = ["McDonalds", "Tesla Model 3 launch in Texas", "Chase Sapphire travel credit card"]
+DEFAULT_FEEDBACK = "Add a segment for frequent business travelers"
+SEARCH_VERTICALS = ['Retail', 'Finance', 'Automotive']
+
+def process_resources() -> Tuple[float, int]:
+    """RSS in MB and OS thread count of this process."""
+    if psutil is not None:
+        process = psutil.Process()
+        return process.memory_info().rss / 2**20, process.num_threads()
+    rss, threads = float('nan'), threading.active_count()
+    with open('/proc/self/status') as f:  # Linux without psutil
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+class ResourceSampler:
+    """Samples RSS, thread count and active users on a background thread."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self.active_users = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self._start = time.perf_counter()
+
+    def user_started(self):
+        with self._lock:
+            self.active_users += 1
+
+    def user_finished(self):
+        with self._lock:
+            self.active_users -= 1
+
+    def sample(self):
+        rss, threads = process_resources()
+        self.samples.append({'elapsed_s': time.perf_counter() - self._start, 'rss_mb': rss, 'threads': threads, 'active_users': self.active_users})
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+@contextlib.contextmanager
+def shared_runtime():
+    """
+    AppTest installs a mock Runtime and patches the config for each script run and tears
+    them down afterwards, which breaks any other session still running. Install them once
+    for the whole load test and keep AppTest from touching them.
+    """
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    try:
+        with patch_config_options({'global.appTest': True}), \
+                mock.patch.object(app_test, 'Runtime', types.SimpleNamespace(_instance=None)), \
+                mock.patch.object(app_test, 'patch_config_options', lambda overrides: contextlib.nullcontext()):
+            yield
+    finally:
+        Runtime._instance = None
+
+def widget(elements, label: str):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"No widget labelled {label!r}")
+
+def check(at: AppTest):
+    """Raise if the run ended in an exception or an error message."""
+    problems = [e.value for e in at.exception] + [e.value for e in at.error]
+    if problems:
+        raise RuntimeError(problems[0])
+
+def login(at: AppTest, password: str):
+    at.run()
+    widget(at.text_input, "Enter password:").input(password).run()
+    check(at)
+
+def prod_flow(at: AppTest, user: int, iteration: int, args) -> Iterator[Tuple[str, Callable[[], Any]]]:
+    company = args.companies[(user + iteration) % len(args.companies)]
+
+    def generate():
+        widget(at.text_input, "Enter any company name or brief campaign desription:").input(company)
+        widget(at.button, "Generate Audience").click().run()
+
+    yield 'generate', generate
+    yield 'feedback', lambda: widget(at.text_input, "Provide feedback on the audience segments:").input(args.feedback).run()
+    yield 'search', lambda: widget(at.button, "Search Actual Segments").click().run()
+    yield 'methodology', lambda: widget(at.button, "Generate Methodology Report").click().run()
+
+def search_flow(at: AppTest, user: int, iteration: int, args) -> Iterator[Tuple[str, Callable[[], Any]]]:
+    query = args.queries[(user * args.iterations + iteration) % len(args.queries)]
+
+    def search():
+        at.selectbox[0].select(SEARCH_VERTICALS[user % len(SEARCH_VERTICALS)])
+        widget(at.text_input, "Describe the audience segment you are looking for in a few words.").input(query)
+        widget(at.button, "Search").click().run()
+
+    yield 'search', search
+
+FLOWS = {'prod': prod_flow, 'search': search_flow}
+
+def simulate_user(user: int, args, script: str, sampler: ResourceSampler, results: List[Dict[str, Any]], results_lock: threading.Lock):
+    rng = random.Random(args.seed + user)
+    time.sleep(args.ramp_up * user / args.users)
+    sampler.user_started()
+    try:
+        for iteration in range(args.iterations):
+            # A fresh AppTest per iteration is a new browser session
+            at = AppTest.from_file(script, default_timeout=args.timeout)
+            try:
+                login(at, args.password)
+            except Exception as e:
+                with results_lock:
+                    results.append({'user': user, 'iteration': iteration, 'step': 'login', 'ms': 0, 'ok': False, 'error': str(e)})
+                continue
+            for step, action in FLOWS[args.app](at, user, iteration, args):
+                time.sleep(rng.uniform(0.5, 1.5) * args.think)
+                start = time.perf_counter()
+                error = None
+                try:
+                    action()
+                    check(at)
+                except Exception as e:
+                    error = str(e)
+                elapsed = (time.perf_counter() - start) * 1000
+                with results_lock:
+                    results.append({'user': user, 'iteration': iteration, 'step': step, 'ms': elapsed, 'ok': error is None, 'error': error})
+                if error is not None:
+                    break  # Later steps depend on this one
+    finally:
+        sampler.user_finished()
+
+def load_app(app: Dict[str, Any]):
+    """Import the app's modules in this process so the sessions share them, as on a server."""
+    sys.path.insert(0, app['root'])
+    if not st.secrets.load_if_toml_exists():
+        st.secrets = PlaceholderSecrets()
+    for module_name, _ in app['stages']:
+        importlib.import_module(module_name)
+
+def load_test(args) -> Dict[str, Any]:
+    app = APPS[args.app]
+    load_app(app)
+    args.password = st.secrets["app_password"]
+    for name, value in {**app['settings'], **dict(parse_setting(s) for s in args.set)}.items():
+        override_setting(app['root'], name, value)
+
+    # The script imports these by name on every rerun, so it picks up the timed versions
+    timer = StageTimer()
+    for module_name, function_name in app['stages']:
+        module = sys.modules[module_name]
+        setattr(module, function_name, timer.wrap(function_name, getattr(module, function_name)))
+
+    results: List[Dict[str, Any]] = []
+    results_lock = threading.Lock()
+    script = os.path.join(app['root'], app['script'])
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    # The apps print per segment, which would swamp the report
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with shared_runtime(), quiet, ResourceSampler(args.sample_interval) as sampler:
+        with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix='user') as executor:
+            futures = [executor.submit(simulate_user, user, args, script, sampler, results, results_lock) for user in range(args.users)]
+            for future in futures:
+                future.result()
+    wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    steps = {}
+    for step in ['login'] + app['steps']:
+        rows = [r for r in results if r['step'] == step]
+        if rows:
+            ok = [r['ms'] for r in rows if r['ok']]
+            steps[step] = {'runs': len(rows), 'errors': len(rows) - len(ok), **percentiles(ok), 'max': max(ok, default=float('nan'))}
+    stages = {}
+    for _, function_name in app['stages']:
+        calls = timer.calls.get(function_name, [])
+        if calls:
+            stages[function_name] = {'calls': len(calls), **percentiles([wall for wall, _ in calls]), 'cpu_ms_per_call': sum(cpu for _, cpu in calls) / len(calls)}
+    samples = sampler.samples
+    return {
+        'app': args.app,
+        'users': args.users,
+        'iterations': args.iterations,
+        'ramp_up_s': args.ramp_up,
+        'think_s': args.think,
+        'settings': args.set,
+        'service_base_url': os.environ.get('SERVICE_BASE_URL'),
+        'wall_seconds': wall_seconds,
+        'process_cpu_seconds': cpu_seconds,
+        'completed_flows': sum(1 for r in results if r['step'] == app['steps'][-1] and r['ok']),
+        'steps': steps,
+        'stages': stages,
+        'rss_mb': {'start': samples[0]['rss_mb'], 'peak': max(s['rss_mb'] for s in samples), 'end': samples[-1]['rss_mb']},
+        'threads': {'start': samples[0]['threads'], 'peak': max(s['threads'] for s in samples), 'end': samples[-1]['threads']},
+        'errors': sorted({r['error'] for r in results if r['error']})[:20],
+        'samples': samples,
+    }
+
+def print_report(result: Dict[str, Any]):
+    print(f"{result['app']}: {result['users']} users x {result['iterations']} iterations, ramp-up {result['ramp_up_s']:.0f} s, think {result['think_s']:.1f} s")
+    print(f"  {result['completed_flows']} complete flows in {result['wall_seconds']:.1f} s, process CPU {result['process_cpu_seconds']:.1f} s")
+    print(f"  RSS MB: start {result['rss_mb']['start']:.0f}, peak {result['rss_mb']['peak']:.0f}, end {result['rss_mb']['end']:.0f}")
+    print(f"  threads: start {result['threads']['start']}, peak {result['threads']['peak']}, end {result['threads']['end']}")
+    print(f"  {'step':<22}{'runs':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for step, row in result['steps'].items():
+        print(f"  {step:<22}{row['runs']:>7}{row['errors']:>8}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['max']:>10.0f}")
+    print(f"  {'stage':<28}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'CPU ms/call':>13}")
+    for stage, row in result['stages'].items():
+        print(f"  {stage:<28}{row['calls']:>7}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['cpu_ms_per_call']:>13.1f}")
+    for error in result['errors']:
+        print(f"  error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Streamlit app with concurrent simulated users.")
+    parser.add_argument("--app", choices=list(APPS), default='prod')
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=1, help="Sessions each user runs, one after another")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which users start")
+    parser.add_argument("--think", type=float, default=2.0, help="Mean pause between a user's steps in seconds")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds before a script run counts as failed")
+    parser.add_argument("--companies", nargs='+', default=DEFAULT_COMPANIES, help="Company names prod users generate audiences for")
+    parser.add_argument("--feedback", default=DEFAULT_FEEDBACK, help="Feedback prod users give on the audience")
+    parser.add_argument("--audiences", default=os.path.join(BENCHMARK_DIR, 'audiences', '*.json'), help="Glob of audience JSONs whose descriptions search users query")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between RSS and thread samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", action='append', default=[], metavar="NAME=VALUE", help="Override a setting, e.g. MAX_RERANK_WORKERS=20")
+    parser.add_argument("--output", help="Also write the results, with every resource sample, to this JSON file")
+    parser.add_argument("--verbose", action='store_true', help="Show the app's own output")
+    args = parser.parse_args()
+
+    args.queries = []
+    for path in sorted(glob.glob(args.audiences)):
+        with open(path) as f:
+            args.queries.extend(audience_descriptions(json.load(f)))
+    if args.app == 'search' and not args.queries:
+        raise SystemExit(f"No audience JSONs match {args.audiences}")
+
+    result = load_test(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+Record and replay the external calls made by the search pipeline.
+
+Recording wraps the real OpenAI clients and Pinecone index and appends every response,
+with its latency, to JSON lines fixtures. Replay serves those responses from fake
+clients with the same interface, sleeping for a simulated latency and optionally
+answering chat completions with injected 429s, so the pipeline's batching, retries and
+rate limiting behave as they would against the live services.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+import numpy as np
+import openai
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion
+
+QUERY_MATCH_SIMILARITY = 0.999 # Min cosine similarity for a replayed query to reuse a recorded one
+CHAT_KEY_FIELDS = ('model', 'messages', 'max_tokens', 'temperature', 'response_format') # Request fields that identify a chat completion
+
+class MissingFixture(KeyError):
+    """A replayed request was never recorded."""
+
+def chat_key(request: Dict[str, Any]) -> str:
+    fields = {field: request.get(field) for field in CHAT_KEY_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+def filter_key(presearch_filter: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(presearch_filter or {}, sort_keys=True)
+
+def match_to_dict(match) -> Dict[str, Any]:
+    if isinstance(match, dict):
+        return {'id': match['id'], 'score': match['score'], 'metadata': match.get('metadata') or {}}
+    return {'id': match.id, 'score': match.score, 'metadata': dict(match.metadata or {})}
+
+class FixtureStore:
+    """Recorded embeddings, vector queries and chat completions under one directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._embeddings: Dict[Tuple[str, int, str], Tuple[List[float], float]] = {}
+        self._chats: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._queries: Dict[str, List[Dict[str, Any]]] = {}
+        self._query_vectors: Dict[str, np.ndarray] = {}
+        for record in self._read('embeddings.jsonl'):
+            self._embeddings[(record['model'], record['dimensions'], record['text'])] = (record['embedding'], record['latency_ms'])
+        for record in self._read('chat.jsonl'):
+            self._chats[record['key']] = (record['response'], record['latency_ms'])
+        for record in self._read('queries.jsonl'):
+            self._add_query(record)
+
+    def __len__(self) -> int:
+        return len(self._embeddings) + len(self._chats) + sum(len(queries) for queries in self._queries.values())
+
+    def _read(self, name: str) -> List[Dict[str, Any]]:
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _append(self, name: str, record: Dict[str, Any]):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def _add_query(self, record: Dict[str, Any]):
+        key = filter_key(record['filter'])
+        vector = np.asarray(record['vector'], dtype=np.float32)
+        self._queries.setdefault(key, []).append(record)
+        vectors = self._query_vectors.get(key)
+        row = (vector / np.linalg.norm(vector))[None, :]
+        self._query_vectors[key] = row if vectors is None else np.vstack([vectors, row])
+
+    def record_embedding(self, model: str, dimensions: int, text: str, embedding: List[float], latency_ms: float):
+        with self._lock:
+            self._embeddings[(model, dimensions, text)] = (embedding, latency_ms)
+            self._append('embeddings.jsonl', {'model': model, 'dimensions': dimensions, 'text': text, 'embedding': embedding, 'latency_ms': latency_ms})
+
+    def embedding(self, model: str, dimensions: int, text: str) -> Tuple[List[float], float]:
+        try:
+            return self._embeddings[(model, dimensions, text)]
+        except KeyError:
+            raise MissingFixture(f"No recorded {model} embedding for {text[:80]!r}") from None
+
+    def record_chat(self, request: Dict[str, Any], response: Dict[str, Any], latency_ms: float):
+        key = chat_key(request)
+        with self._lock:
+            self._chats[key] = (response, latency_ms)
+            self._append('chat.jsonl', {'key': key, 'model': request.get('model'), 'response': response, 'latency_ms': latency_ms})
+
+    def chat(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        try:
+            return self._chats[chat_key(request)]
+        except KeyError:
+            prompt = json.dumps(request.get('messages'))[:120]
+            raise MissingFixture(f"No recorded {request.get('model')} completion for {prompt}") from None
+
+    def record_query(self, vector: List[float], presearch_filter: Dict[str, Any], top_k: int, matches: List[Dict[str, Any]], latency_ms: float):
+        record = {'filter': presearch_filter or {}, 'top_k': top_k, 'vector': list(vector), 'matches': matches, 'latency_ms': latency_ms}
+        with self._lock:
+            self._add_query(record)
+            self._append('queries.jsonl', record)
+
+    def query(self, vector: List[float], presearch_filter: Dict[str, Any], top_k: int) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        The recorded matches for the nearest recorded query vector with the same filter.
+        Vectors are matched by similarity since cached embeddings round-trip through float32.
+        Matches are sorted by score, so a recording with a larger top_k serves smaller ones.
+        """
+        key = filter_key(presearch_filter)
+        vectors = self._query_vectors.get(key)
+        if vectors is not None:
+            query = np.asarray(vector, dtype=np.float32)
+            similarities = vectors @ (query / np.linalg.norm(query))
+            candidates = [i for i in np.argsort(-similarities) if similarities[i] >= QUERY_MATCH_SIMILARITY]
+            for i in candidates:
+                record = self._queries[key][i]
+                if record['top_k'] >= top_k:
+                    return record['matches'][:top_k], record['latency_ms']
+        raise MissingFixture(f"No recorded query with filter {key} and top_k >= {top_k}")
+
+class LatencyModel:
+    """
+    Simulated service latency: the recorded latency times scale, or a fixed latency per
+    service, with uniform jitter of +/- jitter as a fraction.
+    """
+
+    def __init__(self, scale: float = 1.0, fixed_ms: Optional[Dict[str, float]] = None, jitter: float = 0.0, seed: int = 0):
+        self.scale = scale
+        self.fixed_ms = {service: ms for service, ms in (fixed_ms or {}).items() if ms is not None}
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def seconds(self, service: str, recorded_ms: float) -> float:
+        base_ms = self.fixed_ms.get(service, recorded_ms * self.scale)
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+        return max(base_ms * factor, 0) / 1000
+
+class FaultInjector:
+    """Answer a fraction of chat completions with a 429 carrying a retry-after header."""
+
+    def __init__(self, rate_limit_rate: float = 0.0, retry_after: float = 1.0, seed: int = 0):
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def maybe_throttle(self, stats: 'CallStats'):
+        with self._lock:
+            throttle = self._rng.random() < self.rate_limit_rate
+        if throttle:
+            stats.increment('injected_429')
+            response = httpx.Response(
+                429,
+                headers={'retry-after': str(self.retry_after)},
+                request=httpx.Request('POST', 'https://replay.invalid/chat/completions')
+            )
+            raise openai.RateLimitError("Injected rate limit", response=response, body=None)
+
+class CallStats:
+    """Thread-safe counters of calls made to each fake service."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+class _RawResponse:
+    """The parts of openai's raw response used by the async client layer."""
+
+    def __init__(self, completion: ChatCompletion, headers: Dict[str, str]):
+        self.headers = headers
+        self._completion = completion
+
+    def parse(self) -> ChatCompletion:
+        return self._completion
+
+class RecordingOpenAI:
+    """Sync OpenAI-compatible client that forwards to a real client and records responses."""
+
+    def __init__(self, client, store: FixtureStore):
+        self._client = client
+        self._store = store
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    def _create_chat(self, **request):
+        start = time.perf_counter()
+        response = self._client.chat.completions.create(**request)
+        self._store.record_chat(request, response.model_dump(), (time.perf_counter() - start) * 1000)
+        return response
+
+    def _create_embeddings(self, **request):
+        start = time.perf_counter()
+        response = self._client.embeddings.create(**request)
+        latency_ms = (time.perf_counter() - start) * 1000
+        for item in response.data:
+            self._store.record_embedding(request['model'], request.get('dimensions'), request['input'][item.index], item.embedding, latency_ms)
+        return response
+
+class RecordingAsyncOpenAI:
+    """Async counterpart of RecordingOpenAI for the raw-response calls made by src.async_clients."""
+
+    def __init__(self, client, store: FixtureStore):
+        self._client = client
+        self._store = store
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self._create_chat_raw)))
+
+    async def _create_chat_raw(self, **request):
+        start = time.perf_counter()
+        raw_response = await self._client.chat.completions.with_raw_response.create(**request)
+        self._store.record_chat(request, raw_response.parse().model_dump(), (time.perf_counter() - start) * 1000)
+        return raw_response
+
+class RecordingIndex:
+    """Pinecone index wrapper that records query results."""
+
+    def __init__(self, index, store: FixtureStore):
+        self._index = index
+        self._store = store
+
+    def query(self, vector, filter=None, top_k=10, include_metadata=True, **kwargs):
+        start = time.perf_counter()
+        results = self._index.query(vector=vector, filter=filter, top_k=top_k, include_metadata=include_metadata, **kwargs)
+        matches = [match_to_dict(match) for match in results['matches']]
+        self._store.record_query(vector, filter, top_k, matches, (time.perf_counter() - start) * 1000)
+        return results
+
+class ReplayOpenAI:
+    """Sync OpenAI-compatible client answering from fixtures."""
+
+    def __init__(self, store: FixtureStore, latency: LatencyModel, faults: FaultInjector, stats: CallStats):
+        self._store = store
+        self._latency = latency
+        self._faults = faults
+        self._stats = stats
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    def _create_chat(self, **request):
+        self._stats.increment('chat')
+        response, latency_ms = self._store.chat(request)
+        self._faults.maybe_throttle(self._stats)
+        time.sleep(self._latency.seconds('chat', latency_ms))
+        return ChatCompletion.model_validate(response)
+
+    def _create_embeddings(self, **request):
+        self._stats.increment('embedding_requests')
+        self._stats.increment('embedded_texts', len(request['input']))
+        recorded = [self._store.embedding(request['model'], request.get('dimensions'), text) for text in request['input']]
+        time.sleep(self._latency.seconds('embedding', max(latency_ms for _, latency_ms in recorded)))
+        return CreateEmbeddingResponse.model_validate({
+            'object': 'list',
+            'model': request['model'],
+            'data': [{'object': 'embedding', 'index': i, 'embedding': embedding} for i, (embedding, _) in enumerate(recorded)],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+        })
+
+class ReplayAsyncOpenAI(ReplayOpenAI):
+    """Async counterpart of ReplayOpenAI for the raw-response calls made by src.async_clients."""
+
+    def __init__(self, store: FixtureStore, latency: LatencyModel, faults: FaultInjector, stats: CallStats):
+        super().__init__(store, latency, faults, stats)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self._create_chat_raw)))
+
+    async def _create_chat_raw(self, **request):
+        self._stats.increment('chat')
+        response, latency_ms = self._store.chat(request)
+        self._faults.maybe_throttle(self._stats)
+        await asyncio.sleep(self._latency.seconds('chat', latency_ms))
+        return _RawResponse(ChatCompletion.model_validate(response), {})
+
+class ReplayIndex:
+    """Pinecone index answering from fixtures."""
+
+    def __init__(self, store: FixtureStore, latency: LatencyModel, stats: CallStats):
+        self._store = store
+        self._latency = latency
+        self._stats = stats
+
+    def query(self, vector, filter=None, top_k=10, include_metadata=True, **kwargs):
+        self._stats.increment('pinecone_queries')
+        matches, latency_ms = self._store.query(vector, filter, top_k)
+        time.sleep(self._latency.seconds('pinecone', latency_ms))
+        return {'matches': matches}
@@ -130,6 +130,17 @@ Data segment: "{doc}"
 Provide only a numeric score between 0 and 100, where 0 is not effective at all and 100 is extremely effective.
 """
 
+BATCH_RERANK_PROMPT = """On a scale of 0 to 100, how effective would each numbered data segment be for targeting the user's desired audience?
+
+Desired audience: "{query}"
+
+Data segments:
+{docs}
+
+Score every segment independently, where 0 is not effective at all and 100 is extremely effective. Respond only with JSON in this form, with one entry per segment id:
+{{"scores": [{{"id": 1, "score": 0}}, {{"id": 2, "score": 0}}]}}
+"""
+
 ### researcher prompts
 
 INITIAL_RESEARCH_PROMPT = "Answer this question: how does {domain} collect {data_type} data that it sells to advertisers?"
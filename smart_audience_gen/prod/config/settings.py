@@ -1,9 +1,12 @@
+import os
 import streamlit as st
 
 # Constants
 EMBEDDING_MODEL = "text-embedding-3-large" # Embedding model used to create vectors to search pinecone
+EMBEDDING_DIMENSIONS = 256 # Dimensions of the pinecone index vectors
 PINECONE_INDEX_NAME = "3rd-party-data-v2" # Pinecone index name
 PINECONE_CACHE_INDEX = "researcher-cache" # Pinecone cache index name
+VECTOR_BACKEND = "pinecone" # 'pinecone' or 'local' (serve segment queries from the local snapshot)
 ONLINE_MODEL = "perplexity/llama-3.1-sonar-large-128k-online" # Online model used for company research
 OFFLINE_MODEL = "perplexity/llama-3.1-sonar-large-128k-chat" # Offline model used for company research
 OPENAI_MODEL = "gpt-4o-2024-05-13" # OpenAI model used for audience generation
@@ -15,13 +18,89 @@ API_SELECTOR = 'openai' # 'openai' or 'groq' or 'open_router'
 
 # Parameters
 MAX_RERANK_WORKERS = 10 # Max concurrency for search reranking
+RERANK_MODE = 'pointwise' # 'pointwise' (one LLM call per segment) or 'listwise' (RERANK_BATCH_SIZE segments per call)
+RERANK_BATCH_SIZE = 20 # Segments scored per LLM call in 'listwise' mode
+RERANK_WAVE_SIZE = 10 # Segments scored concurrently per wave in 'pointwise' mode
+RERANK_BUDGET = 60 # Max segments reranked per description before giving up on the primary threshold
+RERANK_VECTOR_WEIGHT = 0.5 # Weight of vector score vs optimization score when ordering segments for reranking
+SEARCH_MODE = 'pipelined' # 'pipelined' (embed all, query all, stream into reranking) or 'per_description'
+SEARCH_WORKERS = 5 # Max descriptions searched concurrently in 'per_description' mode
+QUERY_STAGE_WORKERS = 10 # Max concurrent pinecone queries in 'pipelined' mode
+RERANK_STAGE_WORKERS = 5 # Max descriptions reranked concurrently in 'pipelined' mode
+PINECONE_POOL_THREADS = 10 # Size of the connection pool shared by pinecone queries
 RELEVANCE_THRESHOLD = .9 # Relevance threshold for search reranking
 SECONDARY_RELEVANCE_THRESHOLD = .85 # Secondary relevance threshold for search reranking
 RERANK_TOP_K = 3 
 FALLBACK_TOP_K = 0
 PINECONE_TOP_K = 300
+RESEARCH_WORKERS = 5 # Max broker/data type groups researched concurrently for the methodology report
+STATE_HISTORY_DEPTH = 20 # Number of state updates that can be undone
+NON_US_FILTER_PUSHDOWN = False # Exclude is_non_us segments inside the vector query (run src/tag_non_us.py first)
 CONTEXT_LENGTH_START = 2 # Number of messages to pass from beginning of conversation
-CONTEXT_LENGTH_END = 8 # Number of messages to pass from end of conversation
+CONTEXT_TOKEN_BUDGET = 16000 # Max prompt tokens sent per call; older middle turns are summarized to fit
+MODEL_CONTEXT_BUDGETS = {GROQ_MODEL: 6000} # Per-model overrides of CONTEXT_TOKEN_BUDGET
+CONTEXT_SUMMARY_TOKENS = 800 # Tokens reserved for the summary of omitted turns
+STREAM_RESPONSES = True # Stream audience generation, feedback and report responses into the UI as they are generated
+USE_ASYNC_CLIENTS = True # Route LLM calls through the shared asyncio client layer instead of per-thread blocking clients
+ASYNC_MAX_CONNECTIONS = 100 # Keep-alive connection pool size shared by all async clients
+PROVIDER_CONCURRENCY = {'openai': 50, 'open_router': 20, 'groq': 10, 'perplexity': 10} # Max in-flight requests per provider
+ASYNC_MAX_RETRIES = 4 # Attempts per async API call
+ASYNC_RETRY_BASE_DELAY = 1 # Seconds, doubled per attempt with full jitter
+ASYNC_RETRY_MAX_DELAY = 30 # Upper bound on a single async retry delay
+RATE_LIMITS = { # Requests and tokens per minute per provider; concurrency adapts (AIMD) below PROVIDER_CONCURRENCY
+    'openai': {'rpm': 5000, 'tpm': 800000},
+    'open_router': {'rpm': 500, 'tpm': 1000000},
+    'groq': {'rpm': 30, 'tpm': 6000},
+    'perplexity': {'rpm': 50, 'tpm': 1000000},
+}
+MODEL_RATE_LIMITS = { # Per-model overrides of RATE_LIMITS
+    RERANKER_MODEL: {'rpm': 10000, 'tpm': 10000000},
+}
+EMBEDDING_BATCH_SIZE = 64 # Max texts sent in a single embedding request
+EMBEDDING_BATCH_WINDOW = 0.02 # Seconds to wait for concurrent embedding requests to coalesce
+TRACING_ENABLED = True # Record spans for embedding, search, reranking and LLM calls
+TRACE_CONSOLE = False # Log every finished span
+TRACE_OPENTELEMETRY = False # Mirror spans to the OpenTelemetry SDK when it is installed and configured
+TRACE_HISTORY = 50 # Finished traces kept in memory for the debug panel
+USE_BACKGROUND_JOBS = True # Run search, report and methodology in worker processes that survive reruns, instead of in the script run
+JOB_WORKERS = 2 # Worker processes running background jobs
+JOB_POLL_INTERVAL = 1.0 # Seconds between reruns while the UI waits on a background job
+JOB_RESULT_TTL_HOURS = 24 # Age after which a finished job's result is recomputed rather than shared
+
+PERFORMANCE_VERTICALS = [ # Verticals scored in the performance table, in addition to 'overall'
+    'Government', 'Healthcare', 'Retail', 'Energy', 'Arts, Entertainment, and Recreation',
+    'Hospitality and Tourism', 'Education', 'Computer & Electronics', 'CPG', 'Transportation and Logistics',
+    'Pharmaceuticals and Biotechnology', 'Finance', 'Agriculture', 'Professional Services', 'QSR',
+    'Automotive', 'Nonprofit and Social Services', 'Real Estate', 'Telecommunications',
+    'Media and Entertainment', 'Construction', 'Technology'
+]
+
+# Local caches
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache") # Root directory for on-disk caches
+EMBEDDING_CACHE_DIR = os.path.join(CACHE_DIR, "embeddings") # Memory-mapped embedding cache
+EMBEDDING_CACHE_CAPACITY = 100000 # Max embeddings kept on disk before LRU eviction
+SCORE_CACHE_PATH = os.path.join(CACHE_DIR, "scores.sqlite") # Reranker relevance score cache
+SCORE_CACHE_TTL_DAYS = 30 # Age after which cached relevance scores are recomputed
+SCORE_CACHE_MAX_ENTRIES = 2000000 # Max cached relevance scores before LRU eviction
+AUDIENCE_CACHE_PATH = os.path.join(CACHE_DIR, "audiences.sqlite") # Generated audiences shared across sessions
+AUDIENCE_CACHE_TTL_DAYS = 7 # Age after which a company's research and audience are regenerated
+SUMMARY_CACHE_PATH = os.path.join(CACHE_DIR, "summaries.sqlite") # Exact-key store of researcher summaries
+SUMMARY_CACHE_TTL_DAYS = 30 # Age after which researcher summaries are regenerated
+PERFORMANCE_TABLE_PATH = os.path.join(CACHE_DIR, "segment_performance.arrow") # Catalogue-wide z-scores built by src/export_performance_table.py
+JOB_DB_PATH = os.path.join(CACHE_DIR, "jobs.sqlite") # Background job table, shared by every session and worker
+TRACE_EXPORT_PATH = None # File finished spans are appended to as JSON lines, e.g. os.path.join(CACHE_DIR, "traces.jsonl"). Unrotated, so for diagnostic runs only
+LOCAL_INDEX_DIR = os.path.join(CACHE_DIR, "segment_index") # Local snapshot of the pinecone segment index
+LOCAL_INDEX_EF = 400 # HNSW search breadth, must be >= top_k
+LOCAL_INDEX_EXACT_LIMIT = 50000 # Filtered queries with fewer candidates than this are searched exactly
+
+# Service endpoints
+SERVICE_BASE_URL = os.environ.get("SERVICE_BASE_URL") # e.g. "http://127.0.0.1:8750" to send every API call to src/mock_services.py for load testing
+OPENAI_BASE_URL = f"{SERVICE_BASE_URL}/openai/v1" if SERVICE_BASE_URL else None # None uses the OpenAI default
+OPEN_ROUTER_BASE_URL = f"{SERVICE_BASE_URL}/openrouter/v1" if SERVICE_BASE_URL else "https://openrouter.ai/api/v1"
+GROQ_BASE_URL = f"{SERVICE_BASE_URL}/groq" if SERVICE_BASE_URL else "https://api.groq.com"
+PERPLEXITY_BASE_URL = f"{SERVICE_BASE_URL}/perplexity" if SERVICE_BASE_URL else "https://api.perplexity.ai"
+PINECONE_INDEX_HOST = f"{SERVICE_BASE_URL}/pinecone/{PINECONE_INDEX_NAME}" if SERVICE_BASE_URL else "" # Empty looks the host up by index name
+PINECONE_CACHE_HOST = f"{SERVICE_BASE_URL}/pinecone/{PINECONE_CACHE_INDEX}" if SERVICE_BASE_URL else ""
 
 # API keys
 PPLX_API_KEY = st.secrets["PPLX_API_KEY"]
@@ -5,28 +5,98 @@ import json
 
 
 from src.ui_components import (
-    render_company_input, render_json_diff, render_actual_segments,
+    render_company_input, render_refresh_option, render_json_diff, render_actual_segments,
     render_audience_report, render_button, render_user_feedback,
-    render_segment_selection, render_optimization_strategy_dropdown, render_segment_details)
+    render_segment_selection, render_optimization_strategy_dropdown, render_segment_details,
+    render_trace_toggle, render_trace_panel, render_job_progress, render_job_failure)
 from src.state_management import StateManager
 from src.data_processing import ensure_dict, validate_audience_segments
-from src.audience_generation import generate_audience, process_user_feedback, update_audience_segments, delete_unselected_segments
-from src.audience_search import process_audience_segments, summarize_segments, extract_research_inputs
+from src.audience_generation import generate_audience, get_audience_cache, process_user_feedback, update_audience_segments, delete_unselected_segments
+from src.audience_search import (
+    process_audience_segments, reselect_audience_segments, summarize_segments, extract_research_inputs,
+    audience_items, pending_descriptions, assemble_results)
 from src.report_generation import generate_audience_report
 from src.researcher import generate_segment_summaries
-from config.settings import PINECONE_TOP_K
+from src.segment_processing import score_cache
+from src.tracing import span, recent_traces, adopt_spans
+from src.background_jobs import get_job_queue
+from config.settings import PINECONE_TOP_K, STREAM_RESPONSES, USE_BACKGROUND_JOBS, JOB_POLL_INTERVAL
 from config.prompts import REDUCE_PROMPT, EXPAND_PROMPT
 
+def get_presearch_filter(use_presearch_filter: bool) -> Dict[str, Any]:
+    return {"BrandName": "Data Alliance"} if use_presearch_filter else {}
+
 def process_audience_data(extracted_json: Dict[str, Any], use_presearch_filter: bool) -> Dict[str, Any]:
     """Process the extracted audience data."""
-    presearch_filter = {"BrandName": "Data Alliance"} if use_presearch_filter else {}
-    processed_results = process_audience_segments(extracted_json, presearch_filter=presearch_filter, top_k=PINECONE_TOP_K, optimization_strategy=StateManager.get('optimization_strategy'))
+    processed_results = process_audience_segments(
+        extracted_json,
+        presearch_filter=get_presearch_filter(use_presearch_filter),
+        top_k=PINECONE_TOP_K,
+        optimization_strategy=StateManager.get('optimization_strategy'),
+        search_cache=StateManager.get('search_cache')
+    )
     return summarize_segments(processed_results)
 
-def generate_initial_audience(company_name: str, conversation_history: list) -> None:
+def run_background_job(kind: str, payload: Dict[str, Any], label: str) -> Any:
+    """
+    Return the result of a background job, submitting it or joining an identical one first.
+    While it runs, show its progress and rerun every JOB_POLL_INTERVAL seconds; the job
+    itself carries on across reruns and refreshes. The worker's spans join this run's trace.
+    """
+    queue = get_job_queue()
+    job_id = queue.submit(kind, payload, st.session_state.session_id)
+    job = queue.get(job_id)
+    if job['status'] == 'failed':
+        if render_job_failure(label, job['error']):
+            queue.submit(kind, payload, st.session_state.session_id, retry_failed=True)
+            st.rerun()
+        st.stop()
+    if job['status'] != 'done':
+        render_job_progress(label, job)
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    adopt_spans(queue.spans(job_id))
+    return queue.result(job_id)
+
+def process_audience_data_in_background(extracted_json: Dict[str, Any], use_presearch_filter: bool) -> Dict[str, Any]:
+    """
+    process_audience_data with the search in a worker process. Only descriptions missing from
+    the session's search cache are sent, and their scored segments are merged back into it.
+    """
+    presearch_filter = get_presearch_filter(use_presearch_filter)
+    optimization_strategy = StateManager.get('optimization_strategy')
+    search_cache = StateManager.get('search_cache')
+    items = audience_items(extracted_json)
+    pending = pending_descriptions(items, presearch_filter, PINECONE_TOP_K, search_cache)
+    if pending:
+        job_result = run_background_job('search', {
+            'descriptions': pending,
+            'presearch_filter': presearch_filter,
+            'top_k': PINECONE_TOP_K,
+            'optimization_strategy': optimization_strategy
+        }, "Searching across 504,311 audience segments for best matches...")
+        search_cache.update(job_result['search_cache'])
+    return summarize_segments(assemble_results(items, presearch_filter, PINECONE_TOP_K, optimization_strategy, search_cache))
+
+def reselect_audience_data(optimization_strategy: str) -> Dict[str, Any]:
+    """Re-select segments from the current search results for another strategy, or None if a new search is needed."""
+    if StateManager.get('post_search_results') is None:
+        return None
+    processed_results = reselect_audience_segments(
+        ensure_dict(StateManager.get('extracted_audience_json')),
+        presearch_filter=get_presearch_filter(StateManager.get('use_presearch_filter')),
+        top_k=PINECONE_TOP_K,
+        optimization_strategy=optimization_strategy,
+        search_cache=StateManager.get('search_cache')
+    )
+    return summarize_segments(processed_results) if processed_results else None
+
+def generate_initial_audience(company_name: str, conversation_history: list, force_refresh: bool = False) -> None:
     """Generate the initial audience based on company name and conversation history."""
     with st.spinner("Generating audience..."):
-        audience_segments, updated_history = generate_audience(company_name, conversation_history)
+        if force_refresh:
+            get_audience_cache().invalidate(company_name)
+        audience_segments, updated_history = generate_audience(company_name, conversation_history, force_refresh)
         StateManager.update(
             extracted_audience_json=audience_segments,
             conversation_history=updated_history,
@@ -42,9 +112,10 @@ def handle_user_feedback(audience_json: Dict[str, Any]) -> None:
             StateManager.update(
                 last_feedback=feedback
             )
+            # A copy, so a failed call cannot leave its prompt in the session's history
             updated_json, updated_history = process_user_feedback(
                 feedback,
-                StateManager.get('conversation_history')
+                list(StateManager.get('conversation_history'))
             )
             StateManager.update(
                 old_audience_json=audience_json,
@@ -54,6 +125,7 @@ def handle_user_feedback(audience_json: Dict[str, Any]) -> None:
                 summary_results=None,
                 audience_report=None,
                 final_report=None,
+                methodology_requested=False,
                 stage=1
             )
             if validate_audience_segments((updated_json)):
@@ -72,7 +144,7 @@ def handle_segment_selection(audience_json: Dict[str, Any]) -> None:
                 updated_json, updated_history = update_audience_segments(
                     audience_json,
                     selected_segments,
-                    StateManager.get('conversation_history')
+                    list(StateManager.get('conversation_history'))
                 )
                 StateManager.update_audience_segments(audience_json, updated_json, updated_history)
                 if validate_audience_segments(updated_json):
@@ -85,7 +157,7 @@ def handle_segment_selection(audience_json: Dict[str, Any]) -> None:
                 updated_json, updated_history = delete_unselected_segments(
                     audience_json, 
                     selected_segments,
-                    StateManager.get('conversation_history')
+                    list(StateManager.get('conversation_history'))
                 )
                 StateManager.update_audience_segments(audience_json, updated_json, updated_history)
                 if validate_audience_segments(updated_json):
@@ -97,7 +169,7 @@ def handle_segment_selection(audience_json: Dict[str, Any]) -> None:
             with st.spinner("Reducing segments..."):
                 updated_json, updated_history = process_user_feedback(
                     REDUCE_PROMPT,
-                    StateManager.get('conversation_history')
+                    list(StateManager.get('conversation_history'))
                 )
                 StateManager.update_audience_segments(audience_json, updated_json, updated_history)
                 if validate_audience_segments(updated_json):
@@ -109,29 +181,79 @@ def handle_segment_selection(audience_json: Dict[str, Any]) -> None:
             with st.spinner("Expanding reach..."):
                 updated_json, updated_history = process_user_feedback(
                     EXPAND_PROMPT,
-                    StateManager.get('conversation_history')
+                    list(StateManager.get('conversation_history'))
                 )
                 StateManager.update_audience_segments(audience_json, updated_json, updated_history)
                 if validate_audience_segments(updated_json):
                     st.success("Reach expanded successfully.")
                     st.rerun()
 
+def handle_audience_edits() -> None:
+    """Segment selection and feedback. If either fails, every update made since this run started is undone."""
+    # A version rather than restore_backup, which would also undo an unrelated earlier update
+    # when the failure came before this run's first journaled update
+    version = StateManager.version()
+    try:
+        handle_segment_selection(ensure_dict(StateManager.get('extracted_audience_json')))
+        
+        if StateManager.get('old_audience_json'):
+            render_json_diff(StateManager.get('old_audience_json'), ensure_dict(StateManager.get('extracted_audience_json')))
+        
+        handle_user_feedback(ensure_dict(StateManager.get('extracted_audience_json')))
+
+    except Exception as e:
+        print(f"An error occurred during feedback handling: {str(e)}")
+        st.error(f"An error occurred during feedback handling: {str(e)}")
+        StateManager.restore_version(version)
+        st.warning("State is reverting to the last known valid state. Try a different command.")
+        time.sleep(5)
+        st.rerun()
+
 def process_and_render_segments() -> None:
     if StateManager.get('post_search_results') is None:
         """Process and render the audience segments."""
         use_presearch_filter = StateManager.get('use_presearch_filter')
         
-        with st.spinner("Searching across 504,311 audience segments for best matches..."):
-            post_search_results = process_audience_data(
+        if USE_BACKGROUND_JOBS:
+            post_search_results = process_audience_data_in_background(
                 ensure_dict(StateManager.get('extracted_audience_json')),
                 use_presearch_filter
             )
-            StateManager.update(post_search_results=post_search_results)
+        else:
+            with st.spinner("Searching across 504,311 audience segments for best matches..."):
+                post_search_results = process_audience_data(
+                    ensure_dict(StateManager.get('extracted_audience_json')),
+                    use_presearch_filter
+                )
+        StateManager.update(post_search_results=post_search_results)
     
     render_actual_segments(StateManager.get('post_search_results'))
     
     
-    if not StateManager.get('audience_report'):
+    if StateManager.get('audience_report'):
+        render_audience_report(StateManager.get('audience_report'))
+    elif USE_BACKGROUND_JOBS:
+        audience_report = run_background_job('report', {
+            'summary_json': StateManager.get('post_search_results'),
+            'company_name': StateManager.get('company_name'),
+            'conversation_history': StateManager.get('conversation_history')
+        }, "Generating audience report...")
+        StateManager.update(
+            audience_report=audience_report
+        )
+        render_audience_report(audience_report)
+    elif STREAM_RESPONSES:
+        # The report renders as it streams in
+        st.subheader("Audience Report")
+        audience_report = generate_audience_report(
+            StateManager.get('post_search_results'), 
+            StateManager.get('company_name'), 
+            StateManager.get('conversation_history')
+        )
+        StateManager.update(
+            audience_report=audience_report
+        )
+    else:
         with st.spinner("Generating audience report..."):
             audience_report = generate_audience_report(
                 StateManager.get('post_search_results'), 
@@ -141,32 +263,24 @@ def process_and_render_segments() -> None:
             StateManager.update(
                 audience_report=audience_report
             )
-    
-    render_audience_report(StateManager.get('audience_report'))
+        render_audience_report(StateManager.get('audience_report'))
 
 def generate_methodology_report() -> None:
     """Generate data collection methodology summaries."""
-    with st.spinner("Generating data collection methodology summaries..."):
-        segments = extract_research_inputs(StateManager.get('post_search_results'))
-        segment_summaries = generate_segment_summaries(segments)
-        render_segment_details(segment_summaries)
+    segments = extract_research_inputs(StateManager.get('post_search_results'))
+    if USE_BACKGROUND_JOBS:
+        segment_summaries = run_background_job('methodology', {'segments': segments}, "Generating data collection methodology summaries...")
+    else:
+        with st.spinner("Generating data collection methodology summaries..."):
+            segment_summaries = generate_segment_summaries(segments)
+    render_segment_details(segment_summaries)
 
-def main() -> None:
-    """Main function to run the Streamlit app."""
-    st.set_page_config(layout="wide")
-
-    password = st.text_input("Enter password:", type="password")
-    if password != st.secrets["app_password"]:  # Ensure this key exists in your secrets
-        st.error("Incorrect password. Please try again.")
-        return  # Exit the main function if the password is incorrect
-    
-    # Initialize or reset state for new sessions
-    if 'session_id' not in st.session_state:
-        StateManager.reset()
-    
+def run_app() -> None:
+    """Render the app and run whatever the user asked for on this rerun."""
     st.title("Smart Audience Generator")
 
     new_company_name = render_company_input()
+    force_refresh = render_refresh_option()
     
     if render_button("Generate Audience"):
         StateManager.update(
@@ -179,40 +293,40 @@ def main() -> None:
             summary_results=None,
             audience_report=None,
             final_report=None,
+            methodology_requested=False,
             use_presearch_filter=False,
             post_search_results=None,
-            state_backup=None,
+            search_cache={},
             user_feedback=""
         )
+        StateManager.clear_history()
         StateManager.update(company_name=new_company_name)
-        generate_initial_audience(StateManager.get('company_name'), StateManager.get('conversation_history'))
+        generate_initial_audience(StateManager.get('company_name'), StateManager.get('conversation_history'), force_refresh)
 
 
     if StateManager.get('stage') >= 1:
-        try:
-            handle_segment_selection(ensure_dict(StateManager.get('extracted_audience_json')))
-            
-            if StateManager.get('old_audience_json'):
-                render_json_diff(StateManager.get('old_audience_json'), ensure_dict(StateManager.get('extracted_audience_json')))
-            
-            handle_user_feedback(ensure_dict(StateManager.get('extracted_audience_json')))
-
-        except Exception as e:
-            print(f"An error occurred during feedback handling: {str(e)}")
-            st.error(f"An error occurred during feedback handling: {str(e)}")
-            StateManager.restore_backup()
-            st.warning("State is reverting to the last known valid state. Try a different command.")
-            time.sleep(5)
-            st.rerun()
+        handle_audience_edits()
         
         # Add the optimization strategy dropdown here
         optimization_strategy = render_optimization_strategy_dropdown()
         if optimization_strategy != StateManager.get('optimization_strategy'):
-            StateManager.update(
-                optimization_strategy=optimization_strategy,
-                stage=1,
-                post_search_results=None
-            )
+            post_search_results = reselect_audience_data(optimization_strategy)
+            if post_search_results is not None:
+                # Every strategy was reranked with the search, so this is a local re-sort
+                StateManager.update(
+                    optimization_strategy=optimization_strategy,
+                    post_search_results=post_search_results,
+                    audience_report=None,
+                    final_report=None,
+                    methodology_requested=False
+                )
+            else:
+                StateManager.update(
+                    optimization_strategy=optimization_strategy,
+                    stage=1,
+                    post_search_results=None,
+                    methodology_requested=False
+                )
 
         
         if render_button("Search Actual Segments"):
@@ -220,6 +334,7 @@ def main() -> None:
                 summary_results=None,
                 audience_report=None,
                 final_report=None,
+                methodology_requested=False,
                 stage=2
             )
             st.rerun()
@@ -228,7 +343,35 @@ def main() -> None:
         process_and_render_segments()
 
         if render_button("Generate Methodology Report"):
+            if USE_BACKGROUND_JOBS:
+                # Remembered so the reruns that poll the job keep showing it
+                StateManager.update(methodology_requested=True)
+            else:
+                generate_methodology_report()
+        if StateManager.get('methodology_requested'):
             generate_methodology_report()
 
+def main() -> None:
+    """Main function to run the Streamlit app."""
+    st.set_page_config(layout="wide")
+
+    password = st.text_input("Enter password:", type="password")
+    if password != st.secrets["app_password"]:  # Ensure this key exists in your secrets
+        st.error("Incorrect password. Please try again.")
+        return  # Exit the main function if the password is incorrect
+    
+    # Initialize or reset state for new sessions
+    if 'session_id' not in st.session_state:
+        StateManager.reset()
+
+    show_traces = render_trace_toggle()
+
+    # Each rerun is one trace, so the panel shows where this run's time went
+    with span('run', session_id=st.session_state.session_id):
+        run_app()
+
+    if show_traces:
+        render_trace_panel(recent_traces(session_id=st.session_state.session_id), score_cache.stats())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,81 +1,137 @@
-import requests
 from openai import OpenAI
 from groq import Groq
 from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_log
-from config.settings import ONLINE_MODEL, OFFLINE_MODEL, PPLX_API_KEY, OPENAI_API_KEY, GROQ_API_KEY, OPEN_ROUTER_KEY, OPENAI_MODEL, OPEN_ROUTER_MODEL, GROQ_MODEL, CONTEXT_LENGTH_START, CONTEXT_LENGTH_END, API_SELECTOR
+from config.settings import ONLINE_MODEL, OFFLINE_MODEL, OPENAI_API_KEY, GROQ_API_KEY, OPEN_ROUTER_KEY, OPENAI_MODEL, OPEN_ROUTER_MODEL, GROQ_MODEL, CONTEXT_LENGTH_START, CONTEXT_TOKEN_BUDGET, MODEL_CONTEXT_BUDGETS, CONTEXT_SUMMARY_TOKENS, API_SELECTOR, USE_ASYNC_CLIENTS, OPENAI_BASE_URL, OPEN_ROUTER_BASE_URL, GROQ_BASE_URL
 from config.prompts import BASIC_SYSTEM_PROMPT
+from .async_clients import chat_completion_async, chat_completion_stream_async, perplexity_chat_async, run_sync, iterate_sync
+from .context_window import fit_context
+from .tracing import span, count_retries, increment
+from .single_flight import SingleFlight, canonical_key
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-groq_client = Groq(api_key=GROQ_API_KEY)
+openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL)
 open_router_client = client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
+  base_url=OPEN_ROUTER_BASE_URL,
   api_key=OPEN_ROUTER_KEY,
 )
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=2, min=30, max=200),
-    before_sleep=before_sleep_log(logger, logging.INFO)
-)
 def send_perplexity_message(messages, model=ONLINE_MODEL):
-    url = "https://api.perplexity.ai/chat/completions"
-    
-    payload = {
-        "model": model,
-        "messages": messages
-    }
-    
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": f"Bearer {PPLX_API_KEY}"
-    }
-    
-    response = requests.post(url, json=payload, headers=headers)
-    response_data = response.json()
-    
-    if 'choices' in response_data and len(response_data['choices']) > 0:
-        return response_data['choices'][0]['message']['content']
-    else:
-        raise Exception("Error: Unable to get a response from the API")
+    """Send a chat completion directly to the Perplexity API, through the shared client pool and rate limiter."""
+    return run_sync(perplexity_chat_async(messages, model))
 
 @retry(
     stop=stop_after_attempt(4),
-    wait=wait_exponential(multiplier=2, min=30, max=200),
-    before_sleep=before_sleep_log(logger, logging.INFO)
+    wait=wait_exponential(multiplier=2, min=2, max=60),
+    before_sleep=count_retries(before_sleep_log(logger, logging.INFO))
 )
 def send_api_message(client, messages, model):
     response = client.chat.completions.create(
         model=model,
-        messages=select_context(messages, CONTEXT_LENGTH_START, CONTEXT_LENGTH_END),
+        messages=select_context(messages, model),
         temperature=0.0,
         timeout=30
     )
     logger.info(f"API call {response}")
+    if response.usage:
+        increment('prompt_tokens', response.usage.prompt_tokens)
+        increment('completion_tokens', response.usage.completion_tokens)
     
     if response.choices and len(response.choices) > 0:
         return response.choices[0].message.content
     else:
         raise Exception("Error: Unable to get a response from the API")
     
-def select_context(history, num_first, num_recent):
-    if len(history) <= num_first + num_recent:
-        return history
-    print('history length' + str(len(history)))
-    return history[:num_first] + history[-(num_recent):]
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential(multiplier=2, min=2, max=60),
+    before_sleep=count_retries(before_sleep_log(logger, logging.INFO))
+)
+def open_api_stream(client, messages, model):
+    # Only opening the stream is retried, a retry mid-stream would repeat tokens
+    return client.chat.completions.create(
+        model=model,
+        messages=select_context(messages, model),
+        temperature=0.0,
+        timeout=30,
+        stream=True
+    )
+
+def stream_api_message(client, messages, model):
+    for chunk in open_api_stream(client, messages, model):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def select_context(history, model):
+    token_budget = MODEL_CONTEXT_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET)
+    return fit_context(history, model, token_budget, CONTEXT_LENGTH_START, CONTEXT_SUMMARY_TOKENS)
+
+# api_selector -> (provider, model) for the async client layer
+API_ROUTES = {
+    'openai': ('openai', OPENAI_MODEL),
+    'groq': ('groq', GROQ_MODEL),
+    'open_router': ('open_router', OPEN_ROUTER_MODEL),
+    'online_perplexity': ('open_router', ONLINE_MODEL),
+    'offline_perplexity': ('open_router', OFFLINE_MODEL),
+}
+
+# Identical concurrent calls (same route and messages) share one request
+route_flight = SingleFlight('route_api_call')
+
+async def route_api_call_async(api_selector = API_SELECTOR, messages = []):
+    provider, model = API_ROUTES[api_selector]
+
+    async def call():
+        with span('route_api_call', api_selector=api_selector, model=model):
+            return await chat_completion_async(
+                provider,
+                model,
+                select_context(messages, model),
+                temperature=0.0,
+                timeout=30
+            )
+    return await route_flight.do_async(canonical_key(api_selector, messages), call)
+
+def route_api_call_stream_async(api_selector = API_SELECTOR, messages = []):
+    provider, model = API_ROUTES[api_selector]
+    return chat_completion_stream_async(
+        provider,
+        model,
+        select_context(messages, model),
+        temperature=0.0,
+        timeout=30
+    )
+
+def route_api_call_stream(api_selector = API_SELECTOR, messages = []):
+    """Like route_api_call, but yields the response text in chunks as it is generated."""
+    if USE_ASYNC_CLIENTS:
+        return iterate_sync(route_api_call_stream_async(api_selector, messages))
+    clients = {
+        'openai': openai_client,
+        'groq': groq_client,
+        'open_router': open_router_client,
+        'online_perplexity': open_router_client,
+        'offline_perplexity': open_router_client,
+    }
+    return stream_api_message(clients[api_selector], messages, API_ROUTES[api_selector][1])
+
+def send_routed_message(api_selector, messages):
+    with span('route_api_call', api_selector=api_selector, model=API_ROUTES[api_selector][1]):
+        if api_selector == 'openai':
+            return send_api_message(openai_client, messages, OPENAI_MODEL)
+        elif api_selector == 'groq':
+            return send_api_message(groq_client, messages, GROQ_MODEL)
+        elif api_selector == 'open_router':
+            return send_api_message(open_router_client, messages, OPEN_ROUTER_MODEL)
+        elif api_selector == 'online_perplexity':
+            return send_api_message(open_router_client, messages, ONLINE_MODEL)
+        elif api_selector == 'offline_perplexity':
+            return send_api_message(open_router_client, messages, OFFLINE_MODEL)
 
 def route_api_call(api_selector = API_SELECTOR, messages = []):
-    if api_selector == 'openai':
-        return send_api_message(openai_client, messages, OPENAI_MODEL)
-    elif api_selector == 'groq':
-        return send_api_message(groq_client, messages, GROQ_MODEL)
-    elif api_selector == 'open_router':
-        return send_api_message(open_router_client, messages, OPEN_ROUTER_MODEL)
-    elif api_selector == 'online_perplexity':
-        return send_api_message(open_router_client, messages, ONLINE_MODEL)
-    elif api_selector == 'offline_perplexity':
-        return send_api_message(open_router_client, messages, OFFLINE_MODEL)
\ No newline at end of file
+    if USE_ASYNC_CLIENTS:
+        return run_sync(route_api_call_async(api_selector, messages))
+    return route_flight.do(canonical_key(api_selector, messages), send_routed_message, api_selector, messages)
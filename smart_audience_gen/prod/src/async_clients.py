@@ -0,0 +1,213 @@
+import queue
+import asyncio
+import random
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, Iterator, List
+import httpx
+from openai import AsyncOpenAI, APIStatusError
+from config.settings import (
+    OPENAI_API_KEY, GROQ_API_KEY, OPEN_ROUTER_KEY, PPLX_API_KEY,
+    ASYNC_MAX_CONNECTIONS, PROVIDER_CONCURRENCY, ASYNC_MAX_RETRIES, ASYNC_RETRY_BASE_DELAY, ASYNC_RETRY_MAX_DELAY,
+    RATE_LIMITS, MODEL_RATE_LIMITS, OPENAI_BASE_URL, GROQ_BASE_URL, OPEN_ROUTER_BASE_URL, PERPLEXITY_BASE_URL
+)
+from .rate_limiting import RateLimiter, get_rate_limiter, estimate_tokens, retry_after_seconds
+from .tracing import bind_context, increment
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_BASE_URLS = {
+    'openai': OPENAI_BASE_URL,
+    'groq': f"{GROQ_BASE_URL}/openai/v1",
+    'open_router': OPEN_ROUTER_BASE_URL,
+    'perplexity': PERPLEXITY_BASE_URL,
+}
+PROVIDER_API_KEYS = {
+    'openai': OPENAI_API_KEY,
+    'groq': GROQ_API_KEY,
+    'open_router': OPEN_ROUTER_KEY,
+    'perplexity': PPLX_API_KEY,
+}
+
+_loop = None
+_loop_lock = threading.Lock()
+_http_client = None
+_clients: Dict[str, AsyncOpenAI] = {}
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide event loop that owns every async client, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-clients", daemon=True).start()
+        return _loop
+
+def submit_async(coro: Coroutine) -> Future:
+    """Schedule a coroutine on the shared loop from any thread and return a concurrent future."""
+    # The loop thread has its own context, so carry the caller's span over explicitly
+    return asyncio.run_coroutine_threadsafe(bind_context(coro), get_event_loop())
+
+def run_sync(coro: Coroutine) -> Any:
+    """Run a coroutine on the shared loop and block the calling thread until it finishes."""
+    return submit_async(coro).result()
+
+def iterate_sync(async_iterable: AsyncIterator) -> Iterator:
+    """Consume an async iterator on the shared loop, yielding its items to the calling thread as they arrive."""
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = submit_async(pump())
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared keep-alive connection pool used by every provider."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+    return _http_client
+
+def get_client(provider: str) -> AsyncOpenAI:
+    """OpenAI-compatible async client for a provider, sharing the connection pool."""
+    if provider not in _clients:
+        _clients[provider] = AsyncOpenAI(
+            api_key=PROVIDER_API_KEYS[provider],
+            base_url=PROVIDER_BASE_URLS[provider],
+            http_client=get_http_client(),
+            max_retries=0  # Retries are handled by with_retries
+        )
+    return _clients[provider]
+
+def get_semaphore(provider: str) -> asyncio.Semaphore:
+    """Global cap on in-flight requests per provider."""
+    if provider not in _semaphores:
+        _semaphores[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY[provider])
+    return _semaphores[provider]
+
+def get_limiter(provider: str, model: str) -> RateLimiter:
+    return get_rate_limiter(provider, model, RATE_LIMITS, MODEL_RATE_LIMITS, PROVIDER_CONCURRENCY[provider])
+
+class RateLimited(Exception):
+    """A 429 from a provider, carrying the delay it asked for."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+async def with_retries(call: Callable[[], Awaitable[Any]], max_attempts: int = ASYNC_MAX_RETRIES) -> Any:
+    """Retry an async call with exponential backoff and full jitter, honouring provider retry-after hints."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_attempts:
+                raise
+            delay = random.uniform(0, min(ASYNC_RETRY_MAX_DELAY, ASYNC_RETRY_BASE_DELAY * 2 ** attempt))
+            if isinstance(e, RateLimited) and e.retry_after:
+                delay = min(ASYNC_RETRY_MAX_DELAY, e.retry_after) + random.uniform(0, ASYNC_RETRY_BASE_DELAY)
+            logger.info(f"Retrying in {delay:.1f}s after attempt {attempt} failed: {e}")
+            increment('retries')
+            await asyncio.sleep(delay)
+
+async def chat_completion_async(provider: str, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+    """Send a chat completion to an OpenAI-compatible provider and return the message content."""
+    client = get_client(provider)
+    limiter = get_limiter(provider, model)
+    estimated_tokens = estimate_tokens(messages, kwargs.get('max_tokens'))
+
+    async def call():
+        async with get_semaphore(provider), limiter.slot(estimated_tokens):
+            try:
+                raw_response = await client.chat.completions.with_raw_response.create(model=model, messages=messages, **kwargs)
+            except APIStatusError as e:
+                if e.status_code == 429:
+                    limiter.record_throttle(e.response.headers)
+                    raise RateLimited(str(e), retry_after_seconds(e.response.headers)) from e
+                raise
+        limiter.record_response(raw_response.headers)
+        response = raw_response.parse()
+        if response.usage:
+            increment('prompt_tokens', response.usage.prompt_tokens)
+            increment('completion_tokens', response.usage.completion_tokens)
+        if response.choices and len(response.choices) > 0:
+            return response.choices[0].message.content
+        raise Exception("Error: Unable to get a response from the API")
+
+    return await with_retries(call)
+
+async def chat_completion_stream_async(provider: str, model: str, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+    """Stream a chat completion, yielding content deltas. Only opening the stream is retried."""
+    client = get_client(provider)
+    limiter = get_limiter(provider, model)
+    estimated_tokens = estimate_tokens(messages, kwargs.get('max_tokens'))
+
+    async def open_stream():
+        try:
+            return await client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        except APIStatusError as e:
+            if e.status_code == 429:
+                limiter.record_throttle(e.response.headers)
+                raise RateLimited(str(e), retry_after_seconds(e.response.headers)) from e
+            raise
+
+    async with get_semaphore(provider), limiter.slot(estimated_tokens):
+        stream = await with_retries(open_stream)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    limiter.record_response(None)
+
+async def perplexity_chat_async(messages: List[Dict[str, str]], model: str) -> str:
+    """Send a chat completion directly to the Perplexity API."""
+    headers = {
+        "accept": "application/json",
+        "content-type": "application/json",
+        "authorization": f"Bearer {PROVIDER_API_KEYS['perplexity']}"
+    }
+
+    limiter = get_limiter('perplexity', model)
+    estimated_tokens = estimate_tokens(messages)
+
+    async def call():
+        async with get_semaphore('perplexity'), limiter.slot(estimated_tokens):
+            response = await get_http_client().post(
+                f"{PROVIDER_BASE_URLS['perplexity']}/chat/completions",
+                json={"model": model, "messages": messages},
+                headers=headers
+            )
+        if response.status_code == 429:
+            limiter.record_throttle(response.headers)
+            raise RateLimited("Perplexity rate limit exceeded", retry_after_seconds(response.headers))
+        limiter.record_response(response.headers)
+        response_data = response.json()
+        usage = response_data.get('usage') or {}
+        increment('prompt_tokens', usage.get('prompt_tokens', 0))
+        increment('completion_tokens', usage.get('completion_tokens', 0))
+        if 'choices' in response_data and len(response_data['choices']) > 0:
+            return response_data['choices'][0]['message']['content']
+        raise Exception("Error: Unable to get a response from the API")
+
+    return await with_retries(call)
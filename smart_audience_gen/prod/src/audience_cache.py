@@ -0,0 +1,77 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEGAL_SUFFIXES = ('inc', 'incorporated', 'llc', 'ltd', 'corp', 'corporation', 'co', 'company', 'plc')
+
+def normalize_company_name(company_name: str) -> str:
+    """Case-fold, strip punctuation and legal suffixes so 'Nike, Inc.' and 'nike' share an entry."""
+    words = re.sub(r'[^\w\s]', ' ', company_name.casefold()).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+def prompt_set_version(*prompts: str) -> str:
+    """Short hash of the prompt texts, so editing any prompt invalidates entries built from it."""
+    return hashlib.sha256(json.dumps(prompts).encode()).hexdigest()[:16]
+
+class AudienceCache:
+    """
+    SQLite store of generated company descriptions and audiences shared by every session.
+
+    Entries are keyed by (kind, normalized company name, prompt-set version, model) and
+    expire after ttl_seconds. Each entry holds the response plus the conversation
+    history that produced it, so feedback on a cached audience has the same context.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS audiences "
+                "(kind TEXT NOT NULL, company TEXT NOT NULL, version TEXT NOT NULL, model TEXT NOT NULL, "
+                "response TEXT NOT NULL, conversation TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, company, version, model))"
+            )
+
+    def get(self, kind: str, company_name: str, version: str, model: str) -> Optional[Dict[str, Any]]:
+        """Return {'response', 'conversation'} for a fresh entry, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, conversation FROM audiences "
+                "WHERE kind = ? AND company = ? AND version = ? AND model = ? AND created_at >= ?",
+                (kind, normalize_company_name(company_name), version, model, time.time() - self.ttl_seconds)
+            ).fetchone()
+        if row is None:
+            return None
+        logger.info(f"Audience cache hit for {kind} of '{company_name}'")
+        return {'response': json.loads(row[0]), 'conversation': json.loads(row[1])}
+
+    def put(self, kind: str, company_name: str, version: str, model: str, response: Any, conversation: List[Dict[str, str]]):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO audiences (kind, company, version, model, response, conversation, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, normalize_company_name(company_name), version, model, json.dumps(response), json.dumps(conversation), time.time())
+                )
+                self._conn.execute("DELETE FROM audiences WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+    def invalidate(self, company_name: str) -> int:
+        """Drop every cached entry for a company. Returns the number of entries removed."""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute("DELETE FROM audiences WHERE company = ?", (normalize_company_name(company_name),))
+        return cursor.rowcount
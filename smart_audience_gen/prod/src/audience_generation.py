@@ -1,10 +1,13 @@
 import json
 
-from src.api_clients import send_perplexity_message, route_api_call
-from src.data_processing import extract_and_correct_json
+from src.api_clients import route_api_call, route_api_call_stream
+from src.data_processing import extract_and_correct_json, ensure_dict, IncrementalJSONParser
+from src.ui_components import render_partial_audience
+from src.audience_cache import AudienceCache, prompt_set_version
+from src.tracing import traced
 from typing import Dict, Any, List, Tuple
 import streamlit as st
-from config.settings import ONLINE_MODEL
+from config.settings import ONLINE_MODEL, OPENAI_MODEL, AUDIENCE_CACHE_PATH, AUDIENCE_CACHE_TTL_DAYS, STREAM_RESPONSES
 from config.prompts import (
     COMPANY_RESEARCH_PROMPT,
     AUDIENCE_BUILD_PROMPT,
@@ -18,16 +21,53 @@ from config.prompts import (
     COMPARISON_DESCRIPTION
 )
 
+DESCRIPTION_PROMPT_VERSION = prompt_set_version(COMPANY_RESEARCH_PROMPT)
+AUDIENCE_PROMPT_VERSION = prompt_set_version(
+    COMPANY_RESEARCH_PROMPT, AUDIENCE_BUILD_PROMPT, JSON_AUDIENCE_BUILD_PROMPT,
+    INCLUDED_IMPROVING_PROMPT, EXCLUDED_IMPROVING_PROMPT, REPHRASAL_PROMPT
+)
+AUDIENCE_MODELS = f"{ONLINE_MODEL}|{OPENAI_MODEL}"
+
+@st.cache_resource
+def get_audience_cache() -> AudienceCache:
+    """Cache of generated audiences shared by every session of this server."""
+    return AudienceCache(AUDIENCE_CACHE_PATH, AUDIENCE_CACHE_TTL_DAYS * 24 * 60 * 60)
+
 # Audience generation functions
-def generate_audience(company_name: str, conversation_history: List[Dict[str, str]]) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
-    """Generate audience segments for a given company."""
-    company_description, updated_history = generate_company_description(company_name, conversation_history)
-    return generate_audience_segments(company_name, company_description, updated_history)
+def generate_audience(company_name: str, conversation_history: List[Dict[str, str]], force_refresh: bool = False) -> Tuple[str, List[Dict[str, str]]]:
+    """Generate audience segments for a given company, reusing another session's result when available."""
+    # Cached conversations start from an empty history, so only fresh conversations can use them
+    use_cache = not conversation_history
+    cache = get_audience_cache()
+    if use_cache and not force_refresh:
+        cached = cache.get('audience', company_name, AUDIENCE_PROMPT_VERSION, AUDIENCE_MODELS)
+        if cached:
+            st.write("Loaded previously generated audience")
+            # Returned as the JSON string generate_audience_segments produces, so callers see one type either way
+            return json.dumps(cached['response']), conversation_history + cached['conversation']
+
+    company_description, updated_history = generate_company_description(company_name, conversation_history, force_refresh)
+    audience_json, updated_history = generate_audience_segments(company_name, company_description, updated_history)
+    audience = ensure_dict(audience_json)
+    if use_cache and audience:
+        cache.put('audience', company_name, AUDIENCE_PROMPT_VERSION, AUDIENCE_MODELS, audience, updated_history)
+    return audience_json, updated_history
 
-def generate_company_description(company_name: str, conversation_history: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+def generate_company_description(company_name: str, conversation_history: List[Dict[str, str]], force_refresh: bool = False) -> Tuple[str, List[Dict[str, str]]]:
     """Generate a company description using online Perplexity."""
+    use_cache = not conversation_history
+    cache = get_audience_cache()
+    if use_cache and not force_refresh:
+        cached = cache.get('description', company_name, DESCRIPTION_PROMPT_VERSION, ONLINE_MODEL)
+        if cached:
+            st.write("Loaded previous company research")
+            return cached['response'], conversation_history + cached['conversation']
+
     prompt = COMPANY_RESEARCH_PROMPT.format(company_name=company_name)
-    return append_to_conversation(prompt, 'online_perplexity', conversation_history)
+    company_description, updated_history = append_to_conversation(prompt, 'online_perplexity', conversation_history)
+    if use_cache:
+        cache.put('description', company_name, DESCRIPTION_PROMPT_VERSION, ONLINE_MODEL, company_description, updated_history)
+    return company_description, updated_history
 
 def generate_audience_segments(company_name: str, company_description: str, conversation_history: List[Dict[str, str]]) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
     """Generate audience segments based on company information."""
@@ -50,20 +90,42 @@ def create_audience_message_queue(company_name: str, company_description: str) -
 def process_message_queue(message_queue: List[Tuple[str, str, Dict[str, str]]], conversation_history: List[Dict[str, str]]) -> Tuple[Dict[str, str], List[Dict[str, str]]]:
     """Process a queue of messages and update conversation history."""
     results = {}
+    placeholder = st.empty()
     for prompt_name, prompt, format_args in message_queue:
         formatted_prompt = prompt.format(**format_args) if format_args else prompt
-        response, conversation_history = append_to_conversation(formatted_prompt, 'openai', conversation_history)
+        response, conversation_history = append_to_conversation(formatted_prompt, 'openai', conversation_history, placeholder)
         results[prompt_name] = response
         st.write(prompt_name)
+    placeholder.empty()
     return results, conversation_history
 
-def append_to_conversation(prompt: str, api_type: str, conversation_history: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
-    """Append a message to the conversation history and get a response."""
+def append_to_conversation(prompt: str, api_type: str, conversation_history: List[Dict[str, str]], placeholder=None) -> Tuple[str, List[Dict[str, str]]]:
+    """Append a message to the conversation history and get a response, streaming it into placeholder if given."""
     conversation_history.append({"role": "user", "content": prompt})
-    response = route_api_call(api_type, conversation_history)
+    if placeholder is not None and STREAM_RESPONSES:
+        response = stream_response(api_type, conversation_history, placeholder)
+    else:
+        response = route_api_call(api_type, conversation_history)
     conversation_history.append({"role": "assistant", "content": response})
     return response, conversation_history
 
+@traced()
+def stream_response(api_type: str, conversation_history: List[Dict[str, str]], placeholder) -> str:
+    """Stream a response into placeholder, rendering audience groups as soon as they parse."""
+    parser = IncrementalJSONParser()
+    chunks = []
+    for chunk in route_api_call_stream(api_type, conversation_history):
+        chunks.append(chunk)
+        parser.feed(chunk)
+        if parser.start < 0:
+            placeholder.markdown(''.join(chunks))
+        elif '}' in chunk or ']' in chunk:
+            # Re-render only when a group or segment may have completed
+            partial = parser.value()
+            if isinstance(partial, dict) and 'Audience' in partial:
+                render_partial_audience(placeholder, partial)
+    return ''.join(chunks)
+
 # Segment manipulation functions
 def update_audience_segments(current_audience: Dict[str, Any], selected_segments: List[Tuple[str, str, str]], conversation_history: List[Dict[str, str]]) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
     """Update audience segments based on user selection."""
@@ -122,5 +184,7 @@ def format_deletion_message(segments_to_remove: List[Tuple[str, str, str]]) -> s
 def process_user_feedback(user_feedback: str, conversation_history: List[Dict[str, str]]) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
     """Process user feedback and update the audience segments."""
     prompt = FEEDBACK_PROMPT.format(user_feedback=user_feedback)
-    response, updated_history = append_to_conversation(prompt, 'openai', conversation_history)
+    placeholder = st.empty()
+    response, updated_history = append_to_conversation(prompt, 'openai', conversation_history, placeholder)
+    placeholder.empty()
     return extract_and_correct_json(response), updated_history
\ No newline at end of file
@@ -1,47 +1,89 @@
 import streamlit as st
-from typing import Dict, List, Literal
+from typing import Callable, Dict, List, Literal, Sequence, Tuple, Iterator
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 from .data_processing import results_to_dataframe
-from .embedding import generate_embedding
+from .embedding import generate_embedding, generate_embeddings
 from .pinecone_utils import query_pinecone
-from .segment_processing import process_single_segment, filter_non_us
-from config.settings import RELEVANCE_THRESHOLD, MAX_RERANK_WORKERS, SECONDARY_RELEVANCE_THRESHOLD
+from .segment_processing import process_single_segment, process_single_segment_async, process_segment_batch, filter_non_us, score_cache
+from .async_clients import submit_async
+from .performance_table import PerformanceTable, load_performance_table
+from .tracing import span, traced, set_attribute, submit_with_context
+from config.settings import (
+    RELEVANCE_THRESHOLD, MAX_RERANK_WORKERS, SECONDARY_RELEVANCE_THRESHOLD, RERANK_MODE, RERANK_BATCH_SIZE,
+    RERANK_WAVE_SIZE, RERANK_BUDGET, RERANK_VECTOR_WEIGHT,
+    SEARCH_MODE, SEARCH_WORKERS, QUERY_STAGE_WORKERS, RERANK_STAGE_WORKERS, USE_ASYNC_CLIENTS, NON_US_FILTER_PUSHDOWN,
+    PERFORMANCE_TABLE_PATH
+)
+import threading
 import numpy as np
 
+OPTIMIZATION_STRATEGIES = ('ctr', 'cpa', 'composite')
+
+_performance_table = None
+_performance_table_loaded = False
+_performance_table_lock = threading.Lock()
+
+def get_performance_table() -> PerformanceTable:
+    """Load the catalogue-wide performance table once per process, None if it has not been built."""
+    global _performance_table, _performance_table_loaded
+    with _performance_table_lock:
+        if not _performance_table_loaded:
+            _performance_table = load_performance_table(PERFORMANCE_TABLE_PATH)
+            _performance_table_loaded = True
+        return _performance_table
+
 def calculate_z_score(series):
     return (series - series.mean()) / series.std()
 
-def find_relevant_segments(
-    query: str, 
-    presearch_filter: dict, 
-    top_k: int, 
-    vertical: str = 'overall', 
+def optimization_score(ctr_z_score, cpa_z_score, optimization_strategy: Literal['ctr', 'cpa', 'composite'] = 'composite'):
+    """Score a segment (or a column of segments) for the chosen strategy from its CTR and CPA z-scores."""
+    if optimization_strategy == 'ctr':
+        return ctr_z_score
+    if optimization_strategy == 'cpa':
+        return -cpa_z_score  # Negative because lower CPA is better
+    return ctr_z_score - cpa_z_score
+
+@traced()
+def fetch_candidates(
+    query_embedding: List[float],
+    presearch_filter: dict,
+    top_k: int,
+    vertical: str = 'overall',
     optimization_strategy: Literal['ctr', 'cpa', 'composite'] = 'composite'
 ) -> pd.DataFrame:
-    query_embedding = generate_embedding(query)
+    """Query the segment index and return filtered candidates sorted by optimization score."""
+    if NON_US_FILTER_PUSHDOWN:
+        presearch_filter = {**presearch_filter, 'is_non_us': {'$ne': True}}
     query_results = query_pinecone(query_embedding, top_k, presearch_filter)
-    df = results_to_dataframe(query_results)
+    # Traced here so data_processing stays free of settings and secrets
+    with span('results_to_dataframe'):
+        df = results_to_dataframe(query_results)
+        set_attribute('rows', len(df))
     df = filter_non_us(df)
 
     # Use the vertical-specific CTR and CPA columns
     ctr_column = f'{vertical}_ctr'
     cpa_column = f'{vertical}_cpa'
 
-    # Check if the columns exist and have non-null values
-    if ctr_column in df.columns and cpa_column in df.columns and df[ctr_column].notna().any() and df[cpa_column].notna().any():
-        # Calculate z-scores
+    performance_table = get_performance_table()
+    if performance_table is not None and not df.empty:
+        # Catalogue-wide z-scores, comparable across queries
+        scores = performance_table.lookup(df['id'], vertical)
+        df['ctr_z_score'] = scores['ctr_z_score'].to_numpy()
+        df['cpa_z_score'] = scores['cpa_z_score'].to_numpy()
+    elif ctr_column in df.columns and cpa_column in df.columns and df[ctr_column].notna().any() and df[cpa_column].notna().any():
+        # Otherwise z-scores over the retrieved candidates
         df['ctr_z_score'] = calculate_z_score(df[ctr_column].dropna())
         df['cpa_z_score'] = calculate_z_score(df[cpa_column].dropna())
-        
-        # Calculate optimization score based on strategy
-        if optimization_strategy == 'ctr':
-            df['optimization_score'] = df['ctr_z_score']
-        elif optimization_strategy == 'cpa':
-            df['optimization_score'] = -df['cpa_z_score']  # Negative because lower CPA is better
-        else:  # 'composite'
-            df['optimization_score'] = df['ctr_z_score'] - df['cpa_z_score']
+
+    # Check if the z-scores exist and have non-null values
+    if 'ctr_z_score' in df.columns and df['ctr_z_score'].notna().any() and df['cpa_z_score'].notna().any():
+        # Precompute every strategy's score so a strategy switch is a local re-sort
+        for strategy in OPTIMIZATION_STRATEGIES:
+            df[f'{strategy}_optimization_score'] = optimization_score(df['ctr_z_score'], df['cpa_z_score'], strategy)
+        df['optimization_score'] = optimization_score(df['ctr_z_score'], df['cpa_z_score'], optimization_strategy)
         
         # Sort by optimization score (descending) and vector score
         df = df.sort_values(['optimization_score', 'vector_score'], ascending=[False, False], na_position='last').reset_index(drop=True)
@@ -50,32 +92,33 @@ def find_relevant_segments(
         print(f"Warning: {ctr_column} or {cpa_column} not available. Sorting only by vector score.")
         df = df.sort_values('vector_score', ascending=False).reset_index(drop=True)
         df['optimization_score'] = np.nan  # Add an optimization_score column with NaN values
+        for strategy in OPTIMIZATION_STRATEGIES:
+            df[f'{strategy}_optimization_score'] = np.nan
 
-    processed_segments = []
-    segments_searched = 0
-    with ThreadPoolExecutor(max_workers=MAX_RERANK_WORKERS) as executor:
-        futures = [executor.submit(process_single_segment, query, segment) for segment in df.to_dict('records')]
-        
-        for future in as_completed(futures):
-            processed_segment = future.result()
-            optimization_score = df.loc[segments_searched, 'optimization_score']
-            processed_segment['optimization_score'] = optimization_score
-            processed_segments.append(processed_segment)
-            segments_searched += 1
-            
-            print(f"Segment {segments_searched}: Relevance score = {processed_segment['relevance_score']:.4f}, "
-                  f"Optimization score ({optimization_strategy}) = {optimization_score:.4f}")
-            
-            if processed_segment['relevance_score'] >= RELEVANCE_THRESHOLD:
-                executor.shutdown(wait=False, cancel_futures=True)
-                print(f"Found high-relevance segment after searching {segments_searched} segments")
-                return pd.DataFrame([processed_segment])
-    
-    print(f"No high-relevance segment found after searching {segments_searched} segments")
+    return df
+
+def strategy_score_column(optimization_strategy: str) -> str:
+    """The candidate column holding a strategy's optimization score, composite for unknown strategies."""
+    return f"{optimization_strategy if optimization_strategy in OPTIMIZATION_STRATEGIES else 'composite'}_optimization_score"
+
+def optimization_sort_key(segment: Dict) -> tuple:
+    """Sort key preferring higher optimization score, then relevance, with missing scores last."""
+    optimization_score = segment['optimization_score']
+    return (-np.inf if pd.isna(optimization_score) else optimization_score, segment['relevance_score'])
+
+def rerank_priority(df: pd.DataFrame, optimization_strategy: str) -> pd.Series:
+    """Expected payoff of reranking each candidate: a blend of vector and optimization score percentiles."""
+    vector_rank = df['vector_score'].rank(pct=True)
+    optimization_rank = df[strategy_score_column(optimization_strategy)].rank(pct=True).fillna(0)
+    return RERANK_VECTOR_WEIGHT * vector_rank + (1 - RERANK_VECTOR_WEIGHT) * optimization_rank
+
+def select_secondary_segments(processed_segments: List[Dict]) -> pd.DataFrame:
+    """Return the top segments above the secondary threshold when no high-relevance segment was found."""
+    print(f"No high-relevance segment found after searching {len(processed_segments)} segments")
     
     # If no high-relevance segments found, return top 3 segments above secondary threshold
     secondary_segments = [s for s in processed_segments if s['relevance_score'] >= SECONDARY_RELEVANCE_THRESHOLD]
-    secondary_segments.sort(key=lambda x: (x['optimization_score'], x['relevance_score']), reverse=True)
+    secondary_segments.sort(key=optimization_sort_key, reverse=True)
     top_3_secondary = secondary_segments[:2]
     
     if top_3_secondary:
@@ -84,44 +127,239 @@ def find_relevant_segments(
     
     return pd.DataFrame()  # Return empty DataFrame if no high-relevance segment found
 
-def process_audience_segments(audience_json, presearch_filter, top_k, optimization_strategy):
-    results = {'Audience': {}}
-    total_items = sum(len(descriptions) for category in ['included', 'excluded'] 
-                      for descriptions in audience_json['Audience'][category].values())
+def score_wave(query: str, wave: List[Dict], executor: ThreadPoolExecutor) -> List[Dict]:
+    """Score one wave of segments, returning results in the same order as the wave."""
+    if RERANK_MODE == 'listwise':
+        return process_segment_batch(query, wave)
+    if USE_ASYNC_CLIENTS:
+        # Reranks run as tasks on the shared event loop, bounded by the per-provider rate limiter
+        futures = [submit_async(process_single_segment_async(query, segment)) for segment in wave]
+    else:
+        futures = [submit_with_context(executor, process_single_segment, query, segment) for segment in wave]
+    return [future.result() for future in futures]
+
+@traced('rerank_candidates')
+def rerank_strategies(
+    query: str,
+    df: pd.DataFrame,
+    optimization_strategies: Sequence[str],
+    scored: Dict[str, Dict] = None
+) -> Dict[str, List[Dict]]:
+    """
+    Score candidates for relevance to the query and return every scored segment, per strategy.
+    Each strategy's candidates are scored in small waves ordered by its expected payoff, and its
+    waves stop once a segment clears RELEVANCE_THRESHOLD or RERANK_BUDGET is spent. The strategies'
+    waves run in lockstep, with their unscored segments scored together, so a segment several
+    strategies reach is scored once. scored maps segment ids to segments already scored for this
+    query, which are reused rather than scored again; newly scored segments are added to it.
+    """
+    if scored is None:
+        scored = {}
+    wave_size = RERANK_BATCH_SIZE if RERANK_MODE == 'listwise' else RERANK_WAVE_SIZE
+    records = {
+        strategy: df.loc[rerank_priority(df, strategy).sort_values(ascending=False, kind='stable').index].to_dict('records')
+        for strategy in optimization_strategies
+    }
+    budget = min(len(df), RERANK_BUDGET)
+
+    processed_segments = {strategy: [] for strategy in optimization_strategies}
+    active = list(optimization_strategies)
+    newly_scored = 0
+    with ThreadPoolExecutor(max_workers=min(MAX_RERANK_WORKERS, wave_size * len(active))) as executor:
+        for start in range(0, budget, wave_size):
+            if not active:
+                break
+            waves = {strategy: records[strategy][start:min(start + wave_size, budget)] for strategy in active}
+            unscored = list({segment['id']: segment for wave in waves.values() for segment in wave if segment['id'] not in scored}.values())
+            if unscored:
+                for processed_segment in score_wave(query, unscored, executor):
+                    scored[processed_segment['id']] = processed_segment
+                newly_scored += len(unscored)
+
+            for strategy, wave in waves.items():
+                wave_segments = [scored[segment['id']] for segment in wave]
+                processed_segments[strategy].extend(wave_segments)
+                score_column = strategy_score_column(strategy)
+                for position, processed_segment in enumerate(wave_segments, start + 1):
+                    print(f"Segment {position}: Relevance score = {processed_segment['relevance_score']:.4f}, "
+                          f"Optimization score ({strategy}) = {processed_segment[score_column]:.4f}")
+
+                if any(s['relevance_score'] >= RELEVANCE_THRESHOLD for s in wave_segments):
+                    print(f"Found high-relevance segment for {strategy} after searching {len(processed_segments[strategy])} segments")
+                    active.remove(strategy)
     
-    progress_bar = st.progress(0)
-    processed_items = 0
+    set_attribute('candidates', len(df))
+    set_attribute('strategies', len(processed_segments))
+    set_attribute('scored', newly_scored)
+    set_attribute('reused', sum(map(len, processed_segments.values())) - newly_scored)
+    return processed_segments
 
-    def process_item(item, category, group, optimization_strategy):
-        query = item['description']
-        relevant_segment = find_relevant_segments(query, presearch_filter, top_k, optimization_strategy=optimization_strategy)
-        return {
-            'description': query,
-            'ActualSegments': relevant_segment.to_dict('records') if not relevant_segment.empty else [],
-            'category': category,
-            'group': group
-        }
+def rerank_candidates(
+    query: str,
+    df: pd.DataFrame,
+    optimization_strategy: Literal['ctr', 'cpa', 'composite'] = 'composite',
+    scored: Dict[str, Dict] = None
+) -> List[Dict]:
+    """rerank_strategies for a single strategy."""
+    return rerank_strategies(query, df, [optimization_strategy], scored)[optimization_strategy]
+
+def select_segments(
+    processed_segments: List[Dict],
+    optimization_strategy: Literal['ctr', 'cpa', 'composite'] = 'composite'
+) -> pd.DataFrame:
+    """
+    Pick the best scored segments for a strategy: the best segment above RELEVANCE_THRESHOLD,
+    else the best above the secondary threshold. Needs no API calls.
+    """
+    score_column = strategy_score_column(optimization_strategy)
+    segments = [{**s, 'optimization_score': s.get(score_column, np.nan)} for s in processed_segments]
+    high_relevance = [s for s in segments if s['relevance_score'] >= RELEVANCE_THRESHOLD]
+    if high_relevance:
+        return pd.DataFrame([max(high_relevance, key=optimization_sort_key)])
+    return select_secondary_segments(segments)
+
+def find_relevant_segments(
+    query: str, 
+    presearch_filter: dict, 
+    top_k: int, 
+    vertical: str = 'overall', 
+    optimization_strategy: Literal['ctr', 'cpa', 'composite'] = 'composite'
+) -> pd.DataFrame:
+    query_embedding = generate_embedding(query)
+    df = fetch_candidates(query_embedding, presearch_filter, top_k, vertical, optimization_strategy)
+    return select_segments(rerank_candidates(query, df, optimization_strategy), optimization_strategy)
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        for category in ['included', 'excluded']:
-            results['Audience'][category] = {}
-            for group, descriptions in audience_json['Audience'][category].items():
-                futures.extend([executor.submit(process_item, item, category, group, optimization_strategy) for item in descriptions])
+def search_cache_key(query: str, presearch_filter: dict, top_k: int) -> Tuple[str, str, int]:
+    """Scored segments depend on the description, filter and top_k, not on the optimization strategy."""
+    return (query, json.dumps(presearch_filter, sort_keys=True), top_k)
 
+def rerank_description(query: str, df: pd.DataFrame) -> Dict:
+    """
+    Rerank a description's candidates for every strategy and return its search cache entry:
+    the retained candidates, every segment scored so far by id, and the segments each
+    strategy's waves scored, so a strategy switch is a local re-sort.
+    """
+    scored = {}
+    return {'candidates': df, 'scored': scored, 'reranked': rerank_strategies(query, df, OPTIMIZATION_STRATEGIES, scored)}
+
+def reranked_segments(query: str, entry: Dict, optimization_strategy) -> List[Dict]:
+    """
+    The segments a strategy's waves scored for a search cache entry. Every strategy in
+    OPTIMIZATION_STRATEGIES is reranked with the search; any other strategy's waves run the
+    first time it is asked for, scoring only candidates no earlier strategy reached.
+    """
+    if optimization_strategy not in entry['reranked']:
+        entry['reranked'][optimization_strategy] = rerank_candidates(query, entry['candidates'], optimization_strategy, entry['scored'])
+    return entry['reranked'][optimization_strategy]
+
+def search_per_description(items: List[Tuple[str, str, str]], presearch_filter, top_k, optimization_strategy) -> Iterator[Tuple[Tuple[str, str, str], List[Dict]]]:
+    """Run embed -> query -> rerank serially for each description, several descriptions at a time."""
+    def process_item(query):
+        with span('search_description', description=query):
+            query_embedding = generate_embedding(query)
+            df = fetch_candidates(query_embedding, presearch_filter, top_k, optimization_strategy=optimization_strategy)
+            return rerank_description(query, df)
+
+    with ThreadPoolExecutor(max_workers=SEARCH_WORKERS) as executor:
+        futures = {submit_with_context(executor, process_item, item[0]): item for item in items}
         for future in as_completed(futures):
-            result = future.result()
-            category, group = result['category'], result['group']
-            if group not in results['Audience'][category]:
-                results['Audience'][category][group] = []
-            results['Audience'][category][group].append({
-                'description': result['description'],
-                'ActualSegments': result['ActualSegments']
-            })
-            processed_items += 1
-            progress_bar.progress(processed_items / total_items)
-
-    progress_bar.empty()  # Remove the progress bar when done
+            yield futures[future], future.result()
+
+def search_pipelined(items: List[Tuple[str, str, str]], presearch_filter, top_k, optimization_strategy) -> Iterator[Tuple[Tuple[str, str, str], List[Dict]]]:
+    """Embed every description in one batch, query them concurrently and stream candidates into reranking."""
+    if not items:
+        return
+    embeddings = generate_embeddings([query for query, _, _ in items])
+
+    with ThreadPoolExecutor(max_workers=QUERY_STAGE_WORKERS) as query_executor, \
+            ThreadPoolExecutor(max_workers=RERANK_STAGE_WORKERS) as rerank_executor:
+        query_futures = {
+            submit_with_context(query_executor, fetch_candidates, embedding, presearch_filter, top_k, optimization_strategy=optimization_strategy): item
+            for item, embedding in zip(items, embeddings)
+        }
+        rerank_futures = {}
+        for future in as_completed(query_futures):
+            item = query_futures[future]
+            rerank_futures[submit_with_context(rerank_executor, rerank_description, item[0], future.result())] = item
+
+        for future in as_completed(rerank_futures):
+            yield rerank_futures[future], future.result()
+
+def audience_items(audience_json) -> List[Tuple[str, str, str]]:
+    """(description, category, group) for every description in the audience."""
+    items = []
+    for category in ['included', 'excluded']:
+        for group, descriptions in audience_json['Audience'][category].items():
+            items.extend((item['description'], category, group) for item in descriptions)
+    return items
+
+def assemble_results(items: List[Tuple[str, str, str]], presearch_filter, top_k, optimization_strategy, search_cache) -> Dict:
+    """
+    Build the processed audience from the entries in search_cache. Makes no API calls for any
+    strategy in OPTIMIZATION_STRATEGIES, which were all reranked with the search.
+    """
+    results = {'Audience': {'included': {}, 'excluded': {}}}
+    for query, category, group in items:
+        entry = search_cache[search_cache_key(query, presearch_filter, top_k)]
+        relevant_segment = select_segments(reranked_segments(query, entry, optimization_strategy), optimization_strategy)
+        results['Audience'][category].setdefault(group, []).append({
+            'description': query,
+            'ActualSegments': relevant_segment.to_dict('records') if not relevant_segment.empty else []
+        })
+    return results
+
+def reselect_audience_segments(audience_json, presearch_filter, top_k, optimization_strategy, search_cache):
+    """
+    Re-select segments for another optimization strategy without searching or scoring again,
+    or None if any description still needs searching.
+    """
+    items = audience_items(audience_json)
+    if not search_cache or any(search_cache_key(query, presearch_filter, top_k) not in search_cache for query, _, _ in items):
+        return None
+    return assemble_results(items, presearch_filter, top_k, optimization_strategy, search_cache)
+
+def pending_descriptions(items: List[Tuple[str, str, str]], presearch_filter, top_k, search_cache) -> List[str]:
+    """Descriptions without scored segments in search_cache, each once and in audience order."""
+    return list(dict.fromkeys(query for query, _, _ in items if search_cache_key(query, presearch_filter, top_k) not in search_cache))
+
+def search_descriptions(descriptions: List[str], presearch_filter, top_k, optimization_strategy, search_cache, progress: Callable[[float], None]):
+    """Search descriptions and store their search cache entries in search_cache."""
+    search = search_pipelined if SEARCH_MODE == 'pipelined' else search_per_description
+    processed_items = 0
+    for (query, _, _), entry in search([(query, None, None) for query in descriptions], presearch_filter, top_k, optimization_strategy):
+        search_cache[search_cache_key(query, presearch_filter, top_k)] = entry
+        processed_items += 1
+        progress(processed_items / max(len(descriptions), 1))
+    score_cache.flush_stats()
+
+@traced()
+def process_audience_segments(audience_json, presearch_filter, top_k, optimization_strategy, search_cache=None, progress: Callable[[float], None] = None):
+    """
+    Find actual segments for every audience description. Scored segments are kept in
+    search_cache, so after an edit only new or changed descriptions are searched again.
+    progress is called with the fraction of descriptions searched, and defaults to a
+    progress bar in the app.
+    """
+    if search_cache is None:
+        search_cache = {}
+    items = audience_items(audience_json)
+    total_items = len(items)
+    
+    progress_bar = None
+    if progress is None:
+        progress_bar = st.progress(0)
+        progress = progress_bar.progress
+
+    pending = pending_descriptions(items, presearch_filter, top_k, search_cache)
+    print(f"Searching {len(pending)} of {total_items} descriptions, reusing cached results for the rest")
+    set_attribute('descriptions', total_items)
+    set_attribute('cache_hits', total_items - len(pending))
+    search_descriptions(pending, presearch_filter, top_k, optimization_strategy, search_cache, progress)
+
+    results = assemble_results(items, presearch_filter, top_k, optimization_strategy, search_cache)
+
+    if progress_bar is not None:
+        progress_bar.empty()  # Remove the progress bar when done
     return results
 
 def summarize_segments(processed_results):
@@ -0,0 +1,241 @@
+"""
+Background jobs for the long-running search, report and methodology stages.
+
+Jobs run in a local pool of worker processes and are recorded in a SQLite job table, so
+they outlive the script run that submitted them: reruns, refreshes and widget interactions
+only poll the table. A job's id is the hash of its kind and input, so an identical request
+from any session joins the job already queued, running or finished instead of starting
+another. Finished results are kept for JOB_RESULT_TTL_HOURS.
+"""
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+from config.settings import JOB_DB_PATH, JOB_WORKERS, JOB_RESULT_TTL_HOURS
+from .tracing import span, take_trace
+
+JOB_FIELDS = ('id', 'kind', 'status', 'progress', 'error', 'created', 'updated')
+
+def job_id(kind: str, payload: Dict[str, Any]) -> str:
+    """Hash of the canonical JSON of the job's kind and input."""
+    canonical = json.dumps({'kind': kind, 'payload': payload}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobStore:
+    """
+    The job table. Every state change is a single conditional statement, so server and
+    worker processes sharing the file never both claim or create the same job.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs "
+                "(id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "progress REAL NOT NULL DEFAULT 0, result BLOB, spans TEXT, error TEXT, worker_pid INTEGER, "
+                "created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            if 'spans' not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+                try:
+                    self._conn.execute("ALTER TABLE jobs ADD COLUMN spans TEXT")
+                except sqlite3.OperationalError:
+                    pass # Another process added it first
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_sessions (job_id TEXT NOT NULL, session_id TEXT NOT NULL, PRIMARY KEY (job_id, session_id))"
+            )
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def create(self, id: str, kind: str, payload: Dict[str, Any], session_id: str, retry_failed: bool, result_ttl_seconds: float) -> bool:
+        """Record the job for the session. True if it was new, failed (when retrying) or stale and now needs running."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO job_sessions (job_id, session_id) VALUES (?, ?)", (id, session_id))
+            created = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, payload, status, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (id, kind, json.dumps(payload, default=str), now, now)
+            ).rowcount
+            if created:
+                return True
+            return bool(self._conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0, result = NULL, spans = NULL, error = NULL, worker_pid = NULL, updated = ? "
+                "WHERE id = ? AND ((status = 'failed' AND ?) OR (status = 'done' AND updated < ?))",
+                (now, id, retry_failed, now - result_ttl_seconds)
+            ).rowcount)
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        """The job's status and progress, without its payload or result."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (id,)).fetchone()
+        return dict(zip(JOB_FIELDS, row)) if row else None
+
+    def result(self, id: str) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ? AND status = 'done'", (id,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def spans(self, id: str) -> List[Dict[str, Any]]:
+        """The finished spans the worker recorded for a done job."""
+        with self._lock:
+            row = self._conn.execute("SELECT spans FROM jobs WHERE id = ? AND status = 'done'", (id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def jobs_for_session(self, session_id: str) -> List[Dict[str, Any]]:
+        """Every job the session submitted or joined, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join('jobs.' + field for field in JOB_FIELDS)} FROM jobs JOIN job_sessions ON jobs.id = job_sessions.job_id "
+                "WHERE job_sessions.session_id = ? ORDER BY jobs.created DESC", (session_id,)
+            ).fetchall()
+        return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+    def claim(self, id: str) -> Optional[tuple]:
+        """Mark a queued job running in this process and return (kind, payload), or None if another worker has it."""
+        if not self._execute("UPDATE jobs SET status = 'running', worker_pid = ?, updated = ? WHERE id = ? AND status = 'queued'",
+                             (os.getpid(), time.time(), id)).rowcount:
+            return None
+        with self._lock:
+            kind, payload = self._conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (id,)).fetchone()
+        return kind, json.loads(payload)
+
+    def set_progress(self, id: str, progress: float):
+        self._execute("UPDATE jobs SET progress = ?, updated = ? WHERE id = ? AND status = 'running'", (min(max(progress, 0), 1), time.time(), id))
+
+    def finish(self, id: str, result: Any, spans: List[Dict[str, Any]] = ()):
+        self._execute("UPDATE jobs SET status = 'done', progress = 1, result = ?, spans = ?, updated = ? WHERE id = ?",
+                      (pickle.dumps(result), json.dumps(list(spans), default=str), time.time(), id))
+
+    def fail(self, id: str, error: str):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ? AND status != 'done'", (error, time.time(), id))
+
+    def orphaned(self) -> List[str]:
+        """Queued jobs, and running jobs whose worker has died, e.g. after a server restart."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, status, worker_pid FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        orphans = [id for id, status, pid in rows if status == 'queued' or not _pid_alive(pid)]
+        for id in orphans:
+            self._execute("UPDATE jobs SET status = 'queued', worker_pid = NULL, updated = ? WHERE id = ?", (time.time(), id))
+        return orphans
+
+def _search_job(payload: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    from .audience_search import search_descriptions
+    search_cache = {}
+    search_descriptions(
+        payload['descriptions'], payload['presearch_filter'], payload['top_k'], payload['optimization_strategy'],
+        search_cache, progress
+    )
+    return {'search_cache': search_cache}
+
+def _report_job(payload: Dict[str, Any], progress: Callable[[float], None]) -> str:
+    from .report_generation import generate_audience_report
+    return generate_audience_report(payload['summary_json'], payload['company_name'], payload['conversation_history'], stream=False)
+
+def _methodology_job(payload: Dict[str, Any], progress: Callable[[float], None]) -> List[Dict[str, Any]]:
+    from .researcher import generate_segment_summaries
+    return generate_segment_summaries(payload['segments'], progress=progress)
+
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any], Callable[[float], None]], Any]] = {
+    'search': _search_job,
+    'report': _report_job,
+    'methodology': _methodology_job,
+}
+
+_worker_store = None
+
+def _run_job(path: str, id: str):
+    """Worker process entry point."""
+    global _worker_store
+    if _worker_store is None:
+        _worker_store = JobStore(path)
+    claimed = _worker_store.claim(id)
+    if claimed is None:
+        return
+    kind, payload = claimed
+    try:
+        with span('job', kind=kind, job_id=id) as job_span:
+            result = JOB_HANDLERS[kind](payload, lambda fraction: _worker_store.set_progress(id, fraction))
+    except Exception as e:
+        _worker_store.fail(id, f"{type(e).__name__}: {e}")
+        return
+    # The server's debug panel only sees its own process's traces, so the job's goes with the result
+    _worker_store.finish(id, result, take_trace(job_span.trace_id) if job_span is not None else [])
+
+class JobQueue:
+    def __init__(self, path: str, workers: int, result_ttl_seconds: float):
+        self.path = path
+        self.workers = workers
+        self.result_ttl_seconds = result_ttl_seconds
+        self.store = JobStore(path)
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        for id in self.store.orphaned():
+            self._dispatch(id)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Forking the multithreaded server process could copy held locks, so workers are spawned
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _dispatch(self, id: str):
+        with self._executor_lock:
+            try:
+                future = self._executor.submit(_run_job, self.path, id)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory), which breaks the whole pool
+                self._executor = self._new_executor()
+                future = self._executor.submit(_run_job, self.path, id)
+
+        def on_done(future):
+            if future.exception() is not None:
+                self.store.fail(id, f"Worker failed: {future.exception()!r}")
+        future.add_done_callback(on_done)
+
+    def submit(self, kind: str, payload: Dict[str, Any], session_id: str, retry_failed: bool = False) -> str:
+        """Queue a job, or join the identical one already queued, running or finished. Returns its id."""
+        id = job_id(kind, payload)
+        if self.store.create(id, kind, payload, session_id, retry_failed, self.result_ttl_seconds):
+            self._dispatch(id)
+        return id
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(id)
+
+    def result(self, id: str) -> Any:
+        return self.store.result(id)
+
+    def spans(self, id: str) -> List[Dict[str, Any]]:
+        return self.store.spans(id)
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Start the worker pool once per server process."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JOB_DB_PATH, JOB_WORKERS, JOB_RESULT_TTL_HOURS * 60 * 60)
+        return _job_queue
@@ -0,0 +1,107 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List
+from .tracing import set_attribute
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_OVERHEAD_TOKENS = 4 # Role and separator tokens added per chat message
+SUMMARY_HEADER = "Summary of earlier turns omitted from this conversation:\n"
+SUMMARY_TURN_CHARS = 300 # Characters kept from each omitted user turn
+
+_stats_lock = threading.Lock()
+_stats = {'calls': 0, 'tokens_sent': 0, 'tokens_dropped': 0, 'trimmed_calls': 0}
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model.split('/')[-1])
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+@lru_cache(maxsize=8192)
+def _count_text_tokens(model: str, text: str) -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(message: Dict[str, str], model: str) -> int:
+    """Tokens used by one chat message. Counts are cached per message text."""
+    return _count_text_tokens(model, message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+
+def summarize_turns(messages: List[Dict[str, str]], model: str, max_tokens: int) -> Dict[str, str]:
+    """Compress omitted turns into one message listing what the user asked for, most recent last."""
+    lines = []
+    for message in messages:
+        if message['role'] != 'user':
+            continue
+        content = ' '.join((message.get('content') or '').split())
+        lines.append(f"- {content[:SUMMARY_TURN_CHARS]}{'...' if len(content) > SUMMARY_TURN_CHARS else ''}")
+
+    # Keep the most recent requests that fit
+    kept, used = [], _count_text_tokens(model, SUMMARY_HEADER) + MESSAGE_OVERHEAD_TOKENS
+    for line in reversed(lines):
+        line_tokens = _count_text_tokens(model, line) + 1
+        if used + line_tokens > max_tokens:
+            break
+        kept.append(line)
+        used += line_tokens
+    return {"role": "user", "content": SUMMARY_HEADER + "\n".join(reversed(kept))}
+
+def fit_context(history: List[Dict[str, str]], model: str, token_budget: int, num_first: int, summary_tokens: int) -> List[Dict[str, str]]:
+    """
+    Select messages that fit token_budget: the first num_first messages, then as many
+    recent messages as fit, with the turns in between compressed into a summary.
+    The latest message is always sent.
+    """
+    counts = [count_message_tokens(message, model) for message in history]
+    total = sum(counts)
+    if total <= token_budget or len(history) <= num_first + 1:
+        _record(total, 0, trimmed=False)
+        return history
+
+    head = history[:num_first]
+    used = sum(counts[:num_first]) + summary_tokens
+    start = len(history)
+    while start > num_first and (start == len(history) or used + counts[start - 1] <= token_budget):
+        start -= 1
+        used += counts[start]
+
+    # Keep user/assistant pairs together so the tail never opens on an orphaned reply
+    if start < len(history) - 1 and history[start]['role'] == 'assistant':
+        start += 1
+
+    dropped = history[num_first:start]
+    context = head
+    if dropped:
+        context = head + [summarize_turns(dropped, model, summary_tokens)]
+    context = context + history[start:]
+    sent = sum(count_message_tokens(message, model) for message in context)
+    _record(sent, total - sent, trimmed=True)
+    return context
+
+def _record(tokens_sent: int, tokens_dropped: int, trimmed: bool):
+    with _stats_lock:
+        _stats['calls'] += 1
+        _stats['tokens_sent'] += tokens_sent
+        _stats['tokens_dropped'] += max(tokens_dropped, 0)
+        _stats['trimmed_calls'] += trimmed
+    set_attribute('context_tokens', tokens_sent)
+    set_attribute('context_tokens_dropped', max(tokens_dropped, 0))
+    logger.info(f"Context: {tokens_sent} tokens sent, {max(tokens_dropped, 0)} tokens summarized or dropped")
+
+def get_stats() -> Dict[str, float]:
+    """Totals of tokens sent per call since startup."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['avg_tokens_sent'] = stats['tokens_sent'] / stats['calls'] if stats['calls'] else 0
+    return stats
@@ -3,7 +3,19 @@ import json
 import re
 import time
 import streamlit as st
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Declared schema of the segment index metadata. Text fields are never JSON-decoded,
+# other string fields are only decoded when they hold a JSON object, and columns with
+# these suffixes are converted to floats up front.
+SEGMENT_TEXT_FIELDS = frozenset(['id', 'Name', 'BrandName', 'raw_string', 'Description', 'FullPath'])
+SEGMENT_FLOAT_SUFFIXES = ('_ctr', '_cpa', '_cpm', '_Amount')
 
 def extract_and_correct_json(text):
     # Try to find JSON content enclosed in triple backticks first
@@ -47,6 +59,74 @@ def extract_and_correct_json(text):
         print(json_string)
         return None
     
+class IncrementalJSONParser:
+    """
+    Parse a JSON object while it is still streaming in.
+
+    feed() scans only the new characters, tracking open brackets and strings, and
+    remembers the last point where the object could be cut and closed cleanly.
+    value() returns the partial object as if the stream ended now.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.start = -1
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.safe_end = -1
+        self.safe_stack = []
+
+    def feed(self, chunk: str):
+        offset = len(self.text)
+        self.text += chunk
+        for i, ch in enumerate(chunk, offset):
+            if self.start < 0:
+                if ch == '{':
+                    self.start = i
+                    self.stack.append('}')
+                    self._mark_safe(i + 1)
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.stack.append('}' if ch == '{' else ']')
+                self._mark_safe(i + 1)
+            elif ch in '}]':
+                if self.stack:
+                    self.stack.pop()
+                self._mark_safe(i + 1)
+            elif ch == ',':
+                self._mark_safe(i)
+
+    def _mark_safe(self, end: int):
+        self.safe_end = end
+        self.safe_stack = list(self.stack)
+
+    def value(self):
+        """The object parsed so far, or None if no object has started."""
+        if self.start < 0:
+            return None
+        closers = ''.join(reversed(self.stack))
+        candidate = self.text[self.start:]
+        if self.in_string:
+            candidate = (candidate[:-1] if self.escape else candidate) + '"'
+        try:
+            return json.loads(candidate + closers)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return json.loads(self.text[self.start:self.safe_end] + ''.join(reversed(self.safe_stack)))
+        except json.JSONDecodeError:
+            return None
+
 def validate_audience_segments(json_data: Dict[str, Any]) -> bool:
     """
     Validate the number of segments in the audience JSON.
@@ -88,39 +168,47 @@ def flatten_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def results_to_dataframe(results):
-    data = []
-    for match in results.get('matches', []):  # Access 'matches' key from results dictionary
-        row = {
-            'id': match['id'],
-            'vector_score': match['score']
-        }
-        
-        # Handle metadata
-        metadata = match.get('metadata', {})
-        flattened_metadata = flatten_dict(metadata)
-        
-        # Create a new dictionary to store processed values
-        processed_metadata = {}
-        
-        # Handle potential JSON strings in metadata
-        for key, value in flattened_metadata.items():
-            if isinstance(value, str):
+def decode_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten one match's metadata, JSON-decoding only fields that hold encoded objects."""
+    decoded = {}
+    for key, value in metadata.items():
+        if isinstance(value, str):
+            if key not in SEGMENT_TEXT_FIELDS and value[:1] == '{':
                 try:
-                    parsed_value = json.loads(value)
-                    if isinstance(parsed_value, dict):
-                        processed_metadata.update(flatten_dict(parsed_value, parent_key=key))
-                    else:
-                        processed_metadata[key] = value
-                except json.JSONDecodeError:
-                    processed_metadata[key] = value
-            else:
-                processed_metadata[key] = value
-        
-        row.update(processed_metadata)
-        data.append(row)
-    
-    df = pd.DataFrame(data)
+                    parsed_value = json_loads(value)
+                except ValueError:
+                    parsed_value = None
+                if isinstance(parsed_value, dict):
+                    decoded.update(flatten_dict(parsed_value, parent_key=key))
+                    continue
+            decoded[key] = value
+        elif isinstance(value, dict):
+            decoded.update(decode_metadata(flatten_dict(value, parent_key=key)))
+        elif isinstance(value, list):
+            decoded[key] = json.dumps(value)
+        else:
+            decoded[key] = value
+    return decoded
+
+def results_to_dataframe(results):
+    matches = results.get('matches', [])  # Access 'matches' key from results dictionary
+    num_matches = len(matches)
+
+    # Build columns directly instead of a list of row dicts
+    columns: Dict[str, List[Any]] = {'id': [None] * num_matches, 'vector_score': [None] * num_matches}
+    for i, match in enumerate(matches):
+        columns['id'][i] = match['id']
+        columns['vector_score'][i] = match['score']
+        for key, value in decode_metadata(match.get('metadata') or {}).items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * num_matches
+            column[i] = value
+
+    df = pd.DataFrame(columns)
+    for column in df.columns:
+        if column.endswith(SEGMENT_FLOAT_SUFFIXES):
+            df[column] = pd.to_numeric(df[column], errors='coerce')
     return df
 
 
@@ -1,12 +1,99 @@
-from config.settings import EMBEDDING_MODEL
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+from config.settings import (
+    EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW,
+    EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_CAPACITY
+)
 from .api_clients import openai_client
+from .embedding_cache import EmbeddingCache
+from .tracing import traced, set_attribute
+from .single_flight import SingleFlight
 
-def generate_embedding(text: str) -> list[float]:
-    """Generate an embedding for the given text."""
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_CACHE_CAPACITY)
+
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    """Embed a batch of texts in a single API call and store them in the cache."""
     response = openai_client.embeddings.create(
         model=EMBEDDING_MODEL,
-        input=[text],
+        input=texts,
         encoding_format="float",
-        dimensions=256
+        dimensions=EMBEDDING_DIMENSIONS
     )
-    return response.data[0].embedding
\ No newline at end of file
+    embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    embedding_cache.put_many(texts, embeddings)
+    return embeddings
+
+class EmbeddingBatcher:
+    """Coalesce concurrent single-text embedding requests into multi-input API calls."""
+
+    def __init__(self, max_batch_size: int, window: float):
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._pending: Dict[str, List[Future]] = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        batch = None
+        with self._lock:
+            self._pending.setdefault(text, []).append(future)
+            if len(self._pending) >= self.max_batch_size:
+                batch = self._take_pending()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._dispatch(batch)
+        return future
+
+    def _take_pending(self) -> Dict[str, List[Future]]:
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: Dict[str, List[Future]]):
+        texts = list(batch)
+        try:
+            embeddings = embed_batch(texts)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+        for text, embedding in zip(texts, embeddings):
+            for future in batch[text]:
+                future.set_result(embedding)
+
+embedding_batcher = EmbeddingBatcher(EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WINDOW)
+embedding_flight = SingleFlight('generate_embedding') # A text whose batch is already in flight joins it rather than starting another
+
+@traced()
+def generate_embedding(text: str) -> list[float]:
+    """Generate an embedding for the given text."""
+    cached = embedding_cache.get(text)
+    set_attribute('cache_hit', cached is not None)
+    if cached is not None:
+        return cached
+    return embedding_flight.do(text, lambda: embedding_batcher.submit(text).result())
+
+@traced()
+def generate_embeddings(texts: List[str]) -> List[List[float]]:
+    """Generate embeddings for many texts, only sending cache misses to the API."""
+    embeddings = {text: embedding_cache.get(text) for text in set(texts)}
+    missing = [text for text, embedding in embeddings.items() if embedding is None]
+    set_attribute('cache_hits', len(embeddings) - len(missing))
+    for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+        batch = missing[start:start + EMBEDDING_BATCH_SIZE]
+        embeddings.update(zip(batch, embed_batch(batch)))
+    return [embeddings[text] for text in texts]
@@ -0,0 +1,94 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from typing import List, Optional, Sequence
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache backed by a memory-mapped float32 matrix.
+
+    Each (model, dimensions) pair gets its own matrix file, and rows are addressed
+    by sha256(text). The slot index is a SQLite table shared by every process using
+    the cache (the server and the job workers). Each lookup or write holds its write
+    lock while touching the matrix, so no process reads a row another is overwriting.
+    Least recently used rows are overwritten once the matrix is full.
+    """
+
+    def __init__(self, cache_dir: str, model: str, dimensions: int, capacity: int):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model = model
+        self.dimensions = dimensions
+        self.capacity = capacity
+        prefix = f"{model}-{dimensions}"
+        self._matrix_path = os.path.join(cache_dir, f"{prefix}.f32")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, f"{prefix}.sqlite"), check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slots (key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS slots_used ON slots (used)")
+
+        expected_size = capacity * dimensions * np.dtype(np.float32).itemsize
+        with self._transaction():
+            reuse = os.path.exists(self._matrix_path) and os.path.getsize(self._matrix_path) == expected_size
+            if not reuse:
+                # A new matrix invalidates every slot recorded against the old one
+                self._conn.execute("DELETE FROM slots")
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode='r+' if reuse else 'w+', shape=(capacity, dimensions))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Hold the thread lock and SQLite's write lock, committing on success and rolling back on error."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding for text, or None on a miss."""
+        key = self.key(text)
+        with self._transaction():
+            row = self._conn.execute("SELECT slot FROM slots WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE slots SET used = ? WHERE key = ?", (time.time(), key))
+            return self._matrix[row[0]].tolist()
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]]):
+        """Store embeddings for texts, evicting least recently used rows when full."""
+        with self._transaction():
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                slot = self._allocate(key)
+                self._matrix[slot] = np.asarray(embedding, dtype=np.float32)
+                self._conn.execute("INSERT OR REPLACE INTO slots (key, slot, used) VALUES (?, ?, ?)", (key, slot, time.time()))
+            self._matrix.flush()
+
+    def _allocate(self, key: str) -> int:
+        """The key's current slot, the next unused one, or the least recently used one, which is freed."""
+        row = self._conn.execute("SELECT slot FROM slots WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        # Slots are only reused, never released, so the used ones are always 0..n-1
+        used = self._conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+        if used < self.capacity:
+            return used
+        oldest_key, slot = self._conn.execute("SELECT key, slot FROM slots ORDER BY used LIMIT 1").fetchone()
+        self._conn.execute("DELETE FROM slots WHERE key = ?", (oldest_key,))
+        return slot
+
@@ -0,0 +1,71 @@
+"""
+Build the catalogue-wide performance table served by PerformanceTable.
+
+Run from the prod directory:
+    python -m src.export_performance_table [--source snapshot|pinecone] [--output PATH]
+
+Reads every segment's CTR/CPA per vertical, either from the local index snapshot
+(see src/index_snapshot.py) or directly from pinecone, and writes global z-scores
+and normalized scores for 'overall' and every vertical in PERFORMANCE_VERTICALS.
+"""
+import os
+import json
+import argparse
+from typing import Any, Dict, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from config.settings import LOCAL_INDEX_DIR, PERFORMANCE_TABLE_PATH, PERFORMANCE_VERTICALS
+from .data_processing import decode_metadata
+from .local_index import METADATA_FILE
+from .performance_table import build_performance_frame, write_performance_table
+
+def vertical_keys() -> List[str]:
+    """Metadata keys holding per-vertical metrics, e.g. 'overall' and 'retail'."""
+    return ['overall'] + [vertical.lower() for vertical in PERFORMANCE_VERTICALS]
+
+def iter_snapshot_metadata(snapshot_dir: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    frame = pd.read_parquet(os.path.join(snapshot_dir, METADATA_FILE), columns=['id', 'metadata_json'])
+    for record_id, metadata_json in zip(frame['id'], frame['metadata_json']):
+        yield record_id, json.loads(metadata_json)
+
+def iter_pinecone_metadata() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    from .index_snapshot import iter_index_records
+    from .pinecone_utils import index
+    for record_id, _, metadata in iter_index_records(index):
+        yield record_id, metadata
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def collect_metrics(records: Iterator[Tuple[str, Dict[str, Any]]], keys: List[str]) -> Tuple[List[str], Dict[str, Dict[str, np.ndarray]]]:
+    """Raw CTR and CPA per vertical, aligned with the returned ids (NaN where a segment has no data)."""
+    ids = []
+    values = {key: {'ctr': [], 'cpa': []} for key in keys}
+    for record_id, metadata in records:
+        decoded = decode_metadata(metadata)
+        ids.append(record_id)
+        for key in keys:
+            for metric in ('ctr', 'cpa'):
+                values[key][metric].append(_to_float(decoded.get(f'{key}_{metric}')))
+        if len(ids) % 50000 == 0:
+            print(f"Read {len(ids)} segments")
+    metrics = {key: {metric: np.asarray(series, dtype=np.float64) for metric, series in fields.items()} for key, fields in values.items()}
+    return ids, metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the segment performance z-score table.")
+    parser.add_argument("--source", choices=['snapshot', 'pinecone'], default='snapshot')
+    parser.add_argument("--snapshot", default=LOCAL_INDEX_DIR)
+    parser.add_argument("--output", default=PERFORMANCE_TABLE_PATH)
+    args = parser.parse_args()
+
+    records = iter_snapshot_metadata(args.snapshot) if args.source == 'snapshot' else iter_pinecone_metadata()
+    ids, metrics = collect_metrics(records, vertical_keys())
+    write_performance_table(args.output, build_performance_frame(ids, metrics))
+    print(f"Wrote performance table for {len(ids)} segments to {args.output}")
+
+if __name__ == '__main__':
+    main()
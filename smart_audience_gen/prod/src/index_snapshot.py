@@ -0,0 +1,91 @@
+"""
+Export the pinecone segment index into a local snapshot served by LocalSegmentIndex.
+
+Run from the prod directory:
+    python -m src.index_snapshot [--output DIR] [--batch-size N] [--no-hnsw]
+
+The snapshot is written to a temporary directory and swapped in when complete,
+so re-running the tool syncs the mirror without disturbing running apps.
+"""
+import os
+import json
+import shutil
+import argparse
+from typing import Any, Dict, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from config.settings import EMBEDDING_DIMENSIONS, LOCAL_INDEX_DIR
+from .local_index import normalize, hnswlib, VECTORS_FILE, METADATA_FILE, HNSW_FILE
+from .segment_processing import is_non_us, segment_location_text
+
+def iter_index_records(index, batch_size: int = 1000) -> Iterator[Tuple[str, List[float], Dict[str, Any]]]:
+    """Yield (id, values, metadata) for every record in a serverless pinecone index."""
+    for ids in index.list(limit=min(batch_size, 100)):
+        fetched = index.fetch(ids=list(ids))
+        for record_id, record in fetched.vectors.items():
+            yield record_id, record.values, dict(record.metadata or {})
+
+def build_metadata_frame(ids: List[str], metadata: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Build the columnar metadata store: scalar fields as filter columns plus the raw metadata."""
+    scalar_rows = [
+        {key: value for key, value in item.items() if isinstance(value, (str, int, float, bool))}
+        for item in metadata
+    ]
+    df = pd.DataFrame(scalar_rows)
+    for column in df.columns:
+        if df[column].dtype == object and not df[column].map(lambda v: v is None or isinstance(v, str)).all():
+            df[column] = df[column].map(lambda v: v if v is None else str(v))
+    df.insert(0, 'id', ids)
+    df['metadata_json'] = [json.dumps(item) for item in metadata]
+    return df
+
+def write_snapshot(output_dir: str, ids: List[str], vectors: np.ndarray, metadata: List[Dict[str, Any]], build_hnsw: bool = True):
+    """Write vectors, metadata and (optionally) an HNSW graph to output_dir atomically."""
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    vectors = normalize(vectors.astype(np.float32))
+    np.save(os.path.join(tmp_dir, VECTORS_FILE), vectors)
+    build_metadata_frame(ids, metadata).to_parquet(os.path.join(tmp_dir, METADATA_FILE), index=False)
+
+    if build_hnsw and hnswlib is not None:
+        hnsw = hnswlib.Index(space='ip', dim=vectors.shape[1])
+        hnsw.init_index(max_elements=len(ids), ef_construction=200, M=32)
+        hnsw.add_items(vectors, np.arange(len(ids)))
+        hnsw.save_index(os.path.join(tmp_dir, HNSW_FILE))
+    elif build_hnsw:
+        print("hnswlib is not installed, snapshot will use exact search")
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+
+def export_snapshot(index, output_dir: str = LOCAL_INDEX_DIR, batch_size: int = 1000, build_hnsw: bool = True) -> int:
+    """Export every record of the pinecone index into a local snapshot. Returns the record count."""
+    ids, vectors, metadata = [], [], []
+    for record_id, values, record_metadata in iter_index_records(index, batch_size):
+        # Tag the local mirror even if the remote catalogue has not been tagged yet
+        record_metadata.setdefault('is_non_us', is_non_us(segment_location_text(record_id, record_metadata)))
+        ids.append(record_id)
+        vectors.append(values)
+        metadata.append(record_metadata)
+        if len(ids) % 10000 == 0:
+            print(f"Exported {len(ids)} records")
+
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIMENSIONS)
+    write_snapshot(output_dir, ids, matrix, metadata, build_hnsw)
+    print(f"Wrote snapshot of {len(ids)} records to {output_dir}")
+    return len(ids)
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot the pinecone segment index for local querying.")
+    parser.add_argument("--output", default=LOCAL_INDEX_DIR)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--no-hnsw", action="store_true")
+    args = parser.parse_args()
+
+    from .pinecone_utils import index
+    export_snapshot(index, args.output, args.batch_size, build_hnsw=not args.no_hnsw)
+
+if __name__ == '__main__':
+    main()
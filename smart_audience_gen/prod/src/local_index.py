@@ -0,0 +1,125 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+try:
+    import hnswlib
+except ImportError:  # Fall back to exact search when hnswlib is not installed
+    hnswlib = None
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.parquet"
+HNSW_FILE = "hnsw.bin"
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize vectors so inner product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _field_mask(metadata: pd.DataFrame, field: str, condition: Any) -> np.ndarray:
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    if field not in metadata.columns:
+        # Records without the field only match negative operators, as in Pinecone
+        missing_match = set(condition) <= {"$ne", "$nin"} or condition.get("$exists") is False
+        return np.full(len(metadata), missing_match)
+
+    column = metadata[field]
+    mask = np.ones(len(metadata), dtype=bool)
+    for operator, value in condition.items():
+        if operator == "$eq":
+            mask &= (column == value).to_numpy()
+        elif operator == "$ne":
+            mask &= (column != value).to_numpy()
+        elif operator == "$gt":
+            mask &= (column > value).fillna(False).to_numpy(dtype=bool)
+        elif operator == "$gte":
+            mask &= (column >= value).fillna(False).to_numpy(dtype=bool)
+        elif operator == "$lt":
+            mask &= (column < value).fillna(False).to_numpy(dtype=bool)
+        elif operator == "$lte":
+            mask &= (column <= value).fillna(False).to_numpy(dtype=bool)
+        elif operator == "$in":
+            mask &= column.isin(value).to_numpy()
+        elif operator == "$nin":
+            mask &= ~column.isin(value).to_numpy()
+        elif operator == "$exists":
+            mask &= column.notna().to_numpy() == bool(value)
+        else:
+            raise ValueError(f"Unsupported filter operator '{operator}' for field '{field}'")
+    return mask
+
+def filter_mask(metadata: pd.DataFrame, presearch_filter: Dict[str, Any]) -> np.ndarray:
+    """Evaluate a Pinecone-style metadata filter against the columnar metadata store."""
+    mask = np.ones(len(metadata), dtype=bool)
+    for key, condition in presearch_filter.items():
+        if key == "$and":
+            for sub_filter in condition:
+                mask &= filter_mask(metadata, sub_filter)
+        elif key == "$or":
+            any_mask = np.zeros(len(metadata), dtype=bool)
+            for sub_filter in condition:
+                any_mask |= filter_mask(metadata, sub_filter)
+            mask &= any_mask
+        else:
+            mask &= _field_mask(metadata, key, condition)
+    return mask
+
+class LocalSegmentIndex:
+    """Read-only local mirror of the pinecone segment index, queried like index.query."""
+
+    def __init__(self, index_dir: str, ef: int = 400, exact_limit: int = 50000):
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+        self.metadata = pd.read_parquet(os.path.join(index_dir, METADATA_FILE))
+        self.ids = self.metadata['id'].to_numpy()
+        self.exact_limit = exact_limit
+        self.hnsw = None
+        hnsw_path = os.path.join(index_dir, HNSW_FILE)
+        if hnswlib is not None and os.path.exists(hnsw_path):
+            self.hnsw = hnswlib.Index(space='ip', dim=self.vectors.shape[1])
+            self.hnsw.load_index(hnsw_path, max_elements=len(self.ids))
+            self.hnsw.set_ef(ef)
+
+    def _exact_search(self, query: np.ndarray, top_k: int, candidates: Optional[np.ndarray] = None):
+        vectors = self.vectors if candidates is None else self.vectors[candidates]
+        scores = vectors @ query
+        k = min(top_k, len(scores))
+        if k == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        labels = top if candidates is None else candidates[top]
+        return labels, scores[top]
+
+    def _hnsw_search(self, query: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None):
+        k = min(top_k, len(self.ids) if mask is None else int(mask.sum()))
+        if k == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        search_filter = None if mask is None else (lambda label: bool(mask[label]))
+        labels, distances = self.hnsw.knn_query(query, k=k, filter=search_filter)
+        return labels[0], 1 - distances[0]
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict[str, Any]] = None, include_metadata: bool = True) -> Dict[str, Any]:
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        if filter:
+            mask = filter_mask(self.metadata, filter)
+            candidates = np.flatnonzero(mask)
+            if self.hnsw is None or len(candidates) <= self.exact_limit:
+                labels, scores = self._exact_search(query, top_k, candidates)
+            else:
+                labels, scores = self._hnsw_search(query, top_k, mask)
+        elif self.hnsw is not None:
+            labels, scores = self._hnsw_search(query, top_k)
+        else:
+            labels, scores = self._exact_search(query, top_k)
+
+        metadata_json = self.metadata['metadata_json']
+        matches = []
+        for label, score in zip(labels, scores):
+            match = {'id': self.ids[label], 'score': float(score)}
+            if include_metadata:
+                match['metadata'] = json.loads(metadata_json.iat[label])
+            matches.append(match)
+        return {'matches': matches}
@@ -0,0 +1,393 @@
+"""
+Local stand-ins for the OpenAI, OpenRouter, Groq, Perplexity and Pinecone APIs, for load testing.
+
+Start the server, then point the apps at it with the SERVICE_BASE_URL environment variable:
+    python -m src.mock_services --port 8750 --segments 20000 --chat-latency 0.8 --rate-limit-rate 0.02
+
+Chat completions (streamed or not) answer rerank prompts with a score derived from word
+overlap, JSON prompts with a small audience and anything else with filler prose. Embeddings
+hash words into a unit vector, so related texts land near each other. Each Pinecone index is
+an in-memory vector set supporting query, fetch, upsert and update; the segment index is seeded
+with a synthetic catalogue. Latencies are drawn from log-normal distributions around the
+given medians. GET /stats returns request counts.
+"""
+import re
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+MOCK_AUDIENCE = {  # Descriptions use the catalogue's vocabulary so most find a matching segment
+    "Audience": {
+        "included": {
+            "Core Customers": [{"description": "Frequent Fast Food Diners"}, {"description": "Coffee Shop Visitors"}],
+            "Value Seekers": [{"description": "Online Deal Seekers"}, {"description": "Budget conscious families"}]
+        },
+        "excluded": {
+            "Unlikely Buyers": [{"description": "Luxury Travelers"}, {"description": "Lapsed Grocery Shoppers"}]
+        }
+    }
+}
+FILLER_WORDS = (
+    "audience segment data collected from purchase transactions loyalty programs and online behavior "
+    "modeled against verified panels refreshed monthly to reflect recent activity across channels"
+).split()
+SEGMENT_TOPICS = [
+    'Fast Food Diners', 'Coffee Shop Visitors', 'Grocery Shoppers', 'Luxury Travelers', 'Business Travelers',
+    'New Parents', 'Pet Owners', 'Fitness Enthusiasts', 'Outdoor Recreation', 'Home Improvement',
+    'Auto Intenders', 'Electric Vehicle Intenders', 'Credit Card Seekers', 'Mortgage Shoppers', 'Small Business Owners',
+    'Streaming Subscribers', 'Mobile Gamers', 'College Students', 'Retirees', 'Healthy Eating',
+    'Fashion Shoppers', 'Beauty Buyers', 'Sports Fans', 'Concert Goers', 'Online Deal Seekers'
+]
+SEGMENT_QUALIFIERS = ['Frequent', 'Recent', 'High Spend', 'Likely', 'Lapsed', 'In-Market', 'Affluent', 'Young', 'Urban', 'Suburban']
+SEGMENT_BROKERS = ['Data Alliance', 'Acxiom', 'Experian', 'Oracle', 'Epsilon', 'Eyeota']
+SEGMENT_VERTICALS = ['overall', 'retail', 'finance', 'automotive', 'qsr', 'healthcare'] # Metadata keys are lowercased vertical names
+NON_US_REGIONS = ['United Kingdom', 'Canada', 'Germany', 'Australia'] # Appended to a few segment names to exercise the non-US filter
+
+def hashed_embedding(text: str, dimensions: int) -> np.ndarray:
+    """Unit vector summing a signed hash of every word, so texts sharing words are similar."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        digest = int(hashlib.md5(word.encode()).hexdigest()[:12], 16)
+        vector[digest % dimensions] += 1 if digest & 1 << 40 else -1
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[int(hashlib.md5(text.encode()).hexdigest()[:8], 16) % dimensions] = 1
+        return vector
+    return vector / norm
+
+def relevance(query: str, doc: str) -> int:
+    """0-100 score from the share of the query's words found in the document, with a little noise."""
+    query_words = set(re.findall(r'[a-z0-9]+', query.lower()))
+    doc_words = set(re.findall(r'[a-z0-9]+', doc.lower()))
+    coverage = len(query_words & doc_words) / max(len(query_words), 1)
+    noise = random.Random(query + doc).uniform(-5, 5)
+    return int(max(0, min(100, 30 + 70 * coverage + noise)))
+
+def chat_reply(messages: List[Dict[str, Any]]) -> str:
+    prompt = messages[-1].get('content') or '' if messages else ''
+    query = re.search(r'Desired audience: "(.*?)"', prompt)
+    if query and '"scores"' in prompt:
+        docs = re.findall(r'^\s*(\d+)\. "(.*)"\s*$', prompt, re.MULTILINE)
+        return json.dumps({'scores': [{'id': int(doc_id), 'score': relevance(query.group(1), doc)} for doc_id, doc in docs]})
+    doc = re.search(r'Data segment: "(.*?)"', prompt, re.DOTALL)
+    if query and doc:
+        return str(relevance(query.group(1), doc.group(1)))
+    if 'json' in prompt.lower():
+        return f"```json\n{json.dumps(MOCK_AUDIENCE, indent=2)}\n```"
+    rng = random.Random(prompt)
+    return ' '.join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(80, 200))).capitalize() + '.'
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def matches_filter(metadata: Dict[str, Any], condition: Dict[str, Any]) -> bool:
+    """Evaluate a Pinecone metadata filter. Records missing a field match $ne and $nin."""
+    for field, expected in condition.items():
+        if field == '$and':
+            if not all(matches_filter(metadata, c) for c in expected):
+                return False
+            continue
+        if field == '$or':
+            if not any(matches_filter(metadata, c) for c in expected):
+                return False
+            continue
+        operators = expected if isinstance(expected, dict) else {'$eq': expected}
+        value = metadata.get(field)
+        for operator, operand in operators.items():
+            if operator == '$ne' and value == operand or operator == '$nin' and value in operand:
+                return False
+            if operator in ('$ne', '$nin'):
+                continue
+            if value is None:
+                return False
+            if (operator == '$eq' and value != operand or operator == '$in' and value not in operand
+                    or operator == '$gt' and not value > operand or operator == '$gte' and not value >= operand
+                    or operator == '$lt' and not value < operand or operator == '$lte' and not value <= operand):
+                return False
+    return True
+
+class VectorStore:
+    """One in-memory Pinecone index searched by brute-force cosine similarity."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> int:
+        with self._lock:
+            rows = np.asarray([v['values'] for v in vectors], dtype=np.float32)
+            rows /= np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+            if not len(self._ids):
+                self._vectors = np.zeros((0, rows.shape[1]), dtype=np.float32)
+            new_rows = []
+            for vector, row in zip(vectors, rows):
+                position = self._positions.get(vector['id'])
+                if position is None:
+                    self._positions[vector['id']] = len(self._ids)
+                    self._ids.append(vector['id'])
+                    self._metadata.append(dict(vector.get('metadata') or {}))
+                    new_rows.append(row)
+                else:
+                    self._vectors[position] = row
+                    self._metadata[position] = dict(vector.get('metadata') or {})
+            if new_rows:
+                self._vectors = np.vstack([self._vectors, np.asarray(new_rows)])
+        return len(vectors)
+
+    def update(self, record_id: str, set_metadata: Optional[Dict[str, Any]] = None, values: Optional[List[float]] = None):
+        with self._lock:
+            position = self._positions.get(record_id)
+            if position is None:
+                return
+            if set_metadata:
+                self._metadata[position].update(set_metadata)
+            if values:
+                row = np.asarray(values, dtype=np.float32)
+                self._vectors[position] = row / max(np.linalg.norm(row), 1e-12)
+
+    def query(self, vector: List[float], top_k: int, metadata_filter: Optional[Dict[str, Any]], include_metadata: bool) -> List[Dict[str, Any]]:
+        with self._lock:
+            if not self._ids:
+                return []
+            scores = self._vectors @ np.asarray(vector, dtype=np.float32)
+            if metadata_filter:
+                allowed = np.fromiter((matches_filter(m, metadata_filter) for m in self._metadata), dtype=bool, count=len(self._ids))
+                scores = np.where(allowed, scores, -np.inf)
+            top = np.argsort(-scores)[:top_k]
+            return [
+                {'id': self._ids[i], 'score': float(scores[i]), 'values': [], **({'metadata': self._metadata[i]} if include_metadata else {})}
+                for i in top if np.isfinite(scores[i])
+            ]
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                record_id: {'id': record_id, 'values': self._vectors[self._positions[record_id]].tolist(), 'metadata': self._metadata[self._positions[record_id]]}
+                for record_id in ids if record_id in self._positions
+            }
+
+def synthetic_catalogue(size: int, dimensions: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Segments with the metadata layout of the real index: names, brokers, CPM and per-vertical CTR/CPA."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(size):
+        topic, qualifier = rng.choice(SEGMENT_TOPICS), rng.choice(SEGMENT_QUALIFIERS)
+        name = f"{qualifier} {topic}" + (f" - {rng.choice(NON_US_REGIONS)}" if rng.random() < 0.05 else '')
+        raw_string = f"Full Path: {topic} > {qualifier}, Description: {name} identified from observed behavior"
+        metadata = {
+            'Name': name,
+            'BrandName': rng.choice(SEGMENT_BROKERS),
+            'raw_string': raw_string,
+            'UniqueUserCount': rng.randint(10000, 50000000),
+            'CPMRateInAdvertiserCurrency': json.dumps({'Amount': round(rng.uniform(0.5, 3.0), 2), 'CurrencyCode': 'USD'}),
+        }
+        for vertical in SEGMENT_VERTICALS:
+            if rng.random() < 0.7:
+                metadata[vertical] = json.dumps({'ctr': rng.lognormvariate(math.log(0.002), 0.6), 'cpa': rng.lognormvariate(math.log(25), 0.5)})
+        records.append({'id': str(100000 + i), 'values': hashed_embedding(raw_string, dimensions).tolist(), 'metadata': metadata})
+    return records
+
+class LatencyDistribution:
+    """Log-normal latency around a median, in seconds."""
+
+    def __init__(self, median: float, sigma: float):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        return random.lognormvariate(math.log(self.median), self.sigma) if self.median > 0 else 0
+
+class MockServices:
+    def __init__(self, latencies: Dict[str, LatencyDistribution], rate_limit_rate: float, retry_after: float,
+                 segment_index: str, segments: int, dimensions: int):
+        self.latencies = latencies
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.indexes: Dict[str, VectorStore] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        if segments:
+            self.get_index(segment_index).upsert(synthetic_catalogue(segments, dimensions))
+
+    def get_index(self, name: str) -> VectorStore:
+        with self._lock:
+            if name not in self.indexes:
+                self.indexes[name] = VectorStore()
+            return self.indexes[name]
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def throttled(self) -> bool:
+        if random.random() < self.rate_limit_rate:
+            self.count('throttled')
+            return True
+        return False
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+    services: MockServices = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self._send_json(200, {'requests': self.services.stats, 'indexes': {name: len(store) for name, store in self.services.indexes.items()}})
+        elif url.path.startswith('/pinecone/') and url.path.endswith('/vectors/fetch'):
+            self._pinecone(url.path, parse_qs(url.query))
+        else:
+            self._send_json(404, {'error': f'Unknown path {url.path}'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_json()
+        if path.startswith('/pinecone/'):
+            self._pinecone(path, body)
+        elif path.endswith('/chat/completions'):
+            self._chat(body)
+        elif path.endswith('/embeddings'):
+            self._embeddings(body)
+        else:
+            self._send_json(404, {'error': f'Unknown path {path}'})
+
+    def _chat(self, body: Dict[str, Any]):
+        self.services.count('chat')
+        if self.services.throttled():
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}, {'retry-after': str(self.services.retry_after)})
+            return
+        reply = chat_reply(body.get('messages') or [])
+        latency = self.services.latencies['chat'].sample()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get('model', 'mock')
+        if not body.get('stream'):
+            time.sleep(latency)
+            prompt_tokens = sum(count_tokens(m.get('content') or '') for m in body.get('messages') or [])
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': reply}}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': count_tokens(reply), 'total_tokens': prompt_tokens + count_tokens(reply)}
+            })
+            return
+
+        # Server-sent events, with the sampled latency spread over the chunks
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = re.findall(r'\S*\s*', reply)[:-1] or ['']
+        for i, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                     'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}, 'finish_reason': None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        done = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self._write_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n")
+        self._write_chunk('')
+
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body: Dict[str, Any]):
+        self.services.count('embeddings')
+        texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+        dimensions = body.get('dimensions') or 256
+        time.sleep(self.services.latencies['embedding'].sample())
+        self._send_json(200, {
+            'object': 'list', 'model': body.get('model', 'mock'),
+            'data': [{'object': 'embedding', 'index': i, 'embedding': hashed_embedding(text, dimensions).tolist()} for i, text in enumerate(texts)],
+            'usage': {'prompt_tokens': sum(map(count_tokens, texts)), 'total_tokens': sum(map(count_tokens, texts))}
+        })
+
+    def _pinecone(self, path: str, body: Dict[str, Any]):
+        # /pinecone/<index>/<operation>
+        _, _, index_name, operation = path.split('/', 3)
+        store = self.services.get_index(index_name)
+        self.services.count(f'pinecone_{operation.replace("vectors/", "")}')
+        time.sleep(self.services.latencies['pinecone'].sample())
+        if operation == 'query':
+            matches = store.query(body['vector'], body.get('topK', 10), body.get('filter'), body.get('includeMetadata', False))
+            self._send_json(200, {'matches': matches, 'namespace': body.get('namespace', ''), 'usage': {'readUnits': 5}})
+        elif operation == 'vectors/fetch':
+            self._send_json(200, {'vectors': store.fetch(body.get('ids', [])), 'namespace': '', 'usage': {'readUnits': 1}})
+        elif operation == 'vectors/upsert':
+            self._send_json(200, {'upsertedCount': store.upsert(body.get('vectors', []))})
+        elif operation == 'vectors/update':
+            store.update(body['id'], body.get('setMetadata'), body.get('values'))
+            self._send_json(200, {})
+        else:
+            self._send_json(404, {'error': f'Unknown pinecone operation {operation}'})
+
+def serve(services: MockServices, host: str, port: int) -> ThreadingHTTPServer:
+    """Start the mock services on a background thread and return the server."""
+    handler = type('Handler', (MockHandler,), {'services': services})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-services', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the OpenAI, OpenRouter, Perplexity and Pinecone APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8750)
+    parser.add_argument("--segments", type=int, default=20000, help="Synthetic segments seeded into the segment index")
+    parser.add_argument("--segment-index", default="3rd-party-data-v2", help="Index name seeded with the catalogue")
+    parser.add_argument("--dimensions", type=int, default=256, help="Must match EMBEDDING_DIMENSIONS")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Median chat completion latency in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.15, help="Median embedding latency in seconds")
+    parser.add_argument("--pinecone-latency", type=float, default=0.05, help="Median Pinecone latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of every latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of chat completions answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds on 429s")
+    args = parser.parse_args()
+
+    latencies = {
+        'chat': LatencyDistribution(args.chat_latency, args.latency_sigma),
+        'embedding': LatencyDistribution(args.embedding_latency, args.latency_sigma),
+        'pinecone': LatencyDistribution(args.pinecone_latency, args.latency_sigma),
+    }
+    services = MockServices(latencies, args.rate_limit_rate, args.retry_after, args.segment_index, args.segments, args.dimensions)
+    server = serve(services, args.host, args.port)
+    print(f"Mock services listening on http://{args.host}:{args.port} with {args.segments} segments in '{args.segment_index}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,63 @@
 from typing import List, Dict, Any
 from datetime import datetime, timedelta
 import hashlib
-from config.settings import PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_TOP_K, PINECONE_CACHE_INDEX
+import threading
+from config.settings import (
+    PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_TOP_K, PINECONE_CACHE_INDEX, PINECONE_POOL_THREADS, PINECONE_INDEX_HOST, PINECONE_CACHE_HOST,
+    VECTOR_BACKEND, LOCAL_INDEX_DIR, LOCAL_INDEX_EF, LOCAL_INDEX_EXACT_LIMIT, SUMMARY_CACHE_PATH, SUMMARY_CACHE_TTL_DAYS
+)
 from pinecone import Pinecone
 from .embedding import generate_embedding
+from .local_index import LocalSegmentIndex
+from .summary_cache import SummaryStore
+from .tracing import traced, set_attribute
+from .single_flight import SingleFlight, canonical_key
 
 pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
-cache_index = pc.Index(PINECONE_CACHE_INDEX)
+index = pc.Index(PINECONE_INDEX_NAME, host=PINECONE_INDEX_HOST, pool_threads=PINECONE_POOL_THREADS)
+cache_index = pc.Index(PINECONE_CACHE_INDEX, host=PINECONE_CACHE_HOST)
+summary_store = SummaryStore(SUMMARY_CACHE_PATH, SUMMARY_CACHE_TTL_DAYS * 24 * 60 * 60)
+query_flight = SingleFlight('query_pinecone')
+
+_local_index = None
+_local_index_lock = threading.Lock()
+
+def get_local_index() -> LocalSegmentIndex:
+    """Load the local segment index snapshot once per process."""
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            _local_index = LocalSegmentIndex(LOCAL_INDEX_DIR, ef=LOCAL_INDEX_EF, exact_limit=LOCAL_INDEX_EXACT_LIMIT)
+        return _local_index
 
 def generate_id(text: str) -> str:
     """Generate a hash ID from the given text."""
     return hashlib.sha256(text.encode()).hexdigest()
 
+@traced()
 def query_pinecone(query_embedding: List[float], top_k: int = PINECONE_TOP_K, presearch_filter: Dict[str, Any] = {}) -> Dict[str, Any]:
-    """Query Pinecone index with the given embedding."""
-    results = index.query(
+    """Query Pinecone index with the given embedding. Identical concurrent queries share one request."""
+    segment_index = get_local_index() if VECTOR_BACKEND == 'local' else index
+    results = query_flight.do(
+        canonical_key(VECTOR_BACKEND, query_embedding, top_k, presearch_filter),
+        segment_index.query,
         vector=query_embedding,
         filter=presearch_filter,
         top_k=top_k,
         include_metadata=True
     )
+    set_attribute('backend', VECTOR_BACKEND)
+    set_attribute('top_k', top_k)
+    set_attribute('matches', len(results['matches']))
     return results
 
 def cache_summary(domain: str, data_type: str, initial_prompt: str, summary: str):
-    """Cache the summary in Pinecone with a timestamp."""
-    embedding = generate_embedding(initial_prompt)
+    """Cache the summary locally and in Pinecone with a timestamp."""
     id = generate_id(initial_prompt)
     current_timestamp = int(datetime.now().timestamp())
+    summary_store.put(id, summary, current_timestamp, domain, data_type)
+
+    embedding = generate_embedding(initial_prompt)
     metadata = {
         "domain": domain,
         "data_type": data_type,
@@ -37,20 +67,36 @@ def cache_summary(domain: str, data_type: str, initial_prompt: str, summary: str
     }
     cache_index.upsert(vectors=[(id, embedding, metadata)])
 
+@traced()
 def get_cached_summary(initial_prompt: str):
-    """Retrieve a cached summary from Pinecone, filtering for recent entries."""
-    embedding = generate_embedding(initial_prompt)
-    
-    
-    # Query Pinecone with the embedding and timestamp filter
-    results = query_pinecone(
-        query_embedding=embedding,
-        top_k=1,
-        presearch_filter={
-            "timestamp": {"$gte": int((datetime.now() - timedelta(days=30)).timestamp())}
-        }
-    )
+    """
+    Retrieve a recent cached summary: the local exact-key store first (no API calls),
+    then an exact id fetch from Pinecone, then a similarity query on the cache index.
+    """
+    id = generate_id(initial_prompt)
+    cached = summary_store.get(id)
+    set_attribute('cache_hit', 'local' if cached else False)
+    if cached:
+        return cached
+
+    min_timestamp = int((datetime.now() - timedelta(days=SUMMARY_CACHE_TTL_DAYS)).timestamp())
+    fetched = cache_index.fetch(ids=[id]).vectors.get(id)
+    if fetched and fetched.metadata and fetched.metadata.get('timestamp', 0) >= min_timestamp:
+        metadata = dict(fetched.metadata)
+        set_attribute('cache_hit', 'fetch')
+    else:
+        embedding = generate_embedding(initial_prompt)
+        results = cache_index.query(
+            vector=embedding,
+            top_k=1,
+            filter={"timestamp": {"$gte": min_timestamp}},
+            include_metadata=True
+        )
+        if not (results['matches'] and results['matches'][0]['score'] > 0.95):
+            return None
+        metadata = dict(results['matches'][0]['metadata'])
+        set_attribute('cache_hit', 'semantic')
 
-    if results['matches'] and results['matches'][0]['score'] > 0.95:
-        return results['matches'][0]['metadata']
-    return None
+    # Remember the hit under this prompt's id so the next lookup is local
+    summary_store.put(id, metadata['summary'], metadata['timestamp'], metadata.get('domain'), metadata.get('data_type'))
+    return metadata
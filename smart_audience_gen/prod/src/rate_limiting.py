@@ -0,0 +1,150 @@
+import re
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse rate-limit reset headers such as '1s', '6m0s', '20ms' or '0.5' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds the provider asked us to wait before retrying, if it said."""
+    if not headers:
+        return None
+    return parse_reset_duration(headers.get('retry-after')) or parse_reset_duration(headers.get('x-ratelimit-reset-requests'))
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> int:
+    """Rough token estimate for a chat request (4 characters per token plus the completion budget)."""
+    prompt_tokens = sum(len(message.get('content') or '') for message in messages) // 4
+    return prompt_tokens + (max_tokens or 500)
+
+class TokenBucket:
+    """Continuous-refill bucket holding up to one minute of capacity."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return how long to wait before using it."""
+        self._refill(time.monotonic())
+        self.tokens -= amount
+        return 0 if self.tokens >= 0 else -self.tokens * 60 / self.per_minute
+
+    def sync_remaining(self, remaining: float):
+        """Align with the provider's view of remaining capacity."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, remaining)
+
+class AdaptiveConcurrency:
+    """Additive-increase / multiplicative-decrease limit on in-flight requests."""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease_cooldown: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self) -> bool:
+        """Halve the limit, at most once per cooldown so one burst of 429s counts once."""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return False
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        return True
+
+class RateLimiter:
+    """Requests/minute, tokens/minute and adaptive concurrency for one provider and model."""
+
+    def __init__(self, provider: str, model: str, rpm: float, tpm: float, max_concurrency: int, min_concurrency: int = 1):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency(max(min_concurrency, max_concurrency // 2), min_concurrency, max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        await self.concurrency.acquire()
+        try:
+            wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield self
+        finally:
+            await self.concurrency.release()
+
+    def record_response(self, headers: Optional[Mapping[str, str]]):
+        """Grow concurrency after a success and sync buckets with the provider's rate-limit headers."""
+        self.concurrency.on_success()
+        if not headers:
+            return
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        try:
+            if remaining_requests is not None:
+                self.requests.sync_remaining(float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens.sync_remaining(float(remaining_tokens))
+        except ValueError:
+            pass
+
+    def record_throttle(self, headers: Optional[Mapping[str, str]] = None):
+        """Back off after a 429: halve concurrency and drain the request bucket until the reset time."""
+        if self.concurrency.on_throttle():
+            logger.info(f"Rate limited by {self.provider}/{self.model}, concurrency limit now {int(self.concurrency.limit)}")
+        reset = retry_after_seconds(headers)
+        if reset:
+            self.requests.sync_remaining(-reset * self.requests.per_minute / 60)
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+
+def get_rate_limiter(provider: str, model: str, rate_limits: Dict, model_rate_limits: Dict, max_concurrency: int) -> RateLimiter:
+    """Return the shared limiter for a provider and model, creating it from the configured limits."""
+    key = (provider, model)
+    if key not in _limiters:
+        limits = {**rate_limits[provider], **model_rate_limits.get(model, {})}
+        _limiters[key] = RateLimiter(provider, model, limits['rpm'], limits['tpm'], max_concurrency)
+    return _limiters[key]
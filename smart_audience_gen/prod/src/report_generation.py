@@ -1,9 +1,12 @@
-from src.api_clients import route_api_call
+from src.api_clients import route_api_call, route_api_call_stream
+from src.tracing import traced
 from config.prompts import REPORT_PROMPT, REPORT_SYSTEM_PROMPT
+from config.settings import STREAM_RESPONSES
 import streamlit as st
 import copy
 
-def generate_audience_report(summary_json, company_name, conversation_history):
+@traced()
+def generate_audience_report(summary_json, company_name, conversation_history, stream: bool = STREAM_RESPONSES):
     # Create a local copy of the conversation history
     local_history = copy.deepcopy(conversation_history)
 
@@ -17,7 +20,10 @@ def generate_audience_report(summary_json, company_name, conversation_history):
     local_history.append({"role": "system", "content": REPORT_SYSTEM_PROMPT})
     local_history.append({"role": "user", "content": formatted_report_prompt})
 
-    # Send the message to the LLM using the local history
-    audience_report = route_api_call('openai', local_history)
+    # Send the message to the LLM using the local history, rendering the report as it streams in
+    if stream:
+        audience_report = st.write_stream(route_api_call_stream('openai', local_history))
+    else:
+        audience_report = route_api_call('openai', local_history)
 
     return audience_report
\ No newline at end of file
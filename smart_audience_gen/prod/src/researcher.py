@@ -1,11 +1,17 @@
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
+from functools import lru_cache
 
-from config.settings import ONLINE_MODEL, OFFLINE_MODEL
+from config.settings import ONLINE_MODEL, OFFLINE_MODEL, RESEARCH_WORKERS
 from config.prompts import ONLINE_SYSTEM_PROMPT, OFFLINE_SYSTEM_PROMPT, SUMMARY_PROMPT, INITIAL_RESEARCH_PROMPT, FOLLOW_UP_PROMPT, CATEGORIZE_SEGMENT_PROMPT, BASIC_SYSTEM_PROMPT
-from src.api_clients import send_perplexity_message, route_api_call
+from src.api_clients import route_api_call
 from src.pinecone_utils import cache_summary, get_cached_summary
+from src.tracing import traced, set_attribute, wrap_with_context
 import concurrent.futures
 
+DATA_ALLIANCE = "Data Alliance"
+DATA_ALLIANCE_SUMMARY = "The Trade Desk Data Alliance curates the highest quality 3rd party data available for purchase. We trust their curation and prefer using their segments whenever they are available."
+
+@lru_cache(maxsize=4096)
 def categorize_segment(segment):
     messages = [{"role": "user", "content": CATEGORIZE_SEGMENT_PROMPT.format(segment=segment)}]
     response = route_api_call('online_perplexity', messages)  # Change here
@@ -19,12 +25,13 @@ def summarize_conversation(initial_prompt, conversation_history):
     summary = route_api_call('offline_perplexity', [{"role": "user", "content": formatted_summary_prompt}])
     return summary
 
-def create_conversation(domain: str, segment: str, num_iterations: int) -> tuple[List[Dict[str, str]], str]:
-    if domain == "Data Alliance":
-        summary = "The Trade Desk Data Alliance curates the highest quality 3rd party data available for purchase. We trust their curation and prefer using their segments whenever they are available."
-        return [], summary
-    
-    data_type = categorize_segment(segment)
+@traced()
+def research_data_type(domain: str, data_type: str, num_iterations: int) -> Tuple[List[Dict[str, str]], str]:
+    """Research how a broker collects one type of data, reusing a cached summary when there is one."""
+    set_attribute('domain', domain)
+    set_attribute('data_type', data_type)
+    if domain == DATA_ALLIANCE:
+        return [], DATA_ALLIANCE_SUMMARY
 
     initial_prompt = INITIAL_RESEARCH_PROMPT.format(
         domain=domain,
@@ -33,6 +40,7 @@ def create_conversation(domain: str, segment: str, num_iterations: int) -> tuple
 
     # Check if summary is already cached
     cached_result = get_cached_summary(initial_prompt)
+    set_attribute('cache_hit', bool(cached_result))
     if cached_result:
         return [], cached_result["summary"]
 
@@ -58,19 +66,48 @@ def create_conversation(domain: str, segment: str, num_iterations: int) -> tuple
     
     return offline_conversation, summary
 
-def generate_segment_summaries(segments):
+@traced()
+def create_conversation(domain: str, segment: str, num_iterations: int) -> tuple[List[Dict[str, str]], str]:
+    if domain == DATA_ALLIANCE:
+        return [], DATA_ALLIANCE_SUMMARY
+    return research_data_type(domain, categorize_segment(segment), num_iterations)
 
-    def process_segment(segment):
-        conversation, summary = create_conversation(segment['BrandName'], segment['ActualSegment'], num_iterations=3)
-        return {
-            "ActualSegment": segment['ActualSegment'],
-            "BrandName": segment['BrandName'],
-            "summary": summary
-        }
+@traced()
+def generate_segment_summaries(segments, progress: Callable[[float], None] = None):
+    """
+    Summarize each segment's data collection methodology. Segments are categorized, then
+    grouped by (broker, data type) so each group is researched once and its summary
+    shared by every member. progress, if given, is called with the fraction of groups researched.
+    """
+    unique_segments = list(dict.fromkeys((segment['BrandName'], segment['ActualSegment']) for segment in segments))
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        summaries = list(executor.map(process_segment, segments))
+    def categorize(domain, segment):
+        return None if domain == DATA_ALLIANCE else categorize_segment(segment).strip()
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=RESEARCH_WORKERS) as executor:
+        data_types = dict(zip(unique_segments, executor.map(wrap_with_context(lambda item: categorize(*item)), unique_segments)))
+
+        # Group on the normalized data type, researching with the first wording seen
+        groups = {}
+        for (domain, segment), data_type in data_types.items():
+            groups.setdefault((domain, (data_type or '').lower()), (domain, data_type))
+        print(f"Researching {len(groups)} broker/data type groups for {len(segments)} segments")
+
+        research = executor.map(wrap_with_context(lambda item: research_data_type(*item, num_iterations=3)[1]), groups.values())
+        group_summaries = {}
+        for group, summary in zip(groups, research):
+            group_summaries[group] = summary
+            if progress is not None:
+                progress(len(group_summaries) / len(groups))
+
+    summaries = []
+    for segment in segments:
+        data_type = data_types[(segment['BrandName'], segment['ActualSegment'])]
+        summaries.append({
+            "ActualSegment": segment['ActualSegment'],
+            "BrandName": segment['BrandName'],
+            "summary": group_summaries[(segment['BrandName'], (data_type or '').lower())]
+        })
     return summaries
 
 def generate_methodology_summary(segment_summaries):
@@ -1,42 +1,78 @@
 import re
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 import concurrent.futures
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_nothing
 import pandas as pd
 import streamlit as st
 from config.locations import NON_US_LOCATIONS
-from config.prompts import RERANK_PROMPT
-from config.settings import RERANKER_MODEL, OPEN_ROUTER_RERANK
+from config.prompts import RERANK_PROMPT, BATCH_RERANK_PROMPT
+from config.settings import (
+    RERANKER_MODEL, OPEN_ROUTER_RERANK, SCORE_CACHE_PATH, SCORE_CACHE_TTL_DAYS, SCORE_CACHE_MAX_ENTRIES,
+    RERANK_BATCH_SIZE, MAX_RERANK_WORKERS, USE_ASYNC_CLIENTS
+)
 
 from .api_clients import openai_client, open_router_client
+from .async_clients import chat_completion_async, run_sync
+from .data_processing import extract_and_correct_json, ensure_dict
+from .score_cache import ScoreCache
+from .tracing import span, traced, set_attribute, count_retries, wrap_with_context
+from .single_flight import SingleFlight
+
+score_cache = ScoreCache(SCORE_CACHE_PATH, SCORE_CACHE_TTL_DAYS * 24 * 60 * 60, SCORE_CACHE_MAX_ENTRIES)
+relevance_flight = SingleFlight('gpt_score_relevance') # Keyed by the score cache key, so a rerank in flight is never requested twice
+
+# Compiled once at import. Locations are de-duplicated and longest-first so multi-word names win.
+NON_US_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(map(re.escape, sorted({location.lower() for location in NON_US_LOCATIONS}, key=len, reverse=True))) + r')\b',
+    re.IGNORECASE
+)
+NON_US_COLUMNS = ['Name', 'raw_string', 'BrandName', 'id'] # Columns searched for non-US locations
+
+def is_non_us(text: str) -> bool:
+    """Whether the text mentions a non-US location."""
+    return NON_US_PATTERN.search(text) is not None
+
+def segment_location_text(record_id: str, metadata: Dict) -> str:
+    """The text filter_non_us searches for a catalogue record: name, description, brand and id."""
+    values = {'id': record_id, **metadata}
+    return ' '.join(str(values.get(column, '')) for column in NON_US_COLUMNS)
+
+def non_us_mask(df: pd.DataFrame) -> pd.Series:
+    """Flag rows mentioning a non-US location, trusting precomputed catalogue flags where present."""
+    if 'is_non_us' in df.columns:
+        untagged = df['is_non_us'].isna()
+        mask = df['is_non_us'].where(~untagged, False).astype(bool)
+    else:
+        untagged = pd.Series(True, index=df.index)
+        mask = pd.Series(False, index=df.index)
+    if untagged.any():
+        rows = df.loc[untagged, NON_US_COLUMNS].astype(str)
+        concatenated = rows[NON_US_COLUMNS[0]]
+        for column in NON_US_COLUMNS[1:]:
+            concatenated = concatenated + ' ' + rows[column]
+        mask[untagged] = concatenated.str.contains(NON_US_PATTERN).to_numpy()
+    return mask
 
+@traced()
 def filter_non_us(df: pd.DataFrame) -> pd.DataFrame:
-    # Compile the pattern once
-    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, NON_US_LOCATIONS)) + r')\b', re.IGNORECASE)
-    
-    # Concatenate relevant columns only
-    relevant_columns = ['Name', 'raw_string', 'BrandName', 'id']
-    df['concatenated'] = df[relevant_columns].astype(str).agg(' '.join, axis=1)
-    
-    # Use vectorized operations
-    mask = ~df['concatenated'].str.contains(pattern, regex=True)
-    
-    # Apply the mask and drop the temporary column
-    filtered_df = df[mask].drop(columns=['concatenated'])
+    filtered_df = df[~non_us_mask(df)].copy()
 
     filtered_df.sort_values(by=['CPMRateInAdvertiserCurrency_Amount'], ascending=True, inplace=True)
 
     filtered_df.drop_duplicates(subset=['raw_string', 'Name'], keep='first', inplace=True)
     
     print(f"Filtered out {len(df) - len(filtered_df)} non-US locations")
+    set_attribute('rows_in', len(df))
+    set_attribute('rows_out', len(filtered_df))
     
     return filtered_df
 
 
-def parse_relevance_score(result: str) -> float:
+def parse_relevance_score(result: str) -> Optional[float]:
     """
     Parse the relevance score from the GPT response.
-    Returns a normalized score between 0 and 1.
+    Returns a normalized score between 0 and 1, or None if the response has no score.
     """
     try:
         match = re.search(r'\d+(?:\.\d+)?', result)
@@ -47,16 +83,17 @@ def parse_relevance_score(result: str) -> float:
             raise ValueError("No number found in response")
     except ValueError as e:
         print(f"Error parsing score. Error: {str(e)}")
-        return 0
+        return None
 
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=2, min=10, max=60)
+    wait=wait_exponential(multiplier=2, min=10, max=60),
+    before_sleep=count_retries(before_sleep_nothing)
 )
-def gpt_score_relevance(query: str, doc: str) -> float:
+def request_relevance_score(query: str, doc: str) -> Optional[float]:
     """
     Score the relevance of a document to the query using GPT-3.5.
-    Returns a relevance score between 0 and 1.
+    Returns a relevance score between 0 and 1, or None if the response has no score.
     """
 
     formatted_rerank_prompt = RERANK_PROMPT.format(
@@ -77,7 +114,147 @@ def gpt_score_relevance(query: str, doc: str) -> float:
     result = response.choices[0].message.content.strip()
     return parse_relevance_score(result)
 
+async def request_relevance_score_async(query: str, doc: str) -> Optional[float]:
+    """Async variant of request_relevance_score, retried by the async client layer."""
+    formatted_rerank_prompt = RERANK_PROMPT.format(
+        query=query,
+        doc=doc
+    )
+    result = await chat_completion_async(
+        'openai',
+        RERANKER_MODEL,
+        [{"role": "user", "content": formatted_rerank_prompt}],
+        max_tokens=100,
+        temperature=0,
+        timeout=30
+    )
+    return parse_relevance_score(result.strip())
+
+@traced('gpt_score_relevance')
+async def gpt_score_relevance_async(query: str, doc: str) -> float:
+    """
+    Score the relevance of a document to the query on the shared event loop, reusing cached scores when available.
+    Returns a relevance score between 0 and 1.
+    """
+    key = ScoreCache.make_key(RERANKER_MODEL, RERANK_PROMPT, query, doc)
+    # The cache is a lock-guarded SQLite file that can wait on other processes, so keep it off the loop
+    cached_score = await asyncio.to_thread(score_cache.get, key)
+    set_attribute('cache_hit', cached_score is not None)
+    if cached_score is not None:
+        return cached_score
+
+    async def score():
+        score = await request_relevance_score_async(query, doc)
+        if score is None:
+            return 0 # Irrelevant for this run only; an unparseable reply is never cached
+        await asyncio.to_thread(score_cache.put, key, score)
+        return score
+    return await relevance_flight.do_async(key, score)
+
+def gpt_score_relevance(query: str, doc: str) -> float:
+    """
+    Score the relevance of a document to the query, reusing cached scores when available.
+    Returns a relevance score between 0 and 1.
+    """
+    if USE_ASYNC_CLIENTS:
+        return run_sync(gpt_score_relevance_async(query, doc))
+
+    with span('gpt_score_relevance'):
+        key = ScoreCache.make_key(RERANKER_MODEL, RERANK_PROMPT, query, doc)
+        cached_score = score_cache.get(key)
+        set_attribute('cache_hit', cached_score is not None)
+        if cached_score is not None:
+            return cached_score
+
+        def score():
+            score = request_relevance_score(query, doc)
+            if score is None:
+                return 0 # Irrelevant for this run only; an unparseable reply is never cached
+            score_cache.put(key, score)
+            return score
+        return relevance_flight.do(key, score)
+
 def process_single_segment(query: str, segment: Dict) -> Dict:
     """Process a single segment."""
     relevance_score = gpt_score_relevance(query, segment['raw_string'])
-    return {**segment, 'relevance_score': relevance_score}
\ No newline at end of file
+    return {**segment, 'relevance_score': relevance_score}
+
+async def process_single_segment_async(query: str, segment: Dict) -> Dict:
+    """Process a single segment on the shared event loop."""
+    relevance_score = await gpt_score_relevance_async(query, segment['raw_string'])
+    return {**segment, 'relevance_score': relevance_score}
+
+def parse_batch_relevance_scores(result: str, num_docs: int) -> Dict[int, float]:
+    """
+    Parse the JSON score list from a listwise rerank response.
+    Returns normalized scores between 0 and 1 keyed by 1-based segment id; ids the model dropped are absent.
+    """
+    scores = {}
+    for item in ensure_dict(extract_and_correct_json(result)).get('scores', []):
+        try:
+            doc_id = int(item['id'])
+            score = float(item['score']) / 100
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 1 <= doc_id <= num_docs:
+            scores[doc_id] = max(0, min(score, 1))
+    return scores
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=2, min=10, max=60),
+    before_sleep=count_retries(before_sleep_nothing)
+)
+def request_batch_relevance_scores(query: str, docs: List[str]) -> Dict[int, float]:
+    """Score several documents against the query in a single LLM call."""
+    numbered_docs = "\n".join(f'{doc_id}. "{doc}"' for doc_id, doc in enumerate(docs, 1))
+    formatted_rerank_prompt = BATCH_RERANK_PROMPT.format(query=query, docs=numbered_docs)
+    response = openai_client.chat.completions.create(
+        model=RERANKER_MODEL,
+        messages=[{"role": "user", "content": formatted_rerank_prompt}],
+        max_tokens=50 + 20 * len(docs),
+        temperature=0,
+        response_format={"type": "json_object"},
+        timeout=60
+    )
+
+    if not response.choices or len(response.choices) == 0:
+        raise Exception("Error: Unable to get a response from the API")
+
+    return parse_batch_relevance_scores(response.choices[0].message.content, len(docs))
+
+@traced()
+def gpt_score_relevance_batch(query: str, docs: List[str]) -> List[float]:
+    """
+    Score documents RERANK_BATCH_SIZE at a time with listwise prompts.
+    Any document the model leaves out of its score list is rescored individually.
+    """
+    keys = [ScoreCache.make_key(RERANKER_MODEL, BATCH_RERANK_PROMPT, query, doc) for doc in docs]
+    scores = [score_cache.get(key) for key in keys]
+    missing = [i for i, score in enumerate(scores) if score is None]
+    set_attribute('cache_hits', len(docs) - len(missing))
+
+    for start in range(0, len(missing), RERANK_BATCH_SIZE):
+        batch = missing[start:start + RERANK_BATCH_SIZE]
+        try:
+            batch_scores = request_batch_relevance_scores(query, [docs[i] for i in batch])
+        except Exception as e:
+            print(f"Listwise rerank failed, falling back to per-item scoring. Error: {str(e)}")
+            batch_scores = {}
+        for doc_id, i in enumerate(batch, 1):
+            if doc_id in batch_scores:
+                scores[i] = batch_scores[doc_id]
+                score_cache.put(keys[i], scores[i])
+
+    dropped = [i for i, score in enumerate(scores) if score is None]
+    if dropped:
+        print(f"Scoring {len(dropped)} segments individually after listwise rerank")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_RERANK_WORKERS) as executor:
+            for i, score in zip(dropped, executor.map(wrap_with_context(lambda i: gpt_score_relevance(query, docs[i])), dropped)):
+                scores[i] = score
+    return scores
+
+def process_segment_batch(query: str, segments: List[Dict]) -> List[Dict]:
+    """Process several segments with a listwise rerank."""
+    relevance_scores = gpt_score_relevance_batch(query, [segment['raw_string'] for segment in segments])
+    return [{**segment, 'relevance_score': score} for segment, score in zip(segments, relevance_scores)]
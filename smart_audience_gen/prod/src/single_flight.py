@@ -0,0 +1,98 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+The first caller for a key runs the call, and callers arriving while it is in flight
+wait for its result (or exception) instead of repeating the request. Nothing is kept
+once the call finishes, so this sits in front of the caches rather than replacing them.
+Results are shared, not copied, so callers must not mutate them.
+"""
+import json
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+from .tracing import increment
+
+def _json_default(value):
+    # Arrays in full, since str() of a long numpy array elides its middle
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+def canonical_key(*parts) -> str:
+    """sha256 of the canonical JSON of parts, so equal payloads share a key whatever their dict order."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(',', ':'), default=_json_default).encode()).hexdigest()
+
+class _LeaderInterrupted(Exception):
+    """The leading call was interrupted (a Streamlit rerun, a cancelled task) rather than failing, so waiters retry."""
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: Dict[str, asyncio.Future] = {}
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Any:
+        """Call fn(*args, **kwargs), or wait for the identical call already in flight under key."""
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            increment('coalesced')
+            try:
+                return future.result()
+            except _LeaderInterrupted:
+                continue
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.set_exception(_LeaderInterrupted())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: str, coro_fn: Callable[[], Awaitable]) -> Any:
+        """
+        do() for coroutines on the shared event loop. coro_fn creates the call's coroutine and
+        is only invoked by the leader. Needs no lock, as every caller runs on the loop thread.
+        """
+        while key in self._async_calls:
+            self.coalesced += 1
+            increment('coalesced')
+            try:
+                # Shielded so a cancelled waiter does not cancel the call for everyone else
+                return await asyncio.shield(self._async_calls[key])
+            except _LeaderInterrupted:
+                continue
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_fn()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here so an exception nobody waited for is not logged
+            raise
+        except BaseException:
+            future.set_exception(_LeaderInterrupted())
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[key]
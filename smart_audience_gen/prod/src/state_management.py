@@ -1,6 +1,19 @@
 import streamlit as st
 import uuid
-import copy
+from collections import deque
+from config.settings import STATE_HISTORY_DEPTH
+
+_MISSING = object()
+_UNJOURNALED_KEYS = ('state_history', 'state_version', 'last_feedback')
+
+def _snapshot(value):
+    # Lists and dicts are mutated in place (e.g. conversation_history.append), so keep a
+    # shallow copy. Their items are shared with the live state rather than deep-copied.
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
 
 class StateManager:
     @staticmethod
@@ -17,22 +30,26 @@ class StateManager:
         st.session_state.use_presearch_filter = False
         st.session_state.session_id = str(uuid.uuid4())
         st.session_state.post_search_results = None
+        st.session_state.search_cache = {} # Scored segments per (description, filter, top_k), kept across audience edits
         st.session_state.last_feedback = ""
-        st.session_state.state_backup = None
+        st.session_state.state_history = deque(maxlen=STATE_HISTORY_DEPTH)
+        st.session_state.state_version = 0
         st.session_state.user_feedback = ""
         st.session_state.optimization_strategy = ""
+        st.session_state.methodology_requested = False # Kept across the reruns that poll the methodology job
 
 
     @staticmethod
     def update(**kwargs):
-        # Create a backup before updating
-        StateManager.create_backup()
-        
-        for key, value in kwargs.items():
-            if key in st.session_state:
-                st.session_state[key] = value
-            else:
+        for key in kwargs:
+            if key not in st.session_state:
                 raise AttributeError(f"State has no attribute '{key}'")
+
+        # Journal the previous values of the keys being changed before updating
+        StateManager.create_backup(kwargs.keys())
+
+        for key, value in kwargs.items():
+            st.session_state[key] = value
         
         # Save full state as JSON debugging
         # import json
@@ -43,7 +60,7 @@ class StateManager:
         # filename = f"state_{timestamp}.json"
         # filepath = os.path.join("/Users/adamhunter/Documents/streamlit_segment_search/json_artifacts", filename)
         
-        # state_dict = {key: value for key, value in st.session_state.items() if key != 'state_backup'}
+        # state_dict = {key: value for key, value in st.session_state.items() if key not in _UNJOURNALED_KEYS}
         
         # with open(filepath, 'w') as f:
         #     json.dump(state_dict, f, indent=2, default=str)
@@ -58,6 +75,7 @@ class StateManager:
             summary_results=None,
             audience_report=None,
             final_report=None,
+            methodology_requested=False,
             stage=1
         )
 
@@ -66,20 +84,49 @@ class StateManager:
         return st.session_state.get(attr)
     
     @staticmethod
-    def create_backup():
-        # Create a deep copy of the current state
-        backup = {key: copy.deepcopy(value) for key, value in st.session_state.items() if key != 'state_backup' and key != 'last_feedback'}
-        st.session_state.state_backup = backup
+    def version():
+        return st.session_state.get('state_version', 0)
 
     @staticmethod
-    def restore_backup():
-        if st.session_state.state_backup:
-            for key, value in st.session_state.state_backup.items():
+    def create_backup(keys):
+        # Record only the previous values of the changed keys, so each update costs O(changed keys)
+        delta = {
+            key: _snapshot(st.session_state.get(key, _MISSING))
+            for key in keys if key not in _UNJOURNALED_KEYS
+        }
+        if not delta:
+            return
+        st.session_state.state_history.append((st.session_state.state_version, delta))
+        st.session_state.state_version += 1
+
+    @staticmethod
+    def clear_history():
+        st.session_state.state_history.clear()
+
+    @staticmethod
+    def restore_version(version):
+        """Undo journaled updates until the state is back at version. Returns False if it is no longer in the history."""
+        history = st.session_state.state_history
+        if not history or history[0][0] > version:
+            return False
+        while history and history[-1][0] >= version:
+            previous_version, delta = history.pop()
+            for key, value in delta.items():
                 try:
-                    st.session_state[key] = value
+                    if value is _MISSING:
+                        del st.session_state[key]
+                    else:
+                        st.session_state[key] = value
                 except Exception as e:
                     print(f"Error restoring state for key {key}: {e}")
-            st.session_state.state_backup = None
+            st.session_state.state_version = previous_version
+        return True
+
+    @staticmethod
+    def restore_backup():
+        # Undo the most recent update
+        if st.session_state.state_history:
+            StateManager.restore_version(st.session_state.state_history[-1][0])
         else:
             st.warning("No backup available to restore.")
 
@@ -0,0 +1,51 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+
+class SummaryStore:
+    """
+    Local exact-key store of researcher summaries, keyed by the same sha256 id as the
+    pinecone researcher cache. Recent entries are also kept in memory, and entries
+    older than ttl_seconds (by the time the summary was written) are treated as misses.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._memory: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries "
+                "(id TEXT PRIMARY KEY, domain TEXT, data_type TEXT, summary TEXT NOT NULL, timestamp INTEGER NOT NULL)"
+            )
+
+    def _fresh(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return entry is not None and entry['timestamp'] >= time.time() - self.ttl_seconds
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        """Return {'domain', 'data_type', 'summary', 'timestamp'} for a fresh entry, or None."""
+        with self._lock:
+            entry = self._memory.get(id)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT domain, data_type, summary, timestamp FROM summaries WHERE id = ?", (id,)
+                ).fetchone()
+                if row is not None:
+                    entry = self._memory[id] = dict(zip(('domain', 'data_type', 'summary', 'timestamp'), row))
+        return entry if self._fresh(entry) else None
+
+    def put(self, id: str, summary: str, timestamp: int, domain: str = None, data_type: str = None):
+        entry = {'domain': domain, 'data_type': data_type, 'summary': summary, 'timestamp': int(timestamp)}
+        with self._lock:
+            self._memory[id] = entry
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO summaries (id, domain, data_type, summary, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (id, domain, data_type, summary, int(timestamp))
+                )
@@ -0,0 +1,74 @@
+"""
+Tag every segment in the pinecone index with an is_non_us metadata flag.
+
+Run from the prod directory:
+    python -m src.tag_non_us [--dry-run] [--workers N]
+
+Once the catalogue is tagged, set NON_US_FILTER_PUSHDOWN = True in config/settings.py
+so non-US segments are excluded inside the vector query instead of after retrieval.
+"""
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from .index_snapshot import iter_index_records
+from .segment_processing import is_non_us, segment_location_text
+
+MAX_REPORTED_FAILURES = 20 # Failed updates printed individually before only being counted
+
+def tag_non_us(index, batch_size: int = 1000, workers: int = 20, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    Set is_non_us on every record whose flag is missing or stale. Updates are sent batch_size
+    at a time, each batch finishing before the next is read. Returns the numbers of records
+    tagged and of updates that failed.
+    """
+    tagged = failed = 0
+    batch: List[Tuple[str, bool]] = []
+
+    def send_batch():
+        nonlocal tagged, failed
+        futures = [(record_id, executor.submit(index.update, id=record_id, set_metadata={'is_non_us': flag})) for record_id, flag in batch]
+        for record_id, future in futures:
+            error = future.exception()
+            if error is None:
+                tagged += 1
+                continue
+            failed += 1
+            if failed <= MAX_REPORTED_FAILURES:
+                print(f"Failed to tag {record_id}: {error!r}")
+        if (tagged + failed) // 10000 > (tagged + failed - len(batch)) // 10000:
+            print(f"Tagged {tagged} records, {failed} failed")
+        batch.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record_id, _, metadata in iter_index_records(index, batch_size):
+            flag = is_non_us(segment_location_text(record_id, metadata))
+            if metadata.get('is_non_us') == flag:
+                continue
+            if dry_run:
+                tagged += 1
+                continue
+            batch.append((record_id, flag))
+            if len(batch) >= batch_size:
+                send_batch()
+        if batch:
+            send_batch()
+    if dry_run:
+        print(f"Would tag {tagged} records")
+    else:
+        print(f"Tagged {tagged} records, {failed} updates failed")
+    return tagged, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag pinecone segments with is_non_us.")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=20)
+    args = parser.parse_args()
+
+    from .pinecone_utils import index
+    _, failed = tag_non_us(index, workers=args.workers, dry_run=args.dry_run)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
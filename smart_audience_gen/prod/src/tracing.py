@@ -0,0 +1,244 @@
+"""
+Lightweight tracing for the audience pipeline.
+
+Spans are nested through a context variable, so a span opened inside another becomes
+its child. Work handed to thread pools or the async client loop keeps its parent when
+submitted through submit_with_context, wrap_with_context or bind_context, and spans from
+background job workers are added to the trace of the run that collects the job. Finished traces
+are kept in memory for the debug panel, optionally appended to a JSON lines file and
+logged, and mirrored to OpenTelemetry when it is installed and enabled.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Coroutine, Dict, List, Optional
+from config.settings import TRACING_ENABLED, TRACE_EXPORT_PATH, TRACE_CONSOLE, TRACE_HISTORY, TRACE_OPENTELEMETRY
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = 'ok'
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def set_attribute(self, key: str, value: Any):
+        with self._lock:
+            self.attributes[key] = value
+
+    def increment(self, key: str, amount: float = 1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round(self.duration_ms, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+_traces: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+_traces_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def set_attribute(key: str, value: Any):
+    """Set an attribute on the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+def increment(key: str, amount: float = 1):
+    """Add to a counter attribute (retries, tokens, cache hits) on the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.increment(key, amount)
+
+def count_retries(before_sleep: Callable) -> Callable:
+    """Wrap a tenacity before_sleep hook so each retry is also counted on the current span."""
+    def hook(retry_state):
+        increment('retries')
+        return before_sleep(retry_state)
+    return hook
+
+def _export(span: Span):
+    record = span.to_dict()
+    with _traces_lock:
+        # A root with no children (a rerun that made no traced calls) is not worth keeping
+        if span.parent_id is not None or span.trace_id in _traces:
+            _traces.setdefault(span.trace_id, []).append(record)
+            _traces.move_to_end(span.trace_id)
+            while len(_traces) > TRACE_HISTORY:
+                _traces.popitem(last=False)
+    if TRACE_CONSOLE:
+        logger.info(f"{span.name}: {record['duration_ms']:.1f} ms {span.attributes}")
+    if TRACE_EXPORT_PATH:
+        with _export_lock:
+            os.makedirs(os.path.dirname(TRACE_EXPORT_PATH), exist_ok=True)
+            with open(TRACE_EXPORT_PATH, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span, or as the root of a new trace."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    otel_span = None
+    if TRACE_OPENTELEMETRY and otel_trace is not None:
+        otel_span = otel_trace.get_tracer(__name__).start_span(name)
+    try:
+        yield current
+    except Exception as e:  # Streamlit's rerun and stop signals are BaseExceptions and not errors
+        current.status = 'error'
+        current.set_attribute('error', repr(e))
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+        if otel_span is not None:
+            for key, value in current.attributes.items():
+                otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+            otel_span.end()
+        _export(current)
+
+def traced(name: str = None):
+    """Decorator wrapping each call of a function (sync or async) in a span."""
+    def decorator(fn: Callable):
+        span_name = name or fn.__name__
+        if hasattr(fn, '__code__') and fn.__code__.co_flags & 0x80:  # Coroutine function
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def wrap_with_context(fn: Callable) -> Callable:
+    """Bind fn to the current span so it keeps its parent when run on another thread."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+def submit_with_context(executor, fn: Callable, *args, **kwargs):
+    """executor.submit that keeps the current span as the parent of spans opened by fn."""
+    return executor.submit(wrap_with_context(fn), *args, **kwargs)
+
+async def _run_with_parent(coro: Coroutine, parent: Optional[Span]):
+    token = _current_span.set(parent)
+    try:
+        return await coro
+    finally:
+        _current_span.reset(token)
+
+def bind_context(coro: Coroutine) -> Coroutine:
+    """Keep the current span as the parent of a coroutine scheduled on the shared event loop."""
+    return _run_with_parent(coro, _current_span.get())
+
+def take_trace(trace_id: str) -> List[Dict[str, Any]]:
+    """Remove a finished trace from memory and return its spans, e.g. to hand a worker's trace to the server."""
+    with _traces_lock:
+        return _traces.pop(trace_id, [])
+
+def adopt_spans(spans: List[Dict[str, Any]]):
+    """
+    Add finished spans recorded in another process (a background job's trace) to the current
+    trace for the debug panel, with their root re-parented under the current span.
+    """
+    parent = _current_span.get()
+    if parent is None or not spans:
+        return
+    span_ids = {s['span_id'] for s in spans}
+    adopted = [{**s, 'trace_id': parent.trace_id, 'parent_id': s['parent_id'] if s['parent_id'] in span_ids else parent.span_id}
+               for s in spans]
+    with _traces_lock:
+        _traces.setdefault(parent.trace_id, []).extend(adopted)
+        _traces.move_to_end(parent.trace_id)
+        while len(_traces) > TRACE_HISTORY:
+            _traces.popitem(last=False)
+
+def recent_traces(**root_attributes) -> List[List[Dict[str, Any]]]:
+    """Finished traces, newest first, whose root span has all of root_attributes."""
+    with _traces_lock:
+        traces = [list(spans) for spans in reversed(_traces.values())]
+    matching = []
+    for spans in traces:
+        root = next((s for s in spans if s['parent_id'] is None), None)
+        if root and all(root['attributes'].get(key) == value for key, value in root_attributes.items()):
+            matching.append(spans)
+    return matching
+
+def waterfall_rows(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Flatten a trace for a waterfall chart: offsets in ms from the root span, and a row
+    label from the span's ancestry so repeated calls (one per segment) share a row.
+    """
+    by_id = {s['span_id']: s for s in spans}
+    origin = min(s['start'] for s in spans)
+
+    def path(s):
+        names = []
+        while s is not None:
+            names.append(s['name'])
+            s = by_id.get(s['parent_id'])
+        return names[::-1]
+
+    rows = []
+    for s in sorted(spans, key=lambda s: s['start']):
+        names = path(s)
+        rows.append({
+            'row': '  ' * (len(names) - 1) + names[-1],
+            'path': ' > '.join(names),
+            'name': s['name'],
+            'start_ms': (s['start'] - origin) * 1000,
+            'end_ms': (s['end'] - origin) * 1000,
+            'duration_ms': s['duration_ms'],
+            'status': s['status'],
+            'cache_hit': bool(s['attributes'].get('cache_hit')),
+            'retries': s['attributes'].get('retries', 0),
+            'tokens': s['attributes'].get('prompt_tokens', 0) + s['attributes'].get('completion_tokens', 0),
+            'attributes': json.dumps(s['attributes'], default=str),
+        })
+    return rows
@@ -1,12 +1,19 @@
 import streamlit as st
 from src.ui_utils import get_json_diff
+from src.tracing import waterfall_rows
+import altair as alt
+import pandas as pd
 import json
 import re
+import time
 
 
 def render_company_input():
     return st.text_input("Enter any company name or brief campaign desription:", "McDonalds")
 
+def render_refresh_option() -> bool:
+    return st.checkbox("Regenerate instead of using a previously generated audience")
+
 def render_user_feedback():
     return st.text_input("Provide feedback on the audience segments:")
 
@@ -60,6 +67,20 @@ def render_actual_segments(data):
                         for actual_segment in segment.get("ActualSegments", []):
                             display_actual_segment(actual_segment)
 
+def render_partial_audience(placeholder, audience_json):
+    """Render audience groups into a placeholder while the JSON is still streaming in."""
+    lines = []
+    audience = audience_json.get('Audience') if isinstance(audience_json.get('Audience'), dict) else {}
+    for section in ['included', 'excluded']:
+        groups = audience.get(section) if isinstance(audience.get(section), dict) else {}
+        if groups:
+            lines.append(f"### {section.capitalize()}")
+        for category, segments in groups.items():
+            lines.append(f"**{category}**")
+            if isinstance(segments, list):
+                lines.extend(f"- {segment.get('description', '')}" for segment in segments if isinstance(segment, dict))
+    placeholder.markdown("\n".join(lines))
+
 def render_audience_report(report):
     st.subheader("Audience Report")
     st.markdown(report)
@@ -151,4 +172,51 @@ def display_segment_detail(segment):
     st.markdown(f"**Description:** {description}")
     st.markdown("**Summary:**")
     st.markdown(segment.get('summary', 'N/A'))
-    st.markdown("---")
\ No newline at end of file
+    st.markdown("---")
+
+
+def render_job_progress(label, job):
+    st.progress(job['progress'], text=f"{label} ({job['status']})")
+
+def render_job_failure(label, error) -> bool:
+    """Show a failed background job. Returns True if the user asks to retry it."""
+    st.error(f"{label} failed: {error}")
+    return st.button("Retry")
+
+def render_trace_toggle() -> bool:
+    return st.sidebar.checkbox("Show latency traces", help="Waterfall of embedding, search, rerank and LLM calls for recent runs.")
+
+def render_trace_panel(traces, score_cache_stats=None):
+    """Waterfall and per-step totals for one of this session's recent runs, plus relevance score cache totals."""
+    st.subheader("Latency Traces")
+    if score_cache_stats is not None:
+        st.caption(f"Relevance score cache: {score_cache_stats['hits']:,} hits, {score_cache_stats['misses']:,} misses "
+                   f"({score_cache_stats['hit_rate']:.1%} hit rate) across all sessions and workers")
+    if not traces:
+        st.info("No traced runs yet.")
+        return
+
+    labels = [f"{time.strftime('%H:%M:%S', time.localtime(min(s['start'] for s in spans)))} "
+              f"({max(s['duration_ms'] for s in spans) / 1000:.1f}s, {len(spans)} spans)" for spans in traces]
+    selected = st.selectbox("Run", range(len(traces)), format_func=lambda i: labels[i])
+    rows = pd.DataFrame(waterfall_rows(traces[selected]))
+
+    chart = alt.Chart(rows).mark_bar(opacity=0.7).encode(
+        x=alt.X('start_ms:Q', title='ms since start of run'),
+        x2='end_ms:Q',
+        y=alt.Y('row:N', sort=list(dict.fromkeys(rows['row'])), title=None, axis=alt.Axis(labelLimit=400)),
+        color=alt.Color('status:N', scale=alt.Scale(domain=['ok', 'error'], range=['#4c78a8', '#e45756']), legend=None),
+        tooltip=['path', alt.Tooltip('duration_ms:Q', format='.1f'), 'attributes']
+    ).properties(height=max(200, 22 * rows['row'].nunique()))
+    st.altair_chart(chart, use_container_width=True)
+
+    totals = rows.groupby('name').agg(
+        calls=('duration_ms', 'size'),
+        total_ms=('duration_ms', 'sum'),
+        p50_ms=('duration_ms', 'median'),
+        max_ms=('duration_ms', 'max'),
+        cache_hits=('cache_hit', 'sum'),
+        retries=('retries', 'sum'),
+        tokens=('tokens', 'sum')
+    ).sort_values('total_ms', ascending=False)
+    st.dataframe(totals.round(1), use_container_width=True)
@@ -0,0 +1,17 @@
+import os
+import sys
+import streamlit as st
+
+PROD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROD_DIR)
+# No test calls an API. A service URL stops the Pinecone client looking up index hosts at import
+os.environ.setdefault('SERVICE_BASE_URL', 'http://127.0.0.1:9')
+
+class PlaceholderSecrets(dict):
+    """Stands in for st.secrets so config.settings imports without a secrets file. No test calls a real API."""
+
+    def __missing__(self, key):
+        return 'test'
+
+if not st.secrets.load_if_toml_exists():
+    st.secrets = PlaceholderSecrets()
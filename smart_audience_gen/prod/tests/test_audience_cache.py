@@ -0,0 +1,59 @@
+import json
+import pytest
+from src import audience_generation
+from src.audience_cache import AudienceCache, normalize_company_name
+from src.data_processing import ensure_dict
+
+AUDIENCE = {'Included': [{'Category': 'Travel', 'Description': 'Frequent flyers'}], 'Excluded': []}
+HISTORY = [{'role': 'user', 'content': 'prompt'}, {'role': 'assistant', 'content': 'response'}]
+
+@pytest.fixture
+def cache(tmp_path):
+    return AudienceCache(str(tmp_path / 'audiences.db'), ttl_seconds=60)
+
+def test_normalize_company_name():
+    assert normalize_company_name('Nike, Inc.') == normalize_company_name('nike') == 'nike'
+    assert normalize_company_name('Co') == 'co'
+
+def test_round_trip_and_invalidate(cache):
+    cache.put('audience', 'Nike, Inc.', 'v1', 'model', AUDIENCE, HISTORY)
+    assert cache.get('audience', 'nike', 'v1', 'model') == {'response': AUDIENCE, 'conversation': HISTORY}
+    assert cache.get('audience', 'nike', 'v2', 'model') is None
+    assert cache.invalidate('NIKE') == 1
+    assert cache.get('audience', 'nike', 'v1', 'model') is None
+
+def test_expired_entries_miss(tmp_path):
+    cache = AudienceCache(str(tmp_path / 'audiences.db'), ttl_seconds=-1)
+    cache.put('description', 'Nike', 'v1', 'model', 'description', HISTORY)
+    assert cache.get('description', 'Nike', 'v1', 'model') is None
+
+def test_generate_audience_reuses_stored_audience(cache, monkeypatch):
+    calls = []
+
+    def generate_company_description(company_name, conversation_history, force_refresh=False):
+        calls.append('description')
+        return 'description', conversation_history + HISTORY
+
+    def generate_audience_segments(company_name, company_description, conversation_history):
+        calls.append('segments')
+        # Like the real function, the audience comes back as a JSON string
+        return json.dumps(AUDIENCE), conversation_history
+
+    monkeypatch.setattr(audience_generation, 'get_audience_cache', lambda: cache)
+    monkeypatch.setattr(audience_generation, 'generate_company_description', generate_company_description)
+    monkeypatch.setattr(audience_generation, 'generate_audience_segments', generate_audience_segments)
+
+    generated, generated_history = audience_generation.generate_audience('Nike', [])
+    cached, cached_history = audience_generation.generate_audience('Nike, Inc.', [])
+
+    assert calls == ['description', 'segments']
+    assert type(cached) is type(generated)
+    assert ensure_dict(cached) == ensure_dict(generated) == AUDIENCE
+    assert cached_history == generated_history
+
+def test_generate_audience_skips_cache_with_history(cache, monkeypatch):
+    monkeypatch.setattr(audience_generation, 'get_audience_cache', lambda: cache)
+    monkeypatch.setattr(audience_generation, 'generate_company_description', lambda name, history, force_refresh=False: ('description', history))
+    monkeypatch.setattr(audience_generation, 'generate_audience_segments', lambda name, description, history: (json.dumps(AUDIENCE), history))
+    audience_generation.generate_audience('Nike', list(HISTORY))
+    assert cache.get('audience', 'Nike', audience_generation.AUDIENCE_PROMPT_VERSION, audience_generation.AUDIENCE_MODELS) is None
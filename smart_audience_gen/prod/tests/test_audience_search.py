@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+from src import audience_search
+
+# Candidate ids in the order each strategy prefers them
+CTR_ORDER = ['a', 'b', 'c', 'd', 'e', 'f']
+RELEVANCE = {'a': 0.5, 'b': 0.5, 'c': 0.95, 'd': 0.5, 'e': 0.5, 'f': 0.95}
+
+@pytest.fixture
+def scored_ids(monkeypatch):
+    scored_ids = []
+
+    def score_wave(query, wave, executor):
+        scored_ids.extend(segment['id'] for segment in wave)
+        return [{**segment, 'relevance_score': RELEVANCE[segment['id']]} for segment in wave]
+
+    monkeypatch.setattr(audience_search, 'score_wave', score_wave)
+    monkeypatch.setattr(audience_search, 'RERANK_MODE', 'pointwise')
+    monkeypatch.setattr(audience_search, 'RERANK_WAVE_SIZE', 2)
+    monkeypatch.setattr(audience_search, 'RERANK_BUDGET', 6)
+    monkeypatch.setattr(audience_search, 'RELEVANCE_THRESHOLD', 0.9)
+    monkeypatch.setattr(audience_search, 'SECONDARY_RELEVANCE_THRESHOLD', 0.4)
+    monkeypatch.setattr(audience_search, 'RERANK_VECTOR_WEIGHT', 0.0)
+    return scored_ids
+
+@pytest.fixture
+def candidates():
+    ctr = [6.0, 5.0, 4.0, 3.0, 2.0, 1.0]
+    return pd.DataFrame({
+        'id': CTR_ORDER,
+        'vector_score': [0.8] * 6,
+        'ctr_optimization_score': ctr,
+        'cpa_optimization_score': [-score for score in ctr],
+        'composite_optimization_score': [0.0] * 6,
+        'optimization_score': ctr,
+    })
+
+def test_rerank_stops_after_the_wave_with_a_relevant_segment(scored_ids, candidates):
+    segments = audience_search.rerank_candidates('query', candidates, 'ctr')
+    assert [s['id'] for s in segments] == ['a', 'b', 'c', 'd']
+    assert scored_ids == ['a', 'b', 'c', 'd']
+
+def test_rerank_spends_at_most_the_budget(scored_ids, candidates, monkeypatch):
+    monkeypatch.setattr(audience_search, 'RELEVANCE_THRESHOLD', 1.0)
+    monkeypatch.setattr(audience_search, 'RERANK_BUDGET', 3)
+    assert len(audience_search.rerank_candidates('query', candidates, 'ctr')) == 3
+
+def test_rerank_reuses_scored_segments(scored_ids, candidates):
+    scored = {}
+    audience_search.rerank_candidates('query', candidates, 'ctr', scored)
+    scored_ids.clear()
+    segments = audience_search.rerank_candidates('query', candidates, 'ctr', scored)
+    assert scored_ids == []
+    assert [s['id'] for s in segments] == ['a', 'b', 'c', 'd']
+
+def test_search_reranks_every_strategy_scoring_each_segment_once(scored_ids, candidates):
+    entry = audience_search.rerank_description('query', candidates)
+    # ctr and composite stop at c, cpa at f; the waves of all three are scored together
+    assert sorted(scored_ids) == ['a', 'b', 'c', 'd', 'e', 'f']
+    for strategy in audience_search.OPTIMIZATION_STRATEGIES:
+        fresh = audience_search.rerank_candidates('query', candidates, strategy)
+        assert [s['id'] for s in entry['reranked'][strategy]] == [s['id'] for s in fresh]
+
+def test_strategy_switch_makes_no_api_calls(scored_ids, candidates):
+    entry = audience_search.rerank_description('query', candidates)
+    scored_ids.clear()
+    switched = audience_search.reranked_segments('query', entry, 'cpa')
+    assert scored_ids == []
+    assert audience_search.select_segments(switched, 'cpa')['id'].tolist() == ['f']
+    assert audience_search.select_segments(audience_search.reranked_segments('query', entry, 'ctr'), 'ctr')['id'].tolist() == ['c']
+
+def test_select_segments_falls_back_to_secondary_threshold(scored_ids):
+    segments = [
+        {'id': 'a', 'relevance_score': 0.6, 'ctr_optimization_score': 1.0},
+        {'id': 'b', 'relevance_score': 0.7, 'ctr_optimization_score': 2.0},
+        {'id': 'c', 'relevance_score': 0.1, 'ctr_optimization_score': 3.0},
+    ]
+    selected = audience_search.select_segments(segments, 'ctr')
+    assert selected['id'].tolist() == ['b', 'a']
+
+def test_pending_descriptions_skips_searched_and_repeated_descriptions():
+    items = [('a', 'included', 'g'), ('b', 'included', 'g'), ('a', 'excluded', 'h'), ('c', 'excluded', 'h')]
+    search_cache = {audience_search.search_cache_key('b', {}, 50): {}}
+    assert audience_search.pending_descriptions(items, {}, 50, search_cache) == ['a', 'c']
+    assert audience_search.pending_descriptions(items, {'BrandName': 'Acme'}, 50, search_cache) == ['a', 'b', 'c']
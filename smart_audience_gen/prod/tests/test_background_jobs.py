@@ -0,0 +1,119 @@
+import sqlite3
+import pytest
+from src.background_jobs import JobStore, job_id
+
+TTL = 60
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite'))
+
+def create(store, id='job', session_id='session', retry_failed=False, ttl=TTL):
+    return store.create(id, 'search', {'descriptions': ['a']}, session_id, retry_failed, ttl)
+
+def test_job_id_is_stable_and_depends_on_kind_and_payload():
+    assert job_id('search', {'a': 1, 'b': 2}) == job_id('search', {'b': 2, 'a': 1})
+    assert job_id('search', {'a': 1}) != job_id('report', {'a': 1})
+    assert job_id('search', {'a': 1}) != job_id('search', {'a': 2})
+
+def test_lifecycle(store):
+    assert create(store)
+    assert store.get('job')['status'] == 'queued'
+    assert store.claim('job') == ('search', {'descriptions': ['a']})
+    assert store.get('job')['status'] == 'running'
+    store.set_progress('job', 0.5)
+    assert store.get('job')['progress'] == 0.5
+    store.finish('job', {'search_cache': {('a', '{}', 50): [1, 2]}})
+    job = store.get('job')
+    assert (job['status'], job['progress']) == ('done', 1)
+    assert store.result('job') == {'search_cache': {('a', '{}', 50): [1, 2]}}
+
+def test_worker_spans_are_kept_with_the_result(store):
+    spans = [{'name': 'job', 'span_id': 'a', 'parent_id': None}]
+    create(store)
+    store.claim('job')
+    assert store.spans('job') == []
+    store.finish('job', 'result', spans)
+    assert store.spans('job') == spans
+    assert create(store, ttl=-1)
+    assert store.spans('job') == []
+
+def test_adds_the_spans_column_to_an_existing_table(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+        "progress REAL NOT NULL DEFAULT 0, result BLOB, error TEXT, worker_pid INTEGER, created REAL NOT NULL, updated REAL NOT NULL)"
+    )
+    conn.close()
+    store = JobStore(path)
+    create(store)
+    store.claim('job')
+    store.finish('job', 'result', [{'name': 'job'}])
+    assert store.spans('job') == [{'name': 'job'}]
+
+def test_progress_is_clamped(store):
+    create(store)
+    store.claim('job')
+    store.set_progress('job', 1.5)
+    assert store.get('job')['progress'] == 1
+    store.set_progress('job', -1)
+    assert store.get('job')['progress'] == 0
+
+def test_identical_jobs_are_joined_not_rerun(store):
+    assert create(store, session_id='first')
+    assert not create(store, session_id='second')
+    assert [job['id'] for job in store.jobs_for_session('first')] == ['job']
+    assert [job['id'] for job in store.jobs_for_session('second')] == ['job']
+
+def test_only_one_worker_claims_a_job(store, tmp_path):
+    other = JobStore(str(tmp_path / 'jobs.sqlite'))
+    create(store)
+    assert store.claim('job') is not None
+    assert other.claim('job') is None
+
+def test_results_are_only_returned_when_done(store):
+    create(store)
+    assert store.result('job') is None
+    store.claim('job')
+    assert store.result('job') is None
+
+def test_failed_jobs_rerun_only_when_retried(store):
+    create(store)
+    store.claim('job')
+    store.fail('job', 'ValueError: boom')
+    assert store.get('job')['error'] == 'ValueError: boom'
+    assert not create(store)
+    assert create(store, retry_failed=True)
+    job = store.get('job')
+    assert (job['status'], job['error']) == ('queued', None)
+
+def test_fail_does_not_overwrite_a_finished_job(store):
+    create(store)
+    store.claim('job')
+    store.finish('job', 'result')
+    store.fail('job', 'Worker failed')
+    assert store.get('job')['status'] == 'done'
+
+def test_stale_results_are_rerun(store):
+    create(store)
+    store.claim('job')
+    store.finish('job', 'result')
+    assert not create(store)
+    assert create(store, ttl=-1)
+    assert store.get('job')['status'] == 'queued'
+    assert store.result('job') is None
+
+def test_orphaned_jobs_are_requeued(store):
+    for id in ('queued', 'alive', 'dead', 'done'):
+        create(store, id=id)
+    for id in ('alive', 'dead', 'done'):
+        store.claim(id)
+    store.finish('done', 'result')
+    # Above the Linux pid limit, so no live process has it
+    store._execute("UPDATE jobs SET worker_pid = ? WHERE id = 'dead'", (2 ** 22 + 1,))
+
+    assert sorted(store.orphaned()) == ['dead', 'queued']
+    assert store.get('dead')['status'] == 'queued'
+    assert store.get('alive')['status'] == 'running'
+    assert store.claim('dead') is not None
@@ -0,0 +1,64 @@
+from src.context_window import SUMMARY_HEADER, SUMMARY_TURN_CHARS, count_message_tokens, fit_context, summarize_turns
+
+MODEL = 'gpt-4o-mini'
+
+def conversation(turns: int, words: int = 50):
+    history = []
+    for turn in range(turns):
+        history.append({'role': 'user', 'content': f"request {turn} " + 'word ' * words})
+        history.append({'role': 'assistant', 'content': f"answer {turn} " + 'word ' * words})
+    return history
+
+def tokens(messages):
+    return sum(count_message_tokens(message, MODEL) for message in messages)
+
+def test_history_within_budget_is_unchanged():
+    history = conversation(3)
+    assert fit_context(history, MODEL, tokens(history), num_first=2, summary_tokens=50) is history
+
+def test_short_history_is_never_trimmed():
+    history = conversation(1)
+    assert fit_context(history, MODEL, 10, num_first=1, summary_tokens=50) is history
+
+def test_keeps_head_and_latest_turns_within_budget():
+    history = conversation(20)
+    budget = tokens(history) // 3
+    context = fit_context(history, MODEL, budget, num_first=2, summary_tokens=100)
+
+    assert context[:2] == history[:2]
+    assert context[2]['content'].startswith(SUMMARY_HEADER)
+    assert context[-1] == history[-1]
+    tail = context[3:]
+    assert tail == history[len(history) - len(tail):]
+    assert tokens(context) <= budget
+
+def test_tail_never_opens_on_a_reply():
+    history = conversation(20)
+    for budget in range(300, tokens(history), 97):
+        context = fit_context(history, MODEL, budget, num_first=2, summary_tokens=60)
+        if len(context) > 4 and context[2]['content'].startswith(SUMMARY_HEADER):
+            assert context[3]['role'] == 'user'
+
+def test_latest_message_is_sent_even_over_budget():
+    history = conversation(5, words=500)
+    context = fit_context(history, MODEL, 10, num_first=1, summary_tokens=20)
+    assert context[0] == history[0]
+    assert context[-1] == history[-1]
+
+def test_summary_lists_user_turns_most_recent_last():
+    history = conversation(3)
+    summary = summarize_turns(history, MODEL, max_tokens=1000)
+    lines = summary['content'][len(SUMMARY_HEADER):].split('\n')
+    assert summary['role'] == 'user'
+    assert [line.split()[1:3] for line in lines] == [['request', '0'], ['request', '1'], ['request', '2']]
+
+def test_summary_keeps_the_most_recent_turns_that_fit():
+    history = conversation(30)
+    summary = summarize_turns(history, MODEL, max_tokens=120)
+    assert count_message_tokens(summary, MODEL) <= 120
+    assert 'request 29 ' in summary['content']
+    assert 'request 0 ' not in summary['content']
+
+def test_summary_truncates_long_turns():
+    summary = summarize_turns([{'role': 'user', 'content': 'x' * (SUMMARY_TURN_CHARS * 2)}], MODEL, max_tokens=1000)
+    assert summary['content'].endswith('x' * SUMMARY_TURN_CHARS + '...')
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from src.embedding_cache import EmbeddingCache
+
+DIMENSIONS = 4
+
+def vector(value: float):
+    return [value] * DIMENSIONS
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path)
+
+def test_round_trip_and_miss(cache_dir):
+    cache = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=4)
+    cache.put_many(['a', 'b'], [vector(1), vector(2)])
+    assert cache.get('a') == vector(1)
+    assert cache.get('b') == vector(2)
+    assert cache.get('c') is None
+
+def test_overwriting_a_key_keeps_its_slot(cache_dir):
+    cache = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=2)
+    cache.put_many(['a', 'b'], [vector(1), vector(2)])
+    cache.put_many(['a'], [vector(3)])
+    assert cache.get('a') == vector(3)
+    assert cache.get('b') == vector(2)
+
+def test_evicts_least_recently_used(cache_dir):
+    cache = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=2)
+    cache.put_many(['a'], [vector(1)])
+    cache.put_many(['b'], [vector(2)])
+    assert cache.get('a') == vector(1)  # b is now the least recently used
+    cache.put_many(['c'], [vector(3)])
+    assert cache.get('b') is None
+    assert cache.get('a') == vector(1)
+    assert cache.get('c') == vector(3)
+
+def test_lru_order_is_shared_between_instances(cache_dir):
+    writer = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=2)
+    reader = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=2)
+    writer.put_many(['a'], [vector(1)])
+    writer.put_many(['b'], [vector(2)])
+    assert reader.get('a') == vector(1)
+    writer.put_many(['c'], [vector(3)])
+    assert reader.get('b') is None
+    assert reader.get('a') == vector(1)
+    assert reader.get('c') == vector(3)
+
+def test_instances_never_share_a_slot(cache_dir):
+    first = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=8)
+    second = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=8)
+    for i in range(20):
+        (first if i % 2 else second).put_many([f'text {i}'], [vector(i)])
+    for i in range(12, 20):
+        assert first.get(f'text {i}') == vector(i)
+
+def test_reopening_keeps_entries(cache_dir):
+    EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=4).put_many(['a'], [vector(1)])
+    assert EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=4).get('a') == vector(1)
+
+def test_new_capacity_starts_empty(cache_dir):
+    EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=4).put_many(['a'], [vector(1)])
+    cache = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=8)
+    assert cache.get('a') is None
+    cache.put_many(['b'], [vector(2)])
+    assert cache.get('b') == vector(2)
+
+def test_stores_float32(cache_dir):
+    cache = EmbeddingCache(cache_dir, 'model', DIMENSIONS, capacity=1)
+    cache.put_many(['a'], [[0.1] * DIMENSIONS])
+    assert cache.get('a') == np.full(DIMENSIONS, 0.1, dtype=np.float32).tolist()
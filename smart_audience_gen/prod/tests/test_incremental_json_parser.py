@@ -0,0 +1,53 @@
+import json
+import pytest
+from src.data_processing import IncrementalJSONParser
+
+AUDIENCE = {
+    'Audience': {
+        'included': {'Travel': [{'description': 'Frequent "business" flyers'}, {'description': 'Hotel loyalty members \\ elite'}]},
+        'excluded': {'Age': [{'description': 'Under 18'}]}
+    }
+}
+
+def parse(*chunks):
+    parser = IncrementalJSONParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser
+
+def test_no_object_yet():
+    parser = parse('Here is the audience: ')
+    assert parser.start < 0
+    assert parser.value() is None
+
+def test_skips_text_before_the_object():
+    text = json.dumps(AUDIENCE)
+    assert parse('```json\n', text, '\n```').value() == AUDIENCE
+
+def test_closes_open_brackets():
+    assert parse('{"a": [1, 2').value() == {'a': [1, 2]}
+    assert parse('{"a": {"b": [{"c": 1}').value() == {'a': {'b': [{'c': 1}]}}
+
+def test_closes_an_open_string():
+    assert parse('{"a": "hel').value() == {'a': 'hel'}
+    assert parse('{"a": "say \\"hi').value() == {'a': 'say "hi'}
+
+def test_drops_a_dangling_escape():
+    assert parse('{"a": "back\\').value() == {'a': 'back'}
+
+def test_falls_back_to_the_last_clean_cut():
+    assert parse('{"a": 1, "b": ').value() == {'a': 1}
+    assert parse('{"a": 1, "b').value() == {'a': 1}
+
+def test_brackets_inside_strings_are_ignored():
+    assert parse('{"a": "[{", "b": [').value() == {'a': '[{', 'b': []}
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64])
+def test_every_prefix_parses_and_the_whole_matches(chunk_size):
+    text = json.dumps(AUDIENCE, indent=2)
+    parser = IncrementalJSONParser()
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        # Once the object has started, every prefix yields a usable partial object
+        assert isinstance(parser.value(), dict)
+    assert parser.value() == AUDIENCE
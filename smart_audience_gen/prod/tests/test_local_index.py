@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.index_snapshot import write_snapshot
+from src.local_index import LocalSegmentIndex, filter_mask
+
+METADATA = pd.DataFrame({
+    'BrandName': ['Data Alliance', 'Acme', 'Data Alliance', None],
+    'size': [100.0, 250.0, np.nan, 50.0],
+    'is_non_us': [False, True, False, None],
+})
+
+def matches(presearch_filter):
+    return filter_mask(METADATA, presearch_filter).tolist()
+
+def test_empty_filter_matches_everything():
+    assert matches({}) == [True, True, True, True]
+
+def test_equality_shorthand_and_operators():
+    assert matches({'BrandName': 'Data Alliance'}) == [True, False, True, False]
+    assert matches({'BrandName': {'$eq': 'Acme'}}) == [False, True, False, False]
+    assert matches({'BrandName': {'$in': ['Acme', 'Other']}}) == [False, True, False, False]
+    assert matches({'BrandName': {'$nin': ['Acme']}}) == [True, False, True, True]
+
+def test_not_equal_keeps_records_without_the_value():
+    assert matches({'is_non_us': {'$ne': True}}) == [True, False, True, True]
+
+def test_comparisons_never_match_missing_values():
+    assert matches({'size': {'$gt': 90}}) == [True, True, False, False]
+    assert matches({'size': {'$gte': 100, '$lt': 250}}) == [True, False, False, False]
+    assert matches({'size': {'$lte': 50}}) == [False, False, False, True]
+
+def test_exists():
+    assert matches({'size': {'$exists': True}}) == [True, True, False, True]
+    assert matches({'size': {'$exists': False}}) == [False, False, True, False]
+
+def test_missing_field_matches_only_negative_operators():
+    assert matches({'vertical': 'travel'}) == [False] * 4
+    assert matches({'vertical': {'$ne': 'travel'}}) == [True] * 4
+    assert matches({'vertical': {'$nin': ['travel']}}) == [True] * 4
+    assert matches({'vertical': {'$exists': False}}) == [True] * 4
+
+def test_and_or():
+    assert matches({'$and': [{'BrandName': 'Data Alliance'}, {'size': {'$gt': 50}}]}) == [True, False, False, False]
+    assert matches({'$or': [{'BrandName': 'Acme'}, {'size': {'$lt': 75}}]}) == [False, True, False, True]
+    assert matches({'BrandName': 'Data Alliance', '$or': [{'size': {'$exists': False}}, {'size': 250}]}) == [False, False, True, False]
+
+def test_unsupported_operator():
+    with pytest.raises(ValueError):
+        matches({'size': {'$regex': '1.*'}})
+
+@pytest.fixture
+def index(tmp_path):
+    vectors = np.array([[1, 0, 0.5, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=np.float32)
+    metadata = [
+        {'BrandName': 'Data Alliance', 'segment_name': 'Travelers'},
+        {'BrandName': 'Acme', 'segment_name': 'Pet owners'},
+        {'BrandName': 'Data Alliance', 'segment_name': 'Car buyers'},
+        {'BrandName': 'Acme', 'segment_name': 'Gamers'},
+    ]
+    output_dir = str(tmp_path / 'snapshot')
+    write_snapshot(output_dir, ['a', 'b', 'c', 'd'], vectors, metadata, build_hnsw=False)
+    return LocalSegmentIndex(output_dir)
+
+def test_query_ranks_by_cosine_similarity(index):
+    results = index.query([0, 0, 1, 0], top_k=2)
+    assert [match['id'] for match in results['matches']] == ['c', 'a']
+    assert results['matches'][0]['metadata'] == {'BrandName': 'Data Alliance', 'segment_name': 'Car buyers'}
+    assert results['matches'][0]['score'] > results['matches'][1]['score']
+
+def test_query_applies_the_filter(index):
+    results = index.query([0, 1, 0, 0.5], top_k=10, filter={'BrandName': 'Acme'}, include_metadata=False)
+    assert [match['id'] for match in results['matches']] == ['b', 'd']
+    assert all('metadata' not in match for match in results['matches'])
+    assert index.query([1, 0, 0, 0], top_k=5, filter={'BrandName': 'Nobody'}) == {'matches': []}
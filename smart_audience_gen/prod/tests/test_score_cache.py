@@ -0,0 +1,46 @@
+import pytest
+from src.score_cache import ScoreCache
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'scores.sqlite')
+
+def test_round_trip(path):
+    cache = ScoreCache(path, ttl_seconds=60, max_entries=10)
+    key = ScoreCache.make_key('model', 'template {query}', 'query', 'doc')
+    assert cache.get(key) is None
+    cache.put(key, 0.75)
+    assert cache.get(key) == 0.75
+
+def test_keys_depend_on_every_part():
+    base = ScoreCache.make_key('model', 'template', 'query', 'doc')
+    assert base == ScoreCache.make_key('model', 'template', 'query', 'doc')
+    assert len({base, ScoreCache.make_key('other', 'template', 'query', 'doc'), ScoreCache.make_key('model', 'other', 'query', 'doc'),
+                ScoreCache.make_key('model', 'template', 'other', 'doc'), ScoreCache.make_key('model', 'template', 'query', 'other')}) == 5
+
+def test_expired_scores_miss(path):
+    cache = ScoreCache(path, ttl_seconds=-1, max_entries=10)
+    cache.put('key', 0.5)
+    assert cache.get('key') is None
+
+def test_evicts_least_recently_accessed(path, monkeypatch):
+    monkeypatch.setattr(ScoreCache, 'EVICT_EVERY', 3)
+    cache = ScoreCache(path, ttl_seconds=60, max_entries=2)
+    cache.put('a', 0.1)
+    cache.put('b', 0.2)
+    cache.get('a')
+    cache.put('c', 0.3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 0.1
+    assert cache.get('c') == 0.3
+
+def test_stats_are_shared_between_instances(path):
+    first = ScoreCache(path, ttl_seconds=60, max_entries=10)
+    second = ScoreCache(path, ttl_seconds=60, max_entries=10)
+    first.put('key', 0.5)
+    first.get('key')
+    first.get('missing')
+    first.flush_stats()
+    second.get('key')
+    assert second.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3}
+    assert first.stats()['hits'] == 2
@@ -0,0 +1,35 @@
+import pytest
+from src import segment_processing
+from src.score_cache import ScoreCache
+from src.single_flight import SingleFlight
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ScoreCache(str(tmp_path / 'scores.sqlite'), ttl_seconds=60, max_entries=10)
+    monkeypatch.setattr(segment_processing, 'score_cache', cache)
+    monkeypatch.setattr(segment_processing, 'relevance_flight', SingleFlight('test'))
+    return cache
+
+def key(doc):
+    return ScoreCache.make_key(segment_processing.RERANKER_MODEL, segment_processing.RERANK_PROMPT, 'query', doc)
+
+def test_parse_relevance_score():
+    assert segment_processing.parse_relevance_score('Score: 85') == 0.85
+    assert segment_processing.parse_relevance_score('250') == 1
+    assert segment_processing.parse_relevance_score('No idea') is None
+
+@pytest.mark.parametrize('use_async_clients', [False, True])
+def test_unparseable_scores_are_not_cached(cache, monkeypatch, use_async_clients):
+    replies = {'good': 'Score: 85', 'bad': 'I cannot rate this'}
+
+    async def request_relevance_score_async(query, doc):
+        return segment_processing.parse_relevance_score(replies[doc])
+
+    monkeypatch.setattr(segment_processing, 'USE_ASYNC_CLIENTS', use_async_clients)
+    monkeypatch.setattr(segment_processing, 'request_relevance_score', lambda query, doc: segment_processing.parse_relevance_score(replies[doc]))
+    monkeypatch.setattr(segment_processing, 'request_relevance_score_async', request_relevance_score_async)
+
+    assert segment_processing.gpt_score_relevance('query', 'good') == 0.85
+    assert segment_processing.gpt_score_relevance('query', 'bad') == 0
+    assert cache.get(key('good')) == 0.85
+    assert cache.get(key('bad')) is None
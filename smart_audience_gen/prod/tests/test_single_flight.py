@@ -0,0 +1,174 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from src.single_flight import SingleFlight, canonical_key
+
+def test_canonical_key_ignores_dict_order():
+    assert canonical_key({'a': 1, 'b': [1, 2]}) == canonical_key({'b': [1, 2], 'a': 1})
+    assert canonical_key('openai', [{'role': 'user', 'content': 'hi'}]) != canonical_key('groq', [{'role': 'user', 'content': 'hi'}])
+
+def test_canonical_key_uses_whole_arrays():
+    # str() of a long array elides its middle, which would make these collide
+    first = np.zeros(3000)
+    second = np.zeros(3000)
+    second[1500] = 1
+    assert canonical_key(first) != canonical_key(second)
+    assert canonical_key(first) == canonical_key(first.tolist())
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test')
+    calls = []
+    started = threading.Event()
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        time.sleep(0.2)
+        return value * 2
+
+    with ThreadPoolExecutor(8) as executor:
+        leader = executor.submit(flight.do, 'key', slow, 21)
+        started.wait()
+        waiters = [executor.submit(flight.do, 'key', slow, 21) for _ in range(7)]
+        results = [leader.result()] + [waiter.result() for waiter in waiters]
+
+    assert results == [42] * 8
+    assert calls == [21]
+    assert flight.coalesced == 7
+
+def test_finished_calls_are_not_reused():
+    flight = SingleFlight('test')
+    calls = []
+    for _ in range(3):
+        flight.do('key', calls.append, 1)
+    assert len(calls) == 3
+    assert flight.coalesced == 0
+
+def test_different_keys_run_separately():
+    flight = SingleFlight('test')
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda key: flight.do(key, lambda: (time.sleep(0.05), key)[1]), ['a', 'b', 'c', 'd']))
+    assert results == ['a', 'b', 'c', 'd']
+    assert flight.coalesced == 0
+
+def test_exceptions_reach_every_waiter():
+    flight = SingleFlight('test')
+    calls = []
+    started = threading.Event()
+
+    def failing():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        raise ValueError('failed')
+
+    def call():
+        with pytest.raises(ValueError):
+            flight.do('key', failing)
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(call)
+        started.wait()
+        waiters = [executor.submit(call) for _ in range(3)]
+        for future in [leader] + waiters:
+            future.result()
+    assert len(calls) == 1
+
+class Interrupted(BaseException):
+    pass
+
+def test_waiters_retry_when_the_leader_is_interrupted():
+    flight = SingleFlight('test')
+    calls = []
+    started = threading.Event()
+
+    def interrupted_once():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise Interrupted()
+        return 'ok'
+
+    def call():
+        try:
+            return flight.do('key', interrupted_once)
+        except Interrupted:
+            return 'interrupted'
+
+    with ThreadPoolExecutor(3) as executor:
+        leader = executor.submit(call)
+        started.wait()
+        waiters = [executor.submit(call) for _ in range(2)]
+        assert leader.result() == 'interrupted'
+        assert [waiter.result() for waiter in waiters] == ['ok', 'ok']
+    # One waiter took over as leader and the other joined it
+    assert len(calls) == 2
+
+def test_async_calls_share_one_execution():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[flight.do_async('key', slow) for _ in range(5)])
+
+    assert asyncio.run(main()) == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+
+def test_async_exceptions_reach_every_waiter():
+    flight = SingleFlight('test')
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise KeyError('failed')
+
+    async def main():
+        return await asyncio.gather(*[flight.do_async('key', failing) for _ in range(3)], return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [KeyError] * 3
+
+def test_async_waiter_takes_over_from_a_cancelled_leader():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 'result'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == 'result'
+    assert len(calls) == 2
+
+def test_cancelled_async_waiter_does_not_cancel_the_call():
+    flight = SingleFlight('test')
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return 'result'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == 'result'
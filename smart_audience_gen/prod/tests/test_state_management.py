@@ -0,0 +1,58 @@
+import pytest
+import main
+from src.state_management import StateManager
+
+
+class Rerun(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def state():
+    StateManager.reset()
+    StateManager.update(stage=1, conversation_history=['system'])
+
+
+def test_restore_backup_undoes_the_last_update():
+    StateManager.update(optimization_strategy='ctr')
+    StateManager.update(stage=2)
+    StateManager.restore_backup()
+    assert (StateManager.get('stage'), StateManager.get('optimization_strategy')) == (1, 'ctr')
+
+
+def test_restore_version_undoes_every_later_update():
+    version = StateManager.version()
+    StateManager.update(optimization_strategy='ctr')
+    StateManager.update(stage=2)
+    assert StateManager.restore_version(version)
+    assert StateManager.get('stage') == 1
+    assert StateManager.get('optimization_strategy') != 'ctr'
+
+
+def test_updates_to_unjournaled_keys_add_no_history():
+    version = StateManager.version()
+    StateManager.update(last_feedback='more travel')
+    assert StateManager.version() == version
+
+
+def test_failed_feedback_keeps_earlier_updates(monkeypatch):
+    StateManager.update(optimization_strategy='ctr')
+    history = StateManager.get('conversation_history')
+
+    def process_user_feedback(feedback, conversation_history):
+        conversation_history.append(feedback)
+        raise ValueError('boom')
+
+    def rerun():
+        raise Rerun
+
+    monkeypatch.setattr(main, 'handle_segment_selection', lambda audience_json: None)
+    monkeypatch.setattr(main, 'render_user_feedback', lambda: 'more travel')
+    monkeypatch.setattr(main, 'process_user_feedback', process_user_feedback)
+    monkeypatch.setattr(main.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(main.st, 'rerun', rerun)
+    with pytest.raises(Rerun):
+        main.handle_audience_edits()
+
+    assert (StateManager.get('stage'), StateManager.get('optimization_strategy')) == (1, 'ctr')
+    assert StateManager.get('conversation_history') == history == ['system']
@@ -0,0 +1,22 @@
+from src.tracing import span, take_trace, adopt_spans, recent_traces
+
+def test_worker_trace_is_adopted_under_the_current_span():
+    with span('job', job_id='worker-trace') as job:
+        with span('search'):
+            pass
+    worker_spans = take_trace(job.trace_id)
+    assert [s['name'] for s in worker_spans] == ['search', 'job']
+    assert take_trace(job.trace_id) == []
+
+    with span('run', session_id='adopting-session') as run:
+        adopt_spans(worker_spans)
+    [trace] = recent_traces(session_id='adopting-session')
+    by_name = {s['name']: s for s in trace}
+    assert {s['trace_id'] for s in trace} == {run.trace_id}
+    assert by_name['job']['parent_id'] == run.span_id
+    assert by_name['search']['parent_id'] == by_name['job']['span_id']
+    assert by_name['run']['parent_id'] is None
+
+def test_adopting_without_a_current_span_is_a_no_op():
+    adopt_spans([{'name': 'job', 'trace_id': 't', 'span_id': 's', 'parent_id': None}])
+    assert not [spans for spans in recent_traces() if any(s['trace_id'] == 't' for s in spans)]